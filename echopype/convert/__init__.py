@@ -8,4 +8,5 @@ The current version supports:
 """
 from .convert import Convert
 from .ek60 import ConvertEK60
-from .azfp import ConvertAZFP
\ No newline at end of file
+from .azfp import ConvertAZFP
+from .benchmark import benchmark_codecs
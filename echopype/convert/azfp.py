@@ -30,6 +30,11 @@ class ConvertAZFP(ConvertBase):
         self.loadAZFPxml()
 
         # Initialize variables that'll be filled later
+        self._reset_storage()
+
+    def _reset_storage(self):
+        """Initialize file parsing storage variables.
+        """
         self.unpacked_data = None
         self._checked_unique = False
 
@@ -355,7 +360,8 @@ class ConvertAZFP(ConvertBase):
                                 ).replace(tzinfo=timezone.utc).timestamp())
         return ping_time
 
-    def save(self, file_format, save_path=None, combine_opt=False, overwrite=False, compress=True):
+    def save(self, file_format, save_path=None, combine_opt=False, overwrite=False, compress=True,
+             pack_data=False, n_workers=1, ragged=False, chunks=None, types=None):
         """Save data from raw 01A format to a netCDF4 or Zarr file
 
         Parameters
@@ -371,9 +377,28 @@ class ConvertAZFP(ConvertBase):
             Raises error if combine_opt is true and there is only one file being converted.
         overwrite : bool
             Whether or not to overwrite the file if the output path already exists.
-        compress : bool
-            Whether or not to compress backscatter data. Defaults to `True`
+        compress : bool, str or dict
+            Whether or not to compress backscatter data, or the codec profile or encoding of each
+            variable to compress it with, see ``ConvertBase.raw2nc()``. Defaults to `True`
+        pack_data : bool
+            Not supported for AZFP data, which are already stored as integer counts
+        n_workers : int
+            Number of worker processes converting files in parallel when not combining files.
+            See ``ConvertBase._save_parallel()``. Defaults to 1
+        ragged : bool
+            Whether or not to store backscatter data as a CF contiguous ragged array, see ``ConvertBase.raw2nc()``.
+            Defaults to `False`
+        chunks : dict
+            Chunk size of backscatter data along each dimension, see ``ConvertBase.raw2nc()``.
+            Defaults to chunks aligned to the tiles of MVBS and noise estimation
+        types : list of str
+            Not supported for AZFP data, which do not have datagram types
         """
+        if pack_data:
+            raise ValueError("Packing backscatter data is only supported for EK60 data")
+        if types is not None:
+            raise ValueError("Filtering datagram types is only supported for EK60 data")
+        chunks = self._get_chunks(chunks)
 
         # Subfunctions to set various dictionaries
         def export(file_idx=None):
@@ -465,6 +490,8 @@ class ConvertAZFP(ConvertBase):
                 else:
                     raise ValueError("dig_rate and range_samples not unique across frequencies")
 
+                # Number of counts along the range dimension of each channel
+                sample_count = np.array([np.shape(n)[1] for n in N])
                 # Largest number of counts along the range dimension among the different channels
                 longest_range_bin = np.max(self.unpacked_data['num_bins'])
                 range_bin = np.arange(longest_range_bin)
@@ -484,6 +511,7 @@ class ConvertAZFP(ConvertBase):
                 beam_dict['frequency'] = freq
                 beam_dict['ping_time'] = ping_time
                 beam_dict['range_bin'] = range_bin
+                beam_dict['sample_count'] = sample_count
 
                 beam_dict['backscatter_r'] = N                                   # dim: freq x ping_time x range_bin
                 beam_dict['gain_correction'] = self.parameters['gain']           # dim: freq
@@ -578,17 +606,18 @@ class ConvertAZFP(ConvertBase):
                 raw_file = [self.filename[file_idx]]
 
             # Check if nc file already exists and deletes it if overwrite is true
-            if os.path.exists(out_file) and overwrite:
+            if self._output_exists(out_file) and overwrite:
                 print("          overwriting: " + out_file)
-                os.remove(out_file)
+                self._remove_output(out_file)
             # Check if nc file already exists
             # ... if yes, abort conversion and issue warning
             # ... if not, continue with conversion
-            if os.path.exists(out_file):
+            if self._output_exists(out_file):
                 print(f'          ... this file has already been converted to {file_format}, conversion not executed.')
             else:
                 # Create SetGroups object
-                grp = SetGroups(file_path=out_file, echo_type='AZFP', compress=compress)
+                grp = SetGroups(file_path=out_file, echo_type='AZFP', compress=compress, ragged=ragged,
+                                chunks=chunks)
                 grp.set_toplevel(_set_toplevel_dict())      # top-level group
                 grp.set_env(_set_env_dict())                # environment group
                 grp.set_provenance(raw_file, _set_prov_dict())        # provenance group
@@ -596,6 +625,12 @@ class ConvertAZFP(ConvertBase):
                 grp.set_sonar(_set_sonar_dict())            # sonar group
                 grp.set_beam(_set_beam_dict())              # beam group
                 grp.set_vendor_specific(_set_vendor_specific_dict())    # AZFP Vendor specific group
+                self._write_groups(grp)                     # write all groups to the file at once
+
+        if n_workers > 1 and len(self.filename) > 1 and not combine_opt:
+            self._save_parallel(file_format, save_path, n_workers, overwrite=overwrite, compress=compress,
+                                ragged=ragged, chunks=chunks)
+            return
 
         self.validate_path(save_path, file_format, combine_opt)
         if len(self.filename) == 1 or combine_opt:
@@ -603,7 +638,6 @@ class ConvertAZFP(ConvertBase):
         else:
             for file_seq, file in enumerate(self.filename):
                 if file_seq > 0:
-                    self._checked_unique = False
-                    self.unpacked_data = None
+                    self._reset_storage()
                 self.parse_raw([file])
                 export(file_seq)
@@ -0,0 +1,90 @@
+"""
+Functions to compare the compression codec profiles of converted files.
+"""
+import os
+import glob
+import shutil
+import tempfile
+import time
+import xarray as xr
+
+from echopype.convert.convert import Convert
+from echopype.convert.ek60 import ConvertEK60
+from echopype.convert.utils.set_groups_base import CODEC_PROFILES
+
+
+def benchmark_codecs(raw_file, xml_path='', file_formats=('.nc', '.zarr'), profiles=None, save_dir=None):
+    """Convert a raw file with each codec profile and measure the size and speed of the outputs.
+
+    The raw file is parsed once and then saved with each codec profile in each output file format.
+    Throughputs are in MB of decoded Beam group data per second. The write throughput includes
+    writing all groups of the file, and the read throughput is that of loading the Beam group.
+
+    Parameters
+    ----------
+    raw_file : str
+        path to a sample EK60 ``.raw`` or AZFP ``.01A`` file
+    xml_path : str
+        path to the XML file of AZFP data
+    file_formats : list of str
+        output file formats to compare. Defaults to netCDF and Zarr
+    profiles : list
+        values of ``compress`` to compare, see ``ConvertBase.raw2nc()``.
+        Defaults to no compression and each codec profile in ``CODEC_PROFILES``
+    save_dir : str
+        directory in which the outputs are written and removed afterwards.
+        If `None`, a temporary directory is used
+
+    Returns
+    -------
+    List of dictionaries with the file format, codec profile, bytes on disk,
+    write throughput and read throughput of each output
+    """
+    profiles = [False] + list(CODEC_PROFILES) if profiles is None else profiles
+    converter = Convert(raw_file, xml_path)
+    if isinstance(converter, ConvertEK60):
+        converter.load_ek60_raw(converter.filename)
+    else:
+        converter.parse_raw(converter.filename)
+
+    work_dir = tempfile.mkdtemp(dir=save_dir)
+    results = []
+    try:
+        for file_format in file_formats:
+            for n, profile in enumerate(profiles):
+                out_dir = os.path.join(work_dir, 'profile%02d' % n)
+                start = time.perf_counter()
+                converter.save(file_format, out_dir, compress=profile)
+                write_time = time.perf_counter() - start
+
+                # Outputs of files with several range_bin groups are split into parts
+                out_paths = sorted(glob.glob(os.path.join(out_dir, '*' + file_format)))
+                start = time.perf_counter()
+                n_bytes = 0
+                for out_path in out_paths:
+                    with xr.open_dataset(out_path, group='Beam',
+                                         engine='zarr' if file_format == '.zarr' else 'netcdf4') as ds_beam:
+                        n_bytes += ds_beam.load().nbytes
+                read_time = time.perf_counter() - start
+
+                results.append({'file_format': file_format,
+                                'profile': profile if isinstance(profile, (bool, str)) else 'custom',
+                                'bytes_on_disk': sum(_get_size(x) for x in out_paths),
+                                'write_MBps': n_bytes / 1e6 / write_time,
+                                'read_MBps': n_bytes / 1e6 / read_time})
+    finally:
+        shutil.rmtree(work_dir)
+
+    print('%-8s%-10s%16s%14s%14s' % ('format', 'profile', 'bytes on disk', 'write MB/s', 'read MB/s'))
+    for x in results:
+        print('%-8s%-10s%16d%14.1f%14.1f' % (x['file_format'], x['profile'], x['bytes_on_disk'],
+                                             x['write_MBps'], x['read_MBps']))
+    return results
+
+
+def _get_size(path):
+    """Get the size in bytes of a file, or of all files in a directory such as a zarr store.
+    """
+    if os.path.isdir(path):
+        return sum(os.path.getsize(os.path.join(root, f)) for root, _, files in os.walk(path) for f in files)
+    return os.path.getsize(path)
@@ -1,4 +1,14 @@
 import os
+import copy
+import shutil
+import traceback
+import numpy as np
+from datetime import datetime as dt
+from concurrent.futures import ProcessPoolExecutor
+from echopype.model.modelbase import MVBS_PING_SIZE, NOISE_EST_PING_SIZE
+
+# Approximate number of pings in a chunk of the Beam group, see ConvertBase._get_chunks()
+CHUNK_PING_SIZE = 1000
 
 
 class ConvertBase:
@@ -13,6 +23,13 @@ class ConvertBase:
         self.nc_path = None
         self.zarr_path = None
         self.save_path = None
+        self.conversion_errors = {}   # traceback of each file that failed in a parallel conversion
+        self._datasets = None   # groups of each output file kept in memory by to_datasets() instead of saved
+
+        # Number of pings per tile of MVBS and noise estimation in the model,
+        # to which the default chunks of the Beam group are aligned
+        self.MVBS_ping_size = MVBS_PING_SIZE
+        self.noise_est_ping_size = NOISE_EST_PING_SIZE
 
     @property
     def platform_name(self):
@@ -126,7 +143,8 @@ class ConvertBase:
             self.nc_path = self.nc_path[0]
             self.zarr_path = self.zarr_path[0]
 
-    def raw2nc(self, save_path=None, combine_opt=False, overwrite=False, compress=True):
+    def raw2nc(self, save_path=None, combine_opt=False, overwrite=False, compress=True, pack_data=False,
+               n_workers=1, ragged=False, chunks=None, types=None):
         """Wrapper for saving to netCDF.
 
         Parameters
@@ -140,12 +158,36 @@ class ConvertBase:
             Raises error if combine_opt is true and there is only one file being converted.
         overwrite : bool
             Whether or not to overwrite the file if the output path already exists.
-        compress : bool
-            Whether or not to compress backscatter data. Defaults to `True`
+        compress : bool, str or dict
+            Whether or not to compress backscatter data, or how: the name of a codec profile
+            ('fast', 'balanced' or 'archive', see ``CODEC_PROFILES`` in ``set_groups_base``),
+            or a dictionary of the encoding of each variable of the Beam group in the output
+            file format. `True` uses the 'balanced' profile. Defaults to `True`
+        pack_data : bool
+            Whether or not to store backscatter data as integers packed with a CF ``scale_factor``
+            instead of floats. Only supported for EK60 data. Defaults to `False`
+        n_workers : int
+            Number of worker processes converting files in parallel when not combining files.
+            Defaults to 1
+        ragged : bool
+            Whether or not to store backscatter data as a CF contiguous ragged array with a ``sample_count``
+            variable, which keeps each frequency channel at its own number of range_bin instead of
+            padding shorter channels with NaN. Defaults to `False`
+        chunks : dict
+            Chunk size of the backscatter data in the Beam group along each dimension, for example
+            ``{'frequency': 1, 'ping_time': 1000, 'range_bin': -1}``. A size of -1, or a dimension
+            that is not listed, spans the whole dimension. If `None`, chunks hold one frequency channel
+            and all range_bin of a number of pings that is a multiple of ``self.MVBS_ping_size``
+            and ``self.noise_est_ping_size``, see ``ConvertBase._get_chunks()``
+        types : list of str
+            Datagram types to convert, e.g. ``['NME']`` for navigation only, see
+            ``ConvertEK60.load_ek60_raw()``. Only supported for EK60 data. Defaults to all datagrams
         """
-        self.save(".nc", save_path, combine_opt, overwrite, compress)
+        self.save(".nc", save_path, combine_opt, overwrite, compress, pack_data=pack_data, n_workers=n_workers,
+                  ragged=ragged, chunks=chunks, types=types)
 
-    def raw2zarr(self, save_path=None, combine_opt=False, overwrite=False, compress=True):
+    def raw2zarr(self, save_path=None, combine_opt=False, overwrite=False, compress=True, pack_data=False,
+                 n_workers=1, ragged=False, chunks=None, types=None):
         """Wrapper for saving to zarr.
 
         Parameters
@@ -159,12 +201,177 @@ class ConvertBase:
             Raises error if combine_opt is true and there is only one file being converted.
         overwrite : bool
             Whether or not to overwrite the file if the output path already exists.
-        compress : bool
-            Whether or not to compress backscatter data. Defaults to `True`
+        compress : bool, str or dict
+            Whether or not to compress backscatter data, or how: the name of a codec profile
+            ('fast', 'balanced' or 'archive', see ``CODEC_PROFILES`` in ``set_groups_base``),
+            or a dictionary of the encoding of each variable of the Beam group in the output
+            file format. `True` uses the 'balanced' profile. Defaults to `True`
+        pack_data : bool
+            Whether or not to store backscatter data as integers packed with a CF ``scale_factor``
+            instead of floats. Only supported for EK60 data. Defaults to `False`
+        n_workers : int
+            Number of worker processes converting files in parallel when not combining files.
+            Defaults to 1
+        ragged : bool
+            Whether or not to store backscatter data as a CF contiguous ragged array with a ``sample_count``
+            variable, which keeps each frequency channel at its own number of range_bin instead of
+            padding shorter channels with NaN. Defaults to `False`
+        chunks : dict
+            Chunk size of the backscatter data in the Beam group along each dimension, for example
+            ``{'frequency': 1, 'ping_time': 1000, 'range_bin': -1}``. A size of -1, or a dimension
+            that is not listed, spans the whole dimension. If `None`, chunks hold one frequency channel
+            and all range_bin of a number of pings that is a multiple of ``self.MVBS_ping_size``
+            and ``self.noise_est_ping_size``, see ``ConvertBase._get_chunks()``
+        types : list of str
+            Datagram types to convert, e.g. ``['NME']`` for navigation only, see
+            ``ConvertEK60.load_ek60_raw()``. Only supported for EK60 data. Defaults to all datagrams
         """
-        self.save(".zarr", save_path, combine_opt, overwrite, compress)
+        self.save(".zarr", save_path, combine_opt, overwrite, compress, pack_data=pack_data, n_workers=n_workers,
+                  ragged=ragged, chunks=chunks, types=types)
+
+    def to_datasets(self, ragged=False):
+        """Convert the raw files to in-memory xarray Datasets without writing any file.
+
+        Parameters
+        ----------
+        ragged : bool
+            Whether or not to keep backscatter data as a CF contiguous ragged array,
+            see ``ConvertBase.raw2nc()``. Defaults to `False`
 
-    def save(self, param, save_path, combine_opt, overwrite, compress):
+        Returns
+        -------
+        Dictionary of the Dataset of each group of the converted data, keyed by the group path
+        ('Toplevel', 'Environment', 'Platform', 'Platform/NMEA', 'Beam', 'Sonar', 'Provenance',
+        and 'Vendor' for AZFP), which can be passed to ``echopype.model.EchoData``.
+        A list of such dictionaries if several raw files are converted, or if EK60 pings
+        with different numbers of range_bin are split into parts.
+        """
+        self._datasets = {}
+        try:
+            self.save('.nc', compress=False, ragged=ragged)
+            datasets = list(self._datasets.values())
+        finally:
+            self._datasets = None
+        return datasets[0] if len(datasets) == 1 else datasets
+
+    def save(self, param, save_path, combine_opt, overwrite, compress, pack_data=False, n_workers=1,
+             ragged=False, chunks=None, types=None):
         """Wrapper for saving functions.
         """
         pass
+
+    def _output_exists(self, path):
+        """Whether an output file already exists. Never the case when converting to in-memory Datasets.
+        """
+        return self._datasets is None and os.path.exists(path)
+
+    @staticmethod
+    def _remove_output(path):
+        """Remove an output netCDF file or zarr store before overwriting it.
+        """
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        else:
+            os.remove(path)
+
+    def _write_groups(self, grp):
+        """Write the groups collected by a ``SetGroups`` object to their files,
+        or keep them in memory if converting with ``to_datasets()``.
+        """
+        if self._datasets is None:
+            grp.flush()
+        else:
+            self._datasets.update(grp.to_datasets())
+
+    def _get_chunks(self, chunks=None):
+        """Get the chunk size of the backscatter data along each dimension of the Beam group.
+
+        By default, chunks hold one frequency channel and all range_bin of a number of pings
+        close to ``CHUNK_PING_SIZE``. This number is a multiple of both ``self.MVBS_ping_size``
+        and ``self.noise_est_ping_size``, so that each tile of MVBS and noise estimation is
+        read from a single chunk.
+
+        Parameters
+        ----------
+        chunks : dict
+            chunk size along each dimension, -1 for the whole dimension. If `None`, the default chunks.
+
+        Returns
+        -------
+        Dictionary of the chunk size along each dimension
+        """
+        if chunks is None:
+            tile_size = int(np.lcm(self.MVBS_ping_size, self.noise_est_ping_size))
+            chunks = {'frequency': 1,
+                      'ping_time': tile_size * max(1, round(CHUNK_PING_SIZE / tile_size)),
+                      'range_bin': -1}
+        for dim, size in chunks.items():
+            if not isinstance(size, (int, np.integer)) or (size < 1 and size != -1):
+                raise ValueError("The chunk size of %s must be a positive integer or -1" % dim)
+        return dict(chunks)
+
+    def _reset_storage(self):
+        """Clear the parsed data so that another file can be parsed.
+        """
+        pass
+
+    def _save_parallel(self, file_format, save_path, n_workers, **kwargs):
+        """Convert each file in ``self.filename`` to its own output file in a pool of worker processes.
+
+        Each file is converted by a copy of this object, which keeps the parsing options and
+        platform attributes. An error converting one file does not stop the conversion of the
+        others. The traceback of each failed file is stored in ``self.conversion_errors``
+        and a summary of the conversion is printed.
+
+        Parameters
+        ----------
+        file_format : str
+            format of output file. ".nc" for netCDF4 or ".zarr" for Zarr
+        save_path : str
+            Directory to save output files to. If `None`, outputs in the same location as the input raw files.
+        n_workers : int
+            number of worker processes
+        kwargs
+            other arguments passed on to ``self.save()`` for each file
+        """
+        self.validate_path(save_path, file_format, combine_opt=False)
+        out_paths = self.save_path
+
+        converters = []
+        for file in self.filename:
+            converter = copy.copy(self)
+            converter.filename = file
+            converter._reset_storage()
+            converters.append(converter)
+
+        self.conversion_errors = {}
+        with ProcessPoolExecutor(max_workers=min(n_workers, len(converters))) as executor:
+            futures = [executor.submit(_save_file, converter, file_format, out_path, kwargs)
+                       for converter, out_path in zip(converters, out_paths)]
+            for file, future in zip(self.filename, futures):
+                try:
+                    error = future.result()
+                except Exception:   # the worker process died
+                    error = traceback.format_exc()
+                if error is not None:
+                    self.conversion_errors[file] = error
+
+        print('%s  converted %d of %d files' % (dt.now().strftime('%H:%M:%S'),
+                                                len(self.filename) - len(self.conversion_errors),
+                                                len(self.filename)))
+        for file, error in self.conversion_errors.items():
+            print('          failed: %s\n%s' % (file, error))
+
+
+def _save_file(converter, file_format, save_path, kwargs):
+    """Convert one file in a worker process of ``ConvertBase._save_parallel()``.
+
+    Returns
+    -------
+    `None` if the file was converted, otherwise the traceback of the error
+    """
+    try:
+        converter.save(file_format, save_path, **kwargs)
+    except Exception:
+        return traceback.format_exc()
+    return None
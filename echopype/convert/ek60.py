@@ -4,15 +4,18 @@ Functions to unpack Simrad EK60 .raw data file and save to .nc.
 
 
 import os
-import shutil
+import tempfile
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
 from datetime import datetime as dt
 import pytz
-import pynmea2
 
 from echopype.convert.utils.ek60_raw_io import RawSimradFile, SimradEOF
+from echopype.convert.utils.ek60_raw_index import RawDatagramIndex
+from echopype.convert.utils.ek60_date_conversion import nt_to_datetime64
 from echopype.convert.utils.nmea_data import NMEAData
+from echopype.convert.utils.ek60_ping_data import PingDataColumns
 from echopype.convert.utils.set_groups import SetGroups
 from echopype._version import get_versions
 from .convertbase import ConvertBase
@@ -26,14 +29,57 @@ INDEX2POWER = (10.0 * np.log10(2.0) / 256.0)
 # Create a constant to convert from indexed angles to electrical angles.
 INDEX2ELEC = 180.0 / 128.0
 
+# Byte offset of the sample count in a RAW datagram, from its leading length field
+_RAW_COUNT_OFFSET = 84
+
+# Fill value of indexed angles for padding and for channels without angle data.
+# Angles are stored as int16 so that the fill value is outside the int8 range of
+# the indices recorded in RAW datagrams, including the -128 phase wrap index.
+ANGLE_FILL_VALUE = np.int16(-32768)
+
+# Fill value of power indices kept as int16 for saving with pack_data, for padding
+POWER_FILL_VALUE = np.int16(-32768)
+
 
 class ConvertEK60(ConvertBase):
     """Class for converting EK60 .raw files."""
+
+    # ping-by-ping channel metadata stored from RAW datagrams
+    ping_data_fields = ['mode', 'transducer_depth', 'transmit_power', 'pulse_length', 'bandwidth',
+                        'sample_interval', 'sound_velocity', 'absorption_coefficient',
+                        'heave', 'roll', 'pitch', 'temperature', 'heading']
+
     def __init__(self, _filename=''):
         ConvertBase.__init__(self)
         self.filename = _filename  # path to EK60 .raw filename to be parsed
 
-        # Initialize file parsing storage variables
+        # Parsing options
+        self.use_mmap = False   # memory-map .raw files and decode samples as views into the mapping
+        self.batch_decode = False   # decode RAW headers of a whole file at once using the datagram index
+        self.parse_workers = 1   # number of worker processes parsing ping-aligned parts of each file
+        self.preallocate = False   # decode samples directly into preallocated data cubes, see _fill_range_group()
+        self.scratch_dir = None   # directory for memory-mapped scratch files holding the preallocated cubes
+        self.max_pings_in_memory = None   # parse and save files in blocks of this many pings, see save()
+        self.save_index = False   # save the datagram index of each file as a .idx.npz sidecar reused by later parses
+        self.nmea_window = 60   # seconds of NMEA datagrams around each block interpolated onto its pings, see save()
+
+        # Follow mode state, see follow()
+        self._follow_index = None
+        self._follow_offset = None
+        self._follow_path = None   # path to the first Zarr file
+        self._follow_part = 1   # number of the Zarr file the pings are appended to
+        self._follow_range_len = None   # number of samples of the first channel in this Zarr file
+
+        # NMEA datagrams around the pings of each block interpolated onto them, see _parse_ping_blocks()
+        self._ping_nmea_data = None
+        # range_bin length and first and last ping time of each range_bin group of all blocks
+        self._block_range_groups = None
+
+        self._reset_storage()
+
+    def _reset_storage(self):
+        """Initialize file parsing storage variables.
+        """
         self.config_datagram = None
         self.nmea_data = NMEAData()  # object for NMEA data
         self.ping_data_dict = {}   # dictionary to store metadata
@@ -47,9 +93,24 @@ class ConvertEK60(ConvertBase):
         self.ping_time_split = {}    # dictionaries to store variables of each range_bin groups (if there are multiple)
         self.power_dict_split = {}
         self.angle_dict_split = {}
+        self.sample_count_split = {}   # number of range_bin of each channel in each range_bin group
         self.tx_sig = {}   # dictionary to store transmit signal parameters and sample interval
         self.ping_slices = []
 
+    def _init_channel_storage(self):
+        """Initialize per-channel storage from the configuration datagram.
+        """
+        # metadata columns are typed as in the RAW datagram header, with floats kept in double precision
+        raw_header_dtype = RawSimradFile.DGRAM_TYPE_KEY['RAW'].header_dtype()
+        ping_data_dtype = np.dtype([(field, 'float64' if raw_header_dtype[field].kind == 'f'
+                                     else raw_header_dtype[field].newbyteorder('='))
+                                    for field in self.ping_data_fields])
+        for ch_num in self.config_datagram['transceivers'].keys():
+            self.ping_data_dict[ch_num] = PingDataColumns(
+                ping_data_dtype, frequency=self.config_datagram['transceivers'][ch_num]['frequency'])
+            self.power_dict[ch_num] = []
+            self.angle_dict[ch_num] = []
+
     def _append_channel_ping_data(self, ch_num, datagram):
         """ Append ping-by-ping channel metadata extracted from the newly read datagram of type 'RAW'.
 
@@ -60,21 +121,9 @@ class ConvertEK60(ConvertBase):
         datagram : dict
             the newly read datagram of type 'RAW'
         """
-        self.ping_data_dict[ch_num]['mode'].append(datagram['mode'])
-        self.ping_data_dict[ch_num]['transducer_depth'].append(datagram['transducer_depth'])
-        self.ping_data_dict[ch_num]['transmit_power'].append(datagram['transmit_power'])
-        self.ping_data_dict[ch_num]['pulse_length'].append(datagram['pulse_length'])
-        self.ping_data_dict[ch_num]['bandwidth'].append(datagram['bandwidth'])
-        self.ping_data_dict[ch_num]['sample_interval'].append(datagram['sample_interval'])
-        self.ping_data_dict[ch_num]['sound_velocity'].append(datagram['sound_velocity'])
-        self.ping_data_dict[ch_num]['absorption_coefficient'].append(datagram['absorption_coefficient'])
-        self.ping_data_dict[ch_num]['heave'].append(datagram['heave'])
-        self.ping_data_dict[ch_num]['roll'].append(datagram['roll'])
-        self.ping_data_dict[ch_num]['pitch'].append(datagram['pitch'])
-        self.ping_data_dict[ch_num]['temperature'].append(datagram['temperature'])
-        self.ping_data_dict[ch_num]['heading'].append(datagram['heading'])
-
-    def _read_datagrams(self, fid):
+        self.ping_data_dict[ch_num].append(datagram)
+
+    def _read_datagrams(self, fid, types=None, end_offset=None):
         """
         Read various datagrams until the end of a ``.raw`` file.
 
@@ -85,6 +134,10 @@ class ConvertEK60(ConvertBase):
         ----------
         fid
             a RawSimradFile file object opened in ``self.load_ek60_raw()``
+        types : list of str
+            datagram types to read, see ``self.load_ek60_raw()``
+        end_offset : int
+            byte offset to stop reading at, defaults to the end of the file
         """
         num_datagrams_parsed = 0
         tmp_num_ch_per_ping_parsed = 0  # number of channels of the same ping parsed
@@ -95,13 +148,15 @@ class ConvertEK60(ConvertBase):
 
         while True:
             try:
-                new_datagram = fid.read(1)
+                if end_offset is not None:
+                    if types is not None:
+                        fid._skip_to_type(set(types))
+                    if fid._tell_bytes() >= end_offset:
+                        break
+                new_datagram = fid.read(1, types=types)
             except SimradEOF:
                 break
 
-            # Convert the timestamp to a datetime64 object.
-            new_datagram['timestamp'] = np.datetime64(new_datagram['timestamp'].replace(tzinfo=None), '[ms]')
-
             num_datagrams_parsed += 1
 
             # RAW datagrams store raw acoustic data for a channel
@@ -160,15 +215,246 @@ class ConvertEK60(ConvertBase):
             else:
                 print("Unknown datagram type: " + str(new_datagram['type']))
 
-    def split_by_range_group(self):
+    def _read_datagrams_batch(self, raw_path, types=None):
+        """
+        Read all datagrams following the configuration datagram in a ``.raw`` file in one batch.
+
+        Datagrams are located with the datagram index of the file. The headers of all RAW
+        datagrams are decoded at once into columns, from which complete pings are picked
+        with the same rules as ``self._read_datagrams()``. Power and angle samples are
+        views into a memory map of the file.
+
+        Parameters
+        ----------
+        raw_path : str
+            path to the ``.raw`` file
+        types : list of str
+            datagram types to read, see ``self.load_ek60_raw()``
+        """
+        index = RawDatagramIndex.from_file(raw_path, save_sidecar=self.save_index)
+        records = index.records[1:][index.select(types=types)[1:]]   # skip configuration datagram
+        records = records[records['nt_time'] != 0]   # datagrams w/ timestamp of (0, 0) are skipped
+        dgram_type = records['type'].astype('S3')
+
+        raw_file = np.memmap(raw_path, dtype='u1', mode='r')
+
+        # RAW datagrams: decode headers and pick pings with data from all channels
+        raw_records = records[dgram_type == b'RAW']
+        headers = RawSimradFile.DGRAM_TYPE_KEY['RAW'].unpack_headers(raw_file, raw_records['offset'] + 4)
+        tx_num = self.config_datagram['transceiver_count']
+        channel = headers['channel']
+        seq = np.arange(channel.size)
+        # number of channels of the same ping parsed, counted since the last datagram from the first channel
+        last_reset = np.maximum.accumulate(np.where(channel == 1, seq, -1))
+        num_ch_parsed = np.where(last_reset >= 0, seq - last_reset + 1, seq + 1)
+        ping_end = np.flatnonzero((channel == tx_num) & (num_ch_parsed == tx_num))
+        ping_start = ping_end - tx_num + 1
+
+        # append ping time from first channel
+        self.ping_time.extend(nt_to_datetime64(headers['low_date'][ping_start], headers['high_date'][ping_start]))
+
+        header_size = headers.dtype.itemsize
+        for ch_seq in range(tx_num):
+            rows = ping_start + ch_seq
+            freq_match = headers['frequency'][rows] == self.config_datagram['transceivers'][ch_seq + 1]['frequency']
+            if not np.all(freq_match):
+                raise ValueError('Frequency mismatch for data from channel %d in %s' % (ch_seq + 1, raw_path))
+
+            # ping-by-ping metadata
+            self.ping_data_dict[ch_seq + 1].extend(headers[rows])
+
+            # power and angle data
+            for offset, mode, count in zip(raw_records['offset'][rows] + 4 + header_size,
+                                           headers['mode'][rows], headers['count'][rows]):
+                if count > 0:
+                    if mode & 0x1:
+                        power = raw_file[offset:offset + count * 2].view('<i2')
+                        offset += count * 2
+                    else:
+                        power = None
+                    if mode & 0x2:
+                        angle = raw_file[offset:offset + count * 2].view('i1').reshape((-1, 2))
+                    else:
+                        angle = None
+                else:
+                    power = np.empty((0,), dtype='int16')
+                    angle = np.empty((0,), dtype='int8')
+                self.power_dict[ch_seq + 1].append(power)
+                self.angle_dict[ch_seq + 1].append(angle)
+
+        # NME datagrams store ancillary data as NMEA-0817 style ASCII data.
+        nmea_parser = RawSimradFile.DGRAM_TYPE_KEY['NME']
+        nmea_records = records[dgram_type == b'NME']
+        nmea_times = nt_to_datetime64(nmea_records['nt_time'] & 0xFFFFFFFF, nmea_records['nt_time'] >> 32)
+        for offset, size, nmea_time in zip(nmea_records['offset'], nmea_records['size'], nmea_times):
+            nmea_dgram = nmea_parser.from_string(raw_file[offset + 4:offset + 4 + size].tobytes())
+            self.nmea_data.add_datagram(nmea_time, nmea_dgram['nmea_string'])
+
+        for dgram_type_other in dgram_type[~np.isin(dgram_type, [b'RAW', b'NME'])]:
+            if dgram_type_other in (b'TAG', b'BOT', b'DEP'):
+                print('%s datagram encountered.' % dgram_type_other.decode())
+            else:
+                print("Unknown datagram type: " + dgram_type_other.decode())
+
+    @staticmethod
+    def _ping_start_offsets(records, start_offset):
+        """Return the byte offsets at which a ``.raw`` file can be split between pings.
+
+        These are the offsets of RAW datagrams from the first channel after ``start_offset``
+        that directly follow a valid datagram, so that skipping corrupted data never reads
+        past the end of a byte range.
+
+        Parameters
+        ----------
+        records : np.ndarray
+            records of the datagram index of the file
+        start_offset : int
+            byte offset of the first datagram after the configuration datagram(s)
+        """
+        is_contiguous = np.insert(records['offset'][:-1] + records['size'][:-1] + 8 == records['offset'][1:],
+                                  0, False)
+        is_ping_start = (records['type'].astype('S3') == b'RAW') & (records['channel'] == 1) & \
+                        (records['offset'] > start_offset) & is_contiguous
+        return records['offset'][is_ping_start]
+
+    @staticmethod
+    def _ping_sample_counts(raw_path, records):
+        """Return the time and number of samples of each ping, read from the RAW datagram
+        headers of the first channel without decoding the datagrams.
+
+        Parameters
+        ----------
+        raw_path : str
+            path to the ``.raw`` file
+        records : np.ndarray
+            records of the datagram index of the file
+        """
+        ping_records = records[(records['type'].astype('S3') == b'RAW') & (records['channel'] == 1)]
+        ping_time = nt_to_datetime64(ping_records['nt_time'] & 0xFFFFFFFF, ping_records['nt_time'] >> 32)
+        if ping_records.size == 0:
+            return ping_time, np.empty(0, dtype='int32')
+        raw_bytes = np.memmap(raw_path, dtype='u1', mode='r')
+        pos = ping_records['offset'] + _RAW_COUNT_OFFSET
+        sample_count = raw_bytes[pos[:, None] + np.arange(4)].view('<i4').ravel()
+        return ping_time, sample_count
+
+    def _read_datagrams_parallel(self, raw_path, start_offset, types=None):
+        """
+        Read all datagrams from ``start_offset`` to the end of a ``.raw`` file
+        in ``self.parse_workers`` worker processes.
+
+        The file is split into contiguous byte ranges of about equal size, each
+        starting at a RAW datagram from the first channel, so that no ping is split
+        between ranges. Each range is parsed with ``self._read_datagrams()`` in a worker,
+        and the results are concatenated in file order.
+
+        Parameters
+        ----------
+        raw_path : str
+            path to the ``.raw`` file
+        start_offset : int
+            byte offset of the first datagram after the configuration datagram(s)
+        types : list of str
+            datagram types to read, see ``self.load_ek60_raw()``
+        """
+        index = RawDatagramIndex.from_file(raw_path, save_sidecar=self.save_index)
+        ping_starts = self._ping_start_offsets(index.records, start_offset)
+
+        end_offset = index.end_offset
+        targets = np.linspace(start_offset, end_offset, self.parse_workers + 1)[1:-1]
+        splits = np.unique(ping_starts[np.minimum(np.searchsorted(ping_starts, targets),
+                                                  ping_starts.size - 1)]) if ping_starts.size else []
+        bounds = [start_offset] + [int(x) for x in splits] + [end_offset]
+
+        n_ranges = len(bounds) - 1
+        with ProcessPoolExecutor(max_workers=min(self.parse_workers, n_ranges)) as executor:
+            results = executor.map(_parse_raw_range,
+                                   [raw_path] * n_ranges, [self.config_datagram] * n_ranges,
+                                   bounds[:-1], bounds[1:],
+                                   [self.use_mmap] * n_ranges, [types] * n_ranges)
+            for ping_time, ping_data_dict, power_dict, angle_dict, nmea_times, nmea_strings in results:
+                self.ping_time.extend(ping_time)
+                for ch_num in self.config_datagram['transceivers'].keys():
+                    self.ping_data_dict[ch_num].extend(ping_data_dict[ch_num])
+                    self.power_dict[ch_num].extend(power_dict[ch_num])
+                    self.angle_dict[ch_num].extend(angle_dict[ch_num])
+                for nmea_time, nmea_string in zip(nmea_times, nmea_strings):
+                    self.nmea_data.add_datagram(nmea_time, nmea_string)
+
+    def _allocate_cube(self, shape, dtype='float64', fill_value=np.nan):
+        """Allocate a data cube filled with ``fill_value``, in a scratch file if ``self.scratch_dir`` is set.
+        """
+        if self.scratch_dir is None:
+            cube = np.empty(shape, dtype=dtype)
+        else:
+            # the scratch file is deleted as soon as the cube is no longer referenced
+            cube = np.memmap(tempfile.TemporaryFile(dir=self.scratch_dir), dtype=dtype, mode='w+', shape=shape)
+        cube[:] = fill_value
+        return cube
+
+    def _fill_range_group(self, ping_start, ping_end, range_bin_len, has_angle, pack_data=False):
+        """Decode the samples of the pings of one range_bin group into preallocated data cubes.
+
+        Unlike the stacking, conversion and padding done in ``self.split_by_range_group()``,
+        each ping is written into its place in the output cubes without intermediate copies.
+        With batch decoding the per-ping samples are views into the ``.raw`` file, so the
+        memory needed is close to the size of the output.
+
+        Parameters
+        ----------
+        ping_start, ping_end : int
+            range of the pings of the range_bin group
+        range_bin_len : int
+            length of the range_bin dimension of the group
+        has_angle : np.ndarray
+            whether to store angle data of each channel
+        pack_data : bool
+            whether to keep power as int16 indices, see ``self.split_by_range_group()``
+
+        Returns
+        -------
+        power data cube of dimensions [frequency x ping_time x range_bin] and
+        int16 angle data cube of dimensions [frequency x ping_time x range_bin x 2]
+        """
+        n_ch = len(self.power_dict)
+        if pack_data:
+            power = self._allocate_cube((n_ch, ping_end - ping_start, range_bin_len),
+                                        dtype='int16', fill_value=POWER_FILL_VALUE)
+        else:
+            power = self._allocate_cube((n_ch, ping_end - ping_start, range_bin_len))
+        angle = self._allocate_cube((n_ch, ping_end - ping_start, range_bin_len, 2),
+                                    dtype='int16', fill_value=ANGLE_FILL_VALUE)
+        for ch_seq, ch_num in enumerate(self.power_dict.keys()):
+            for ping_seq, ping_power in enumerate(self.power_dict[ch_num][ping_start:ping_end]):
+                if ping_power is not None and pack_data:
+                    power[ch_seq, ping_seq, :len(ping_power)] = ping_power
+                elif ping_power is not None:
+                    np.multiply(ping_power, INDEX2POWER, out=power[ch_seq, ping_seq, :len(ping_power)])
+            if has_angle[ch_seq]:
+                for ping_seq, ping_angle in enumerate(self.angle_dict[ch_num][ping_start:ping_end]):
+                    if ping_angle is not None:
+                        angle[ch_seq, ping_seq, :len(ping_angle)] = ping_angle
+        return power, angle
+
+    def split_by_range_group(self, pack_data=False):
         """Split ping_time, power_dict, angle_dict, tx_sig by range_group.
 
         This is to deal with cases when there is a switch of range_bin size in the middle of the file.
+        Angles are kept as int16 indices, with ``ANGLE_FILL_VALUE`` for padding and for single-beam channels.
+
+        Parameters
+        ----------
+        pack_data : bool
+            Whether to keep power as the int16 indices of the RAW datagrams, with ``POWER_FILL_VALUE``
+            for padding, to save with ``pack_data`` without converting to dB. Defaults to `False`
         """
         # Find out the number of range_bin groups in power data
         # since there are files with a clear switch of length of range_bin in the middle
         range_bin_lens = [len(l) for l in self.power_dict[1]]
-        uni, uni_inv, uni_cnt = np.unique(range_bin_lens, return_inverse=True, return_counts=True)
+        uni, uni_idx, uni_cnt = np.unique(range_bin_lens, return_index=True, return_counts=True)
+        # order range_bin groups as they appear in the pings, which are sliced in that order below
+        order = np.argsort(uni_idx)
+        uni, uni_cnt = uni[order], uni_cnt[order]
 
         # Initialize dictionaries. keys are index for ranges. values are dictionaries with keys for each freq
         uni_cnt_insert = np.cumsum(np.insert(uni_cnt, 0, 0))
@@ -178,32 +464,38 @@ class ConvertEK60(ConvertBase):
                                                                          uni_cnt_insert[range_group+1]]
             range_bin_freq_lens = np.unique(
                 [x_val[uni_cnt_insert[range_group]].shape for x_val in self.power_dict.values()])
-            self.angle_dict_split[range_group] = np.empty(
-                (len(self.power_dict), uni_cnt_insert[range_group + 1] - uni_cnt_insert[range_group],
-                 range_bin_freq_lens.max(), 2))
-            self.angle_dict_split[range_group][:] = np.nan
-            if len(range_bin_freq_lens) != 1:  # different frequency channels have different range_bin lengths
-                tmp_power_pad, tmp_angle_pad = [], []
-                for x_p, x_a in zip(self.power_dict.values(), self.angle_dict.values()):  # pad nan to shorter channels
-                    tmp_p_data = np.array(x_p[uni_cnt_insert[range_group]:uni_cnt_insert[range_group + 1]])
-                    tmp_a_data = np.array(x_a[uni_cnt_insert[range_group]:uni_cnt_insert[range_group + 1]])
-                    tmp_power = np.pad(tmp_p_data.astype('float64'),
-                                       ((0, 0), (0, range_bin_freq_lens.max()-tmp_p_data.shape[1])),
-                                       mode='constant', constant_values=(np.nan,))
-                    tmp_angle = np.pad(tmp_a_data.astype('float64'),
-                                       ((0, 0), (0, range_bin_freq_lens.max()-tmp_a_data.shape[1]), (0, 0)),
-                                       mode='constant', constant_values=(np.nan,))
-                    tmp_power_pad.append(tmp_power)
-                    tmp_angle_pad.append(tmp_angle)
-                self.angle_dict_split[range_group] = np.array(tmp_angle_pad)
-                self.power_dict_split[range_group] = np.array(tmp_power_pad) * INDEX2POWER
+            self.sample_count_split[range_group] = np.array(
+                [max((len(p) for p in x[uni_cnt_insert[range_group]:uni_cnt_insert[range_group + 1]]
+                      if p is not None), default=0)
+                 for x in self.power_dict.values()])
+            if self.preallocate:
+                self.power_dict_split[range_group], self.angle_dict_split[range_group] = \
+                    self._fill_range_group(uni_cnt_insert[range_group], uni_cnt_insert[range_group + 1],
+                                           range_bin_freq_lens.max(), beam_type == 1, pack_data=pack_data)
             else:
-                self.power_dict_split[range_group] = np.array(
-                    [x[uni_cnt_insert[range_group]:uni_cnt_insert[range_group + 1]]
-                     for x_key, x in self.power_dict.items()]) * INDEX2POWER
-                for ch in np.argwhere(beam_type == 1):   # if split-beam
-                    self.angle_dict_split[range_group][ch, :, :, :] = np.array(
-                        self.angle_dict[ch[0]+1][uni_cnt_insert[range_group]:uni_cnt_insert[range_group + 1]])
+                if len(range_bin_freq_lens) != 1:  # different frequency channels have different range_bin lengths
+                    tmp_power_pad = []
+                    for x_p in self.power_dict.values():  # pad nan to shorter channels
+                        tmp_p_data = np.array(x_p[uni_cnt_insert[range_group]:uni_cnt_insert[range_group + 1]])
+                        tmp_power = np.pad(tmp_p_data if pack_data else tmp_p_data.astype('float64'),
+                                           ((0, 0), (0, range_bin_freq_lens.max()-tmp_p_data.shape[1])),
+                                           mode='constant',
+                                           constant_values=(POWER_FILL_VALUE if pack_data else np.nan,))
+                        tmp_power_pad.append(tmp_power)
+                    self.power_dict_split[range_group] = np.array(tmp_power_pad)
+                else:
+                    self.power_dict_split[range_group] = np.array(
+                        [x[uni_cnt_insert[range_group]:uni_cnt_insert[range_group + 1]]
+                         for x_key, x in self.power_dict.items()])
+                if not pack_data:
+                    self.power_dict_split[range_group] = self.power_dict_split[range_group] * INDEX2POWER
+                self.angle_dict_split[range_group] = np.full(
+                    (len(self.power_dict), uni_cnt_insert[range_group + 1] - uni_cnt_insert[range_group],
+                     range_bin_freq_lens.max(), 2), ANGLE_FILL_VALUE, dtype='int16')
+                for ch in np.flatnonzero(beam_type == 1):   # only split-beam channels have angle data
+                    tmp_a_data = np.array(
+                        self.angle_dict[ch + 1][uni_cnt_insert[range_group]:uni_cnt_insert[range_group + 1]])
+                    self.angle_dict_split[range_group][ch, :, :tmp_a_data.shape[1], :] = tmp_a_data
             self.tx_sig[range_group] = defaultdict(lambda: np.zeros(shape=(tx_num,), dtype='float32'))
 
         pulse_length, transmit_power, bandwidth, sample_interval = [], [], [], []
@@ -212,8 +504,8 @@ class ConvertEK60(ConvertBase):
         param_name_save = ['transmit_duration_nominal', 'transmit_power', 'transmit_bandwidth', 'sample_interval']
         for range_group in range(len(uni)):
             for p, pname in zip(param, param_name):
-                p.append(np.array([np.array(
-                    self.ping_data_dict[x][pname][uni_cnt_insert[range_group]:uni_cnt_insert[range_group + 1]])
+                p.append(np.array([
+                    self.ping_data_dict[x][pname][uni_cnt_insert[range_group]:uni_cnt_insert[range_group + 1]]
                     for x in self.config_datagram['transceivers'].keys()]))
         tx_num = self.config_datagram['transceiver_count']  # number of transceivers
         for range_group in range(len(uni)):
@@ -226,7 +518,7 @@ class ConvertEK60(ConvertBase):
 
         self.range_lengths = uni  # used in looping when saving files with different range_bin numbers
 
-    def load_ek60_raw(self, raw):
+    def load_ek60_raw(self, raw, types=None, pack_data=False):
         """Method to parse the EK60 ``.raw`` data file.
 
         This method parses the ``.raw`` file and saves the parsed data
@@ -236,23 +528,23 @@ class ConvertEK60(ConvertBase):
         ----------
         raw : list
             raw filenames
+        types : list of str
+            datagram types to parse after the configuration datagram, either full (``'RAW0'``)
+            or without version (``'RAW'``), e.g. ``['RAW']`` for backscatter only or
+            ``['NME']`` for navigation only. Datagrams of other types are skipped without
+            being read. Defaults to `None`, which parses all datagrams.
+        pack_data : bool
+            Whether to keep power as int16 indices to save with ``pack_data``,
+            see ``self.split_by_range_group()``. Defaults to `False`
         """
         for f in raw:
             print('%s  converting file: %s' % (dt.now().strftime('%H:%M:%S'), os.path.basename(f)))
 
-            with RawSimradFile(f, 'r') as fid:
+            with RawSimradFile(f, 'r', use_mmap=self.use_mmap) as fid:
                 # Read the CON0 configuration datagram. Only keep 1 if multiple files
                 if self.config_datagram is None:
                     self.config_datagram = fid.read(1)
-                    self.config_datagram['timestamp'] = np.datetime64(
-                        self.config_datagram['timestamp'].replace(tzinfo=None), '[ms]')
-
-                    for ch_num in self.config_datagram['transceivers'].keys():
-                        self.ping_data_dict[ch_num] = defaultdict(list)
-                        self.ping_data_dict[ch_num]['frequency'] = \
-                            self.config_datagram['transceivers'][ch_num]['frequency']
-                        self.power_dict[ch_num] = []
-                        self.angle_dict[ch_num] = []
+                    self._init_channel_storage()
                 else:
                     tmp_config = fid.read(1)
 
@@ -264,17 +556,245 @@ class ConvertEK60(ConvertBase):
                     self.CON1_datagram = None
 
                 # Read the rest of datagrams
-                self._read_datagrams(fid)
+                if self.parse_workers > 1:
+                    self._read_datagrams_parallel(f, fid._tell_bytes(), types=types)
+                elif self.batch_decode or self.preallocate:
+                    self._read_datagrams_batch(f, types=types)
+                else:
+                    self._read_datagrams(fid, types=types)
 
         # Split data based on range_group (when there is a switch of range_bin in the middle of a file)
-        self.split_by_range_group()
+        self.split_by_range_group(pack_data=pack_data)
 
-        # Trim excess data from NMEA object
+        # Trim excess data from NMEA object and ping metadata
         self.nmea_data.trim()
+        for ping_data in self.ping_data_dict.values():
+            ping_data.trim()
+
+    def _parse_ping_blocks(self, raw, types=None, pack_data=False):
+        """Parse ``.raw`` files in blocks of about ``self.max_pings_in_memory`` pings.
+
+        This is a generator used by ``self.save()``. Before each iteration the parsed
+        storage is cleared and filled with the next block of pings, including the NMEA
+        datagrams recorded between them, so that only one block is held in memory.
+        The NMEA datagrams within ``self.nmea_window`` seconds of the pings of the block
+        are also read into ``self._ping_nmea_data`` to interpolate onto the pings.
+
+        Parameters
+        ----------
+        raw : list
+            raw filenames
+        types : list of str
+            datagram types to parse, see ``self.load_ek60_raw()``
+        pack_data : bool
+            whether to keep power as int16 indices, see ``self.load_ek60_raw()``
+        """
+        indexes = [RawDatagramIndex.from_file(f, save_sidecar=self.save_index) for f in raw]
+        nmea_window = np.timedelta64(int(self.nmea_window * 1e9), 'ns')
+
+        # Find the range_bin groups of all blocks in advance, so that the pings of each group
+        # are saved to the same part file as when saving all pings at once
+        ping_time, sample_count = zip(*[self._ping_sample_counts(f, index.records)
+                                        for f, index in zip(raw, indexes)])
+        ping_time, sample_count = np.concatenate(ping_time), np.concatenate(sample_count)
+        uni, uni_idx = np.unique(sample_count, return_index=True)
+        self._block_range_groups = [(length, ping_time[sample_count == length][[0, -1]])
+                                    for length in uni[np.argsort(uni_idx)]]
+
+        try:
+            for f, index in zip(raw, indexes):
+                print('%s  converting file: %s' % (dt.now().strftime('%H:%M:%S'), os.path.basename(f)))
+
+                with RawSimradFile(f, 'r', use_mmap=self.use_mmap) as fid:
+                    config_datagram = fid.read(1)
+                    if self.config_datagram is not None and \
+                            [x['frequency'] for x in config_datagram['transceivers'].values()] != \
+                            [x['frequency'] for x in self.config_datagram['transceivers'].values()]:
+                        raise ValueError('Cannot combine %s with files of different frequency channels' % f)
+                    CON1_datagram = fid.read(1) if fid.peek()['type'] == 'CON1' else None
+                    start_offset = fid._tell_bytes()
+
+                    # Split the file before every max_pings_in_memory-th ping,
+                    # counting pings from the first one even if it is right at start_offset
+                    ping_starts = self._ping_start_offsets(index.records, start_offset - 1)
+                    bounds = [start_offset] + \
+                             [int(x) for x in ping_starts[self.max_pings_in_memory::self.max_pings_in_memory]] + \
+                             [index.end_offset]
+                    new_block = True
+                    for block_start, block_end in zip(bounds[:-1], bounds[1:]):
+                        if new_block:
+                            self._reset_storage()
+                            self.config_datagram = config_datagram
+                            self.CON1_datagram = CON1_datagram
+                            self._init_channel_storage()
+                        fid._seek_bytes(block_start)
+                        self._read_datagrams(fid, types=types, end_offset=block_end)
+                        # carry the NMEA datagrams of a block without complete pings over to the next block
+                        new_block = len(self.ping_time) > 0
+                        if not new_block:
+                            continue
+                        self.split_by_range_group(pack_data=pack_data)
+                        self.nmea_data.trim()
+                        for ping_data in self.ping_data_dict.values():
+                            ping_data.trim()
+
+                        # NMEA data are interpolated onto the pings of the block from the NMEA datagrams
+                        # around them in all files, so that pings at the edges of blocks get the same
+                        # values as when parsing whole files
+                        ping_time = np.asarray(self.ping_time, dtype='datetime64[ns]')
+                        time_range = (ping_time.min() - nmea_window, ping_time.max() + nmea_window)
+                        self._ping_nmea_data = NMEAData()
+                        for nmea_file, nmea_index in zip(raw, indexes):
+                            self._read_nmea_datagrams(nmea_file, nmea_index, self._ping_nmea_data,
+                                                      time_range=time_range)
+                        self._ping_nmea_data.trim()
+                        yield
+        finally:
+            self._ping_nmea_data = None
+            self._block_range_groups = None
+
+    @staticmethod
+    def _read_nmea_datagrams(raw_path, index, nmea_data, time_range=None):
+        """Add the NMEA datagrams of a ``.raw`` file to a NMEAData object.
+
+        The NMEA datagrams are located with the datagram index of the file,
+        without reading the other datagrams.
+
+        Parameters
+        ----------
+        raw_path : str
+            path to the ``.raw`` file
+        index : RawDatagramIndex
+            datagram index of the file
+        nmea_data : NMEAData
+            object to add the NMEA datagrams to
+        time_range : tuple of np.datetime64, optional
+            first and last time of the NMEA datagrams to add, all datagrams if None
+        """
+        records = index.records[1:]   # skip configuration datagram
+        records = records[(records['type'].astype('S3') == b'NME') & (records['nt_time'] != 0)]
+        nmea_times = nt_to_datetime64(records['nt_time'] & 0xFFFFFFFF, records['nt_time'] >> 32)
+        if time_range is not None:
+            in_range = (nmea_times >= time_range[0]) & (nmea_times <= time_range[-1])
+            records, nmea_times = records[in_range], nmea_times[in_range]
+            if records.size == 0:
+                return
+        nmea_parser = RawSimradFile.DGRAM_TYPE_KEY['NME']
+        with open(raw_path, 'rb') as fid:
+            for offset, size, nmea_time in zip(records['offset'], records['size'], nmea_times):
+                fid.seek(int(offset) + 4)
+                nmea_dgram = nmea_parser.from_string(fid.read(int(size)))
+                nmea_data.add_datagram(nmea_time, nmea_dgram['nmea_string'])
+
+    @staticmethod
+    def _part_files(out_file, n_parts):
+        """Return the paths to the ``_partNN`` output files of ``n_parts`` range_bin groups.
+        """
+        split = os.path.splitext(out_file)
+        return [split[0] + '_part%02d' % (n + 1) + split[1] for n in range(n_parts)]
+
+    def follow(self, save_path=None, compress=True, pack_data=False, chunks=None):
+        """Convert the pings of a ``.raw`` file that is still being recorded.
+
+        On the first call the complete pings in the file are converted to a new Zarr file.
+        Each later call only parses the datagrams appended to the ``.raw`` file since the
+        previous call and appends the new pings to the Zarr file along ``ping_time``.
+        A ping is converted once the datagrams of all its channels are completely written.
+        When the number of range_bin changes, the following pings are converted to a new
+        Zarr file named like the ``_partNN`` files of ``save()``, starting from ``_part02``.
 
-    def save(self, file_format, save_path=None, combine_opt=False, overwrite=False, compress=True):
+        Parameters
+        ----------
+        save_path : str
+            path to the output Zarr file. If `None`, outputs in the same location as the input raw file.
+        compress : bool, str or dict
+            Whether or not to compress backscatter data, or the codec profile or encoding of each
+            variable to compress it with, see ``ConvertBase.raw2nc()``. Defaults to `True`
+        pack_data : bool
+            Whether or not to store power as packed int16, see ``save()``. Defaults to `False`
+        chunks : dict
+            Chunk size of power and angle data along each dimension, see ``save()``.
+            Only used when creating the Zarr file
+
+        Returns
+        -------
+        Number of pings converted
+        """
+        if len(self.filename) != 1:
+            raise ValueError("Follow mode converts a single .raw file")
+        raw_path = self.filename[0]
+
+        # Index only the datagrams appended since the last call
+        if self._follow_index is None:
+            self._follow_index = RawDatagramIndex()
+        self._follow_index.update(raw_path)
+        records = self._follow_index.records
+        if len(records) == 0:
+            return 0
+
+        config_datagram = self.config_datagram
+        self._reset_storage()
+        with RawSimradFile(raw_path, 'r', use_mmap=self.use_mmap) as fid:
+            if self._follow_offset is None:
+                self.config_datagram = fid.read(1)
+                start_offset = fid._tell_bytes()
+            else:
+                self.config_datagram = config_datagram
+                start_offset = self._follow_offset
+            self._init_channel_storage()
+
+            # Stop before the last ping if the datagrams of some of its channels are not written yet
+            end_offset = self._follow_index.end_offset
+            new_records = records[records['offset'] >= start_offset]
+            is_raw = new_records['type'].astype('S3') == b'RAW'
+            ping_starts = np.flatnonzero(is_raw & (new_records['channel'] == 1))
+            if ping_starts.size and \
+                    is_raw[ping_starts[-1]:].sum() < self.config_datagram['transceiver_count']:
+                end_offset = int(new_records['offset'][ping_starts[-1]])
+
+            # Stop before the first ping with a different number of range_bin,
+            # which is converted to a new Zarr file by the next call
+            _, sample_count = self._ping_sample_counts(raw_path, new_records[new_records['offset'] < end_offset])
+            part = self._follow_part
+            if sample_count.size:
+                if self._follow_range_len is not None and sample_count[0] != self._follow_range_len:
+                    part += 1
+                range_change = np.flatnonzero(sample_count != sample_count[0])
+                if range_change.size:
+                    end_offset = int(new_records['offset'][ping_starts[range_change[0]]])
+
+            fid._seek_bytes(start_offset)
+            self._read_datagrams(fid, end_offset=end_offset)
+
+        self.split_by_range_group(pack_data=pack_data)
+        self.nmea_data.trim()
+        if len(self.ping_time) == 0:
+            return 0   # parse the same datagrams again once a ping is complete
+
+        if part > 1:
+            save_path = self._part_files(self._follow_path, part)[-1]
+        self.save('.zarr', save_path, compress=compress, append=True, pack_data=pack_data, chunks=chunks)
+        if self._follow_path is None:
+            self._follow_path = self.save_path
+        self._follow_offset = end_offset
+        self._follow_part = part
+        self._follow_range_len = sample_count[0]
+        return len(self.ping_time)
+
+    def save(self, file_format, save_path=None, combine_opt=False, overwrite=False, compress=True, append=False,
+             pack_data=False, n_workers=1, range_groups='files', ragged=False, chunks=None, types=None):
         """Save data from .raw format to a netCDF4 or Zarr file
 
+        If ``self.max_pings_in_memory`` is set, each file is parsed and saved in blocks of
+        that many pings, which are appended to the output file one at a time, so that memory
+        use does not grow with the length of the files. Pings with different numbers of range_bin
+        are saved to the same ``_partNN`` files as without blocks, and each ``_partNN`` file gets
+        the NMEA datagrams of the blocks saved to it. The NMEA data interpolated onto the pings
+        of a block are read from the datagrams within ``self.nmea_window`` seconds of the block.
+
+        If no pings are parsed, for example when converting only NMEA datagrams with
+        ``types=['NME']``, only the Platform, Platform/NMEA and Provenance groups are saved.
+
         Parameters
         ----------
         file_format : str
@@ -288,10 +808,53 @@ class ConvertEK60(ConvertBase):
             Raises error if combine_opt is true and there is only one file being converted.
         overwrite : bool
             Whether or not to overwrite the file if the output path already exists.
-        compress : bool
-            Whether or not to compress backscatter data. Defaults to `True`
+        compress : bool, str or dict
+            Whether or not to compress backscatter data, or the codec profile or encoding of each
+            variable to compress it with, see ``ConvertBase.raw2nc()``. Defaults to `True`
+        append : bool
+            Whether or not to append the parsed pings to an existing file along ``ping_time``.
+            Only the Beam, Platform and Platform/NMEA groups are appended to. NetCDF files can only
+            be appended to if they were created with ``append=True``, which makes their time
+            dimensions unlimited. Defaults to `False`
+        pack_data : bool
+            Whether or not to store power as int16 indices with ``scale_factor=INDEX2POWER``
+            instead of float64 dB values. Decoded transparently by xarray. The indices of the RAW
+            datagrams are then parsed into int16 cubes and saved without converting to dB.
+            Defaults to `False`
+        n_workers : int
+            Number of worker processes converting files in parallel when not combining files.
+            See ``ConvertBase._save_parallel()``. Defaults to 1
+        range_groups : str
+            How to save pings recorded with different numbers of range_bin.
+            'files' saves each range_bin group to its own ``_partNN`` file.
+            'subgroups' saves all pings to one file, with the Beam group of each range_bin group
+            in a subgroup ``Beam/range_group_NN`` and a single Platform group for all pings.
+            Only 'files' is supported when saving in blocks of pings. Defaults to 'files'
+        ragged : bool
+            Whether or not to store power and angle data as CF contiguous ragged arrays,
+            see ``ConvertBase.raw2nc()``. Defaults to `False`
+        chunks : dict
+            Chunk size of power and angle data along each dimension, see ``ConvertBase.raw2nc()``.
+            Defaults to chunks aligned to the tiles of MVBS and noise estimation
+        types : list of str
+            Datagram types to parse, see ``self.load_ek60_raw()``. Defaults to all datagrams
         """
-        def export(file_idx=None):
+        if range_groups not in ('files', 'subgroups'):
+            raise ValueError("range_groups must be 'files' or 'subgroups'")
+        chunks = self._get_chunks(chunks)
+
+        def check_outputs(out_files):
+            # Remove existing output files if overwriting, and return whether to convert
+            for out_file in out_files:
+                if self._output_exists(out_file) and overwrite:
+                    print("          overwriting: " + out_file)
+                    self._remove_output(out_file)
+            if any(self._output_exists(x) for x in out_files) and not append:
+                print(f'          ... this file has already been converted to {file_format}, conversion not executed.')
+                return False
+            return True
+
+        def export(file_idx=None, append_block=False):
             # Subfunctions to set various dictionaries
             def _set_toplevel_dict():
                 out_dict = dict(Conventions='CF-1.7, SONAR-netCDF4, ACDD-1.3',
@@ -332,7 +895,7 @@ class ConvertEK60(ConvertBase):
                 out_dict['platform_code_ICES'] = self.platform_code_ICES
 
                 # Read pitch/roll/heave from ping data
-                # [seconds since 1900-01-01] for xarray.to_netcdf conversion
+                # [nanoseconds since 1900-01-01] for xarray.to_netcdf conversion
                 out_dict['ping_time'] = self.ping_time
                 out_dict['pitch'] = np.array(self.ping_data_dict[1]['pitch'], dtype='float32')
                 out_dict['roll'] = np.array(self.ping_data_dict[1]['roll'], dtype='float32')
@@ -342,19 +905,21 @@ class ConvertEK60(ConvertBase):
                 out_dict['water_level'] = np.int32(0)
 
                 # Read lat/long from NMEA datagram
-                idx_loc = np.argwhere(np.isin(self.nmea_data.messages, ['GGA', 'GLL', 'RMC'])).squeeze()
-                # TODO: use NaN when nmea_msg is empty
-                nmea_msg = []
-                [nmea_msg.append(pynmea2.parse(self.nmea_data.raw_datagrams[x])) for x in idx_loc]
-                out_dict['lat'] = np.array([x.latitude for x in nmea_msg])
-                out_dict['lon'] = np.array([x.longitude for x in nmea_msg])
+                idx_loc = np.flatnonzero(np.isin(self.nmea_data.messages, ['GGA', 'GLL', 'RMC']))
+                out_dict['lat'], out_dict['lon'] = self.nmea_data.decode_position(idx_loc)
                 out_dict['location_time'] = self.nmea_data.nmea_times[idx_loc]
 
-                if len(self.range_lengths) > 1:
-                    out_dict['path'] = self.all_files[piece_seq]
+                # Interpolate NMEA data onto ping times
+                nmea_data = self.nmea_data if self._ping_nmea_data is None else self._ping_nmea_data
+                out_dict['nmea_ping'] = {}
+                for meta_type in ['position', 'HDT', 'VTG', 'distance']:
+                    out_dict['nmea_ping'].update(nmea_data.interpolate(meta_type, self.ping_time))
+
+                out_dict['path'] = self.all_files[piece_seq]
+                if block_parts:
+                    out_dict['ping_slice'] = dict(self._block_range_groups)[self.range_lengths[piece_seq]]
+                elif len(self.range_lengths) > 1 and range_groups == 'files':
                     out_dict['ping_slice'] = self.ping_time_split[piece_seq]
-                else:
-                    out_dict['path'] = out_file
                 return out_dict
 
             def _set_nmea_dict():
@@ -368,14 +933,19 @@ class ConvertEK60(ConvertBase):
                 beam_dict = dict()
                 beam_dict['beam_mode'] = 'vertical'
                 beam_dict['conversion_equation_t'] = 'type_3'  # type_3 is EK60 conversion
-                beam_dict['ping_time'] = self.ping_time_split[piece_seq]   # [seconds since 1900-01-01] for xarray.to_netcdf conversion
+                beam_dict['ping_time'] = self.ping_time_split[piece_seq]   # [nanoseconds since 1900-01-01] for xarray.to_netcdf conversion
                 beam_dict['backscatter_r'] = self.power_dict_split[piece_seq]  # dimension [freq x ping_time x range_bin]
                 beam_dict['angle_dict'] = self.angle_dict_split[piece_seq]
+                beam_dict['power_scale_factor'] = INDEX2POWER   # used when packing power as int16
+                beam_dict['power_fill_value'] = POWER_FILL_VALUE
+                beam_dict['angle_scale_factor'] = INDEX2ELEC
+                beam_dict['angle_fill_value'] = ANGLE_FILL_VALUE
 
                 # Additional coordinate variables added by echopype for storing data as a cube with
                 # dimensions [frequency x ping_time x range_bin]
                 beam_dict['frequency'] = freq
                 beam_dict['range_bin'] = np.arange(self.power_dict_split[piece_seq].shape[2])
+                beam_dict['sample_count'] = self.sample_count_split[piece_seq]
 
                 # Loop through each transducer for channel-specific variables
                 param_numerical = {"beamwidth_receive_major": "beamwidth_alongship",
@@ -427,26 +997,26 @@ class ConvertEK60(ConvertBase):
                     np.array([x['sa_correction_table'][y]
                             for x, y in zip(self.config_datagram['transceivers'].values(), np.array(idx))])
 
-                # New path created if the power data is broken up due to varying range bins
-                if len(self.range_lengths) > 1:
-                    beam_dict['path'] = self.all_files[piece_seq]
+                # Separate path or group if the power data is broken up due to varying range bins
+                beam_dict['path'] = self.all_files[piece_seq]
+                if len(self.range_lengths) > 1 and range_groups == 'subgroups':
+                    beam_dict['group'] = 'Beam/range_group_%02d' % (piece_seq + 1)
                 else:
-                    beam_dict['path'] = out_file
+                    beam_dict['group'] = 'Beam'
 
                 return beam_dict
 
-            def copyfiles():
-                self.all_files = []
-                split = os.path.splitext(self.save_path)
-                for n in range(len(self.range_lengths)):
-                    new_path = split[0] + '_part%02d' % (n + 1) + split[1]
-                    self.all_files.append(new_path)
-                    if n > 0:
-                        if split[1] == '.zarr':
-                            shutil.copytree(self.save_path, new_path)
-                        elif split[1] == '.nc':
-                            shutil.copyfile(self.save_path, new_path)
-                os.rename(self.save_path, self.all_files[0])
+            def _set_output_files():
+                # Output file of each range_bin group
+                if block_parts:
+                    # Each block is appended to the part file of its range_bin group(s) in all blocks
+                    part_lengths = [x[0] for x in self._block_range_groups]
+                    all_parts = self._part_files(out_file, len(part_lengths))
+                    self.all_files = [all_parts[part_lengths.index(x)] for x in self.range_lengths]
+                elif len(self.range_lengths) > 1 and range_groups == 'files':
+                    self.all_files = self._part_files(out_file, len(self.range_lengths))
+                else:
+                    self.all_files = [out_file] * len(self.range_lengths)
 
             if file_idx is None:
                 out_file = self.save_path
@@ -461,18 +1031,32 @@ class ConvertEK60(ConvertBase):
             filetime = filename_tup[len(filename_tup) - 1].replace("T", "")
 
             # Check if nc file already exists and deletes it if overwrite is true
-            if os.path.exists(out_file) and overwrite:
+            if self._output_exists(out_file) and overwrite and not append_block:
                 print("          overwriting: " + out_file)  # TODO: this should be printed after 'converting...'
-                os.remove(out_file)
+                self._remove_output(out_file)
             # Check if nc file already exists
             # ... if yes, abort conversion and issue warning
             # ... if not, continue with conversion
-            if os.path.exists(out_file):
+            if self._output_exists(out_file) and not (append or append_block):
                 print(f'          ... this file has already been converted to {file_format}, conversion not executed.')
             else:
                 # Load data from RAW file
                 if not bool(self.power_dict):  # if haven't parsed .raw file
-                    self.load_ek60_raw(self.filename)
+                    self.load_ek60_raw(self.filename, types=types, pack_data=pack_data)
+
+                # Without pings, e.g. for navigation only, save only the groups that do not need ping data
+                if len(self.ping_time) == 0:
+                    block_parts = False
+                    self.all_files = [out_file]
+                    grp = SetGroups(file_path=out_file, echo_type='EK60', compress=compress,
+                                    append=self._output_exists(out_file), appendable=append)
+                    if not grp.append:
+                        grp.set_toplevel(_set_toplevel_dict())  # top-level group
+                        grp.set_provenance(raw_file, _set_prov_dict())    # provenance group
+                    grp.set_nmea(_set_nmea_dict())              # platform/NMEA group
+                    grp.set_platform(_set_platform_dict())      # platform group
+                    self._write_groups(grp)
+                    return
 
                 # Retrieve variables
                 tx_num = self.config_datagram['transceiver_count']
@@ -497,26 +1081,102 @@ class ConvertEK60(ConvertBase):
                                       for x in self.config_datagram['transceivers'].keys()],
                                       dtype='float32')
 
-                # Create SetGroups object
-                grp = SetGroups(file_path=out_file, echo_type='EK60', compress=compress)
-                grp.set_toplevel(_set_toplevel_dict())  # top-level group
-                grp.set_env(_set_env_dict())            # environment group
-                grp.set_provenance(raw_file, _set_prov_dict())    # provenance group
-                grp.set_nmea(_set_nmea_dict())          # platform/NMEA group
-                grp.set_sonar(_set_sonar_dict())        # sonar group
-                if len(self.range_lengths) > 1:
-                    copyfiles()
-                for piece in range(len(self.range_lengths)):
+                range_lengths = self._block_range_groups if append_block else self.range_lengths
+                if (append or append_block and range_groups == 'subgroups') and len(range_lengths) > 1:
+                    raise ValueError('Cannot append pings with different range_bin lengths to one file')
+                # Whether blocks are saved to the part files of the range_bin groups of all blocks
+                block_parts = append_block and range_groups == 'files' and len(range_lengths) > 1
+                _set_output_files()
+                # part files are only known once the pings are parsed
+                if not append_block and self.all_files[0] != out_file and \
+                        not check_outputs(list(dict.fromkeys(self.all_files))):
+                    return
+
+                # Write each output file once, with the shared groups and its own range_bin group(s)
+                for piece, path in enumerate(self.all_files):
+                    new_file = piece == 0 or path != self.all_files[piece - 1]
+                    if new_file:
+                        # Create SetGroups object
+                        grp = SetGroups(file_path=path, echo_type='EK60', compress=compress,
+                                        append=self._output_exists(path), pack_data=pack_data,
+                                        appendable=append or append_block, ragged=ragged, chunks=chunks)
+                        if grp.append:
+                            grp.set_nmea(_set_nmea_dict())          # platform/NMEA group
+                        else:
+                            grp.set_toplevel(_set_toplevel_dict())  # top-level group
+                            grp.set_env(_set_env_dict())            # environment group
+                            grp.set_provenance(raw_file, _set_prov_dict())    # provenance group
+                            grp.set_nmea(_set_nmea_dict())          # platform/NMEA group
+                            grp.set_sonar(_set_sonar_dict())        # sonar group
                     grp.set_beam(_set_beam_dict(piece_seq=piece))          # beam group
-                    grp.set_platform(_set_platform_dict(piece_seq=piece))  # platform group
+                    if new_file:
+                        grp.set_platform(_set_platform_dict(piece_seq=piece))  # platform group
+                    if piece == len(self.all_files) - 1 or self.all_files[piece + 1] != path:
+                        self._write_groups(grp)                            # write all groups to the file at once
+
+        def export_blocks(file_idx=None):
+            # Parse and save blocks of pings, appending each block to the output file
+            raw_file = self.filename if file_idx is None else [self.filename[file_idx]]
+            out_file = self.save_path if file_idx is None else self.save_path[file_idx]
+            if not check_outputs([out_file]):
+                return
+            self._reset_storage()
+            for n_block, _ in enumerate(self._parse_ping_blocks(raw_file, types=types, pack_data=pack_data)):
+                # the range_bin groups, and so the part files, are known once parsing has started
+                if n_block == 0 and range_groups == 'files' and len(self._block_range_groups) > 1 and \
+                        not check_outputs(self._part_files(out_file, len(self._block_range_groups))):
+                    return
+                export(file_idx, append_block=True)
+
+        if n_workers > 1 and len(self.filename) > 1 and not combine_opt:
+            self._save_parallel(file_format, save_path, n_workers, overwrite=overwrite, compress=compress,
+                                append=append, pack_data=pack_data, range_groups=range_groups,
+                                ragged=ragged, chunks=chunks, types=types)
+            return
 
         self.validate_path(save_path, file_format, combine_opt)
-        if len(self.filename) == 1 or combine_opt:
+        # Datasets in memory hold all pings, and without RAW datagrams there are no pings to save in blocks
+        if self.max_pings_in_memory is not None and self._datasets is None and \
+                (types is None or any(t[:3] == 'RAW' for t in types)):
+            if len(self.filename) == 1 or combine_opt:
+                export_blocks()
+            else:
+                for file_seq in range(len(self.filename)):
+                    export_blocks(file_seq)
+        elif len(self.filename) == 1 or combine_opt:
             export()
         else:
             for freq_seq, file in enumerate(self.filename):
                 if freq_seq > 0:
-                    self.__init__(self.filename)        # Clear previous parse
+                    self._reset_storage()        # Clear previous parse
                     self.validate_path(save_path, file_format, combine_opt)
-                self.load_ek60_raw([file])
+                self.load_ek60_raw([file], types=types, pack_data=pack_data)
                 export(freq_seq)
+
+
+def _parse_raw_range(raw_path, config_datagram, start_offset, end_offset, use_mmap=False, types=None):
+    """Parse the datagrams of a ``.raw`` file between two byte offsets.
+
+    Run in worker processes by ``ConvertEK60._read_datagrams_parallel()``.
+
+    Returns
+    -------
+    ping_time, ping_data_dict, power_dict, angle_dict, nmea_times, nmea_strings
+    """
+    parser = ConvertEK60(raw_path)
+    parser.config_datagram = config_datagram
+    parser._init_channel_storage()
+    with RawSimradFile(raw_path, 'r', use_mmap=use_mmap) as fid:
+        fid._seek_bytes(start_offset)
+        parser._read_datagrams(fid, types=types, end_offset=end_offset)
+        # copy samples out of the file mapping before it is closed
+        power_dict = {ch_num: [None if x is None else np.array(x) for x in power]
+                      for ch_num, power in parser.power_dict.items()}
+        angle_dict = {ch_num: [None if x is None else np.array(x) for x in angle]
+                      for ch_num, angle in parser.angle_dict.items()}
+    parser.nmea_data.trim()
+    for ping_data in parser.ping_data_dict.values():
+        ping_data.trim()
+
+    return (parser.ping_time, parser.ping_data_dict, power_dict, angle_dict,
+            parser.nmea_data.nmea_times, parser.nmea_data.raw_datagrams)
@@ -14,6 +14,7 @@ TODO: fix docstring
 """
 
 import datetime
+import numpy as np
 from pytz import utc as pytz_utc
 
 
@@ -23,8 +24,31 @@ UTC_NT_EPOCH = datetime.datetime(1601, 1, 1, 0, 0, 0, tzinfo=pytz_utc)
 UTC_UNIX_EPOCH = datetime.datetime(1970, 1, 1, 0, 0, 0, tzinfo=pytz_utc)
 
 EPOCH_DELTA_SECONDS = (UTC_UNIX_EPOCH - UTC_NT_EPOCH).total_seconds()
+# NT epoch to Unix epoch in 100 ns intervals
+EPOCH_DELTA_100NS = 11644473600 * 10 ** 7
 
-__all__ = ['nt_to_unix', 'unix_to_nt']
+__all__ = ['nt_to_unix', 'unix_to_nt', 'nt_to_datetime64']
+
+
+def nt_to_datetime64(low_date, high_date):
+    """
+    :param low_date: least significant 32 bits of the NT date
+    :type low_date: int or array of uint32
+
+    :param high_date: most significant 32 bits of the NT date
+    :type high_date: int or array of uint32
+
+    Returns numpy.datetime64[ns] UTC timestamps calculated from NT date pairs.
+    Works on scalars and on whole arrays of dates at once, and keeps the
+    full 100 ns resolution of the NT date by using integer arithmetic only.
+
+    >>> dt64 = nt_to_datetime64(19496896, 30196149)
+    >>> assert dt64 == np.datetime64('2011-12-23T20:54:03.964')
+    """
+
+    nt_date = (np.asarray(high_date, dtype='int64') << 32) + np.asarray(low_date, dtype='int64')
+    unix_ns = (nt_date - EPOCH_DELTA_100NS) * 100
+    return unix_ns.view('datetime64[ns]')[()]
 
 
 def nt_to_unix(nt_timestamp_tuple, return_datetime=True):
@@ -0,0 +1,86 @@
+"""
+Contains class ``PingDataColumns`` for storing ping-by-ping channel metadata.
+Called by class ConvertEK60 in ``echopype/convert/ek60.py``.
+"""
+
+import numpy as np
+
+__all__ = ['PingDataColumns']
+
+
+class PingDataColumns(object):
+    """Columnar storage of ping-by-ping metadata of one channel.
+
+    Each field is a column of a preallocated numpy structured array, which doubles
+    in size when full. Indexing with a field name returns a view of the column for
+    the pings stored so far, so that slicing it by range_bin group does not copy data.
+
+    Parameters
+    ----------
+    dtype : np.dtype
+        structured dtype with one field per metadata column
+    frequency : float
+        frequency of the channel
+    initial_size : int
+        number of pings to preallocate storage for
+    """
+
+    def __init__(self, dtype, frequency=None, initial_size=500):
+        self.frequency = frequency
+        self.n_pings = 0
+        self._data = np.empty(initial_size, dtype=dtype)
+
+    def __len__(self):
+        return self.n_pings
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __contains__(self, field):
+        return field in self.keys()
+
+    def __getitem__(self, field):
+        if field == 'frequency':
+            return self.frequency
+        return self._data[field][:self.n_pings]
+
+    def keys(self):
+        return ['frequency'] + list(self._data.dtype.names)
+
+    def _reserve(self, n_pings):
+        """Grow the storage geometrically so that it can hold ``n_pings`` pings."""
+        if n_pings > self._data.shape[0]:
+            new_data = np.empty(max(n_pings, 2 * self._data.shape[0]), dtype=self._data.dtype)
+            new_data[:self.n_pings] = self._data[:self.n_pings]
+            self._data = new_data
+
+    def append(self, datagram):
+        """Append the metadata of one ping.
+
+        Parameters
+        ----------
+        datagram : dict
+            datagram of type 'RAW', or any mapping with a value for each field
+        """
+        self._reserve(self.n_pings + 1)
+        self._data[self.n_pings] = tuple(datagram[field] for field in self._data.dtype.names)
+        self.n_pings += 1
+
+    def extend(self, columns):
+        """Append the metadata of many pings.
+
+        Parameters
+        ----------
+        columns
+            structured array, ``PingDataColumns`` or dict with an array for each field
+        """
+        fields = self._data.dtype.names
+        n_new = len(columns[fields[0]])
+        self._reserve(self.n_pings + n_new)
+        for field in fields:
+            self._data[field][self.n_pings:self.n_pings + n_new] = columns[field]
+        self.n_pings += n_new
+
+    def trim(self):
+        """Release the preallocated storage not used by any ping."""
+        self._data = self._data[:self.n_pings].copy()
@@ -0,0 +1,252 @@
+"""
+Contains class ``RawDatagramIndex`` for one-pass indexing of EK60 ``.raw`` files.
+Called by class RawSimradFile in ``echopype/convert/utils/ek60_raw_io.py``.
+
+The index records the type, channel, NT timestamp, byte offset and size of every
+datagram in a file, so that datagrams can be located by number or time without
+walking the file. On request it is saved as a compact ``.npz`` sidecar next to
+the ``.raw`` file, which is reused on later opens as long as the file has not changed.
+"""
+
+import os
+import struct
+import logging
+import numpy as np
+from .ek60_date_conversion import EPOCH_DELTA_100NS
+
+log = logging.getLogger(__name__)
+
+__all__ = ['RawDatagramIndex', 'INDEX_DTYPE']
+
+#: One record per datagram. ``offset`` points at the leading length field and
+#: ``size`` is the datagram length excluding the two 4-byte length fields.
+INDEX_DTYPE = np.dtype([('type', 'S4'),
+                        ('channel', 'i2'),
+                        ('nt_time', 'u8'),
+                        ('offset', 'i8'),
+                        ('size', 'i4')])
+
+
+
+class RawDatagramIndex(object):
+    """Datagram offset index of an EK60 ``.raw`` file.
+
+    Parameters
+    ----------
+    records : np.ndarray
+        structured array with dtype ``INDEX_DTYPE``
+    file_size : int
+        size in bytes of the indexed file
+    file_mtime : int
+        modification time [ns] of the indexed file
+    """
+
+    SIDECAR_EXT = '.idx.npz'
+
+    def __init__(self, records=None, file_size=0, file_mtime=0):
+        self.records = np.empty(0, dtype=INDEX_DTYPE) if records is None else records
+        self.file_size = file_size
+        self.file_mtime = file_mtime
+        self._time_order = None
+
+    def __len__(self):
+        return self.records.shape[0]
+
+    def __getitem__(self, key):
+        return self.records[key]
+
+    @property
+    def end_offset(self):
+        """Byte offset right after the last indexed datagram."""
+        if len(self) == 0:
+            return 0
+        return int(self.records['offset'][-1] + self.records['size'][-1] + 8)
+
+    @classmethod
+    def sidecar_path(cls, raw_path):
+        return raw_path + cls.SIDECAR_EXT
+
+    @classmethod
+    def from_file(cls, raw_path, use_sidecar=True, save_sidecar=False):
+        """Get the index of a ``.raw`` file, reusing the sidecar file if it is up to date.
+
+        A sidecar indexing an earlier, shorter version of a file that is still being
+        recorded is extended from its last datagram instead of being rebuilt. A sidecar
+        whose first or last datagram is no longer found in the file is rebuilt.
+
+        Parameters
+        ----------
+        raw_path : str
+            path to the ``.raw`` file
+        use_sidecar : bool
+            whether to load an existing sidecar index. Defaults to `True`
+        save_sidecar : bool
+            whether to save a new or updated index next to the ``.raw`` file. Defaults to `False`
+        """
+        stat = os.stat(raw_path)
+        sidecar = cls.sidecar_path(raw_path)
+
+        index = None
+        if use_sidecar and os.path.exists(sidecar):
+            try:
+                index = cls.load(sidecar)
+            except (IOError, ValueError, KeyError):
+                log.warning('Could not read datagram index %s, re-indexing', sidecar)
+            else:
+                if index.file_size > stat.st_size or not index.matches(raw_path):
+                    index = None  # file was rewritten
+                elif (index.file_size, index.file_mtime) == (stat.st_size, stat.st_mtime_ns):
+                    return index
+
+        if index is None:
+            index = cls()
+        index.update(raw_path)
+
+        if save_sidecar:
+            try:
+                index.save(sidecar)
+            except IOError:
+                log.warning('Could not save datagram index to %s', sidecar)
+
+        return index
+
+    def matches(self, raw_path):
+        """Whether the first and last indexed datagrams are still at their offsets in the file.
+
+        Their length fields, type and timestamp are compared with the index, which detects
+        files rewritten with other content even if they are not shorter than before.
+        """
+        if len(self) == 0:
+            return True
+        with open(raw_path, 'rb') as fid:
+            for record in self.records[[0, -1]]:
+                fid.seek(int(record['offset']))
+                header = fid.read(16)
+                fid.seek(int(record['offset'] + record['size'] + 4))
+                trailer = fid.read(4)
+                if len(header) < 16 or len(trailer) < 4:
+                    return False
+                size, dgram_type, low_date, high_date = struct.unpack('=l4sLL', header)
+                if (size, struct.unpack('=l', trailer)[0], dgram_type, (high_date << 32) + low_date) != \
+                        (record['size'], record['size'], record['type'], record['nt_time']):
+                    return False
+        return True
+
+    def update(self, raw_path):
+        """Index datagrams appended to the file since the last update.
+        """
+        stat = os.stat(raw_path)
+        new_records = self.scan(raw_path, start=self.end_offset, growing=True)
+        if new_records.size:
+            self.records = np.concatenate([self.records, new_records])
+            self._time_order = None
+        self.file_size = stat.st_size
+        self.file_mtime = stat.st_mtime_ns
+        return new_records.size
+
+    @staticmethod
+    def scan(raw_path, start=0, growing=False):
+        """Walk through the file once and return one ``INDEX_DTYPE`` record per datagram.
+
+        Corrupted data between datagrams is skipped and left out of the index.
+        An incomplete datagram at the end of the file is not indexed.
+        If ``growing`` is True, the file is still being written, and scanning stops
+        quietly at the first datagram extending beyond the end of the file instead
+        of searching the rest of the file for a valid datagram.
+        """
+        # Import here to avoid a circular import with ek60_raw_io
+        from .ek60_raw_io import RawSimradFile, SimradEOF, DatagramReadError
+
+        records = []
+        with RawSimradFile(raw_path, 'r', use_mmap=True) as fid:
+            fid._seek_bytes(start)
+            file_size = start + fid._bytes_remaining()
+            while True:
+                pos = fid._tell_bytes()
+                try:
+                    header = fid.peek()
+                    if growing and pos + header['size'] + 8 > file_size:
+                        break
+                    fid.skip()
+                except (SimradEOF, DatagramReadError, struct.error):
+                    break
+                if fid._tell_bytes() == pos + header['size'] + 8:
+                    records.append((header['type'].encode(), header.get('channel', 0),
+                                    (header['high_date'] << 32) + header['low_date'],
+                                    pos, header['size']))
+
+        return np.array(records, dtype=INDEX_DTYPE)
+
+    def save(self, path):
+        """Save index to a ``.npz`` file."""
+        with open(path, 'wb') as f:
+            np.savez(f, records=self.records,
+                     file_stat=np.array([self.file_size, self.file_mtime], dtype='int64'))
+
+    @classmethod
+    def load(cls, path):
+        """Load index from a ``.npz`` file."""
+        with np.load(path) as npz:
+            records = npz['records']
+            file_size, file_mtime = npz['file_stat'].tolist()
+        if records.dtype != INDEX_DTYPE:
+            raise ValueError('Datagram index has an unexpected layout')
+        return cls(records, file_size, file_mtime)
+
+    def select(self, types=None, channels=None):
+        """Return a boolean mask of the datagrams matching the given types and channels.
+
+        Parameters
+        ----------
+        types : list of str
+            datagram types, either full (``'RAW0'``) or without version (``'RAW'``)
+        channels : list of int
+            channel numbers of RAW datagrams. Datagrams of other types are not filtered by channel.
+        """
+        mask = np.ones(len(self), dtype=bool)
+        if types is not None:
+            types = [t.encode() if isinstance(t, str) else t for t in types]
+            dgram_type = self.records['type']
+            mask &= np.isin(dgram_type, types) | np.isin(dgram_type.astype('S3'), types)
+        if channels is not None:
+            is_raw = self.records['type'].astype('S3') == b'RAW'
+            mask &= ~is_raw | np.isin(self.records['channel'], channels)
+        return mask
+
+    @staticmethod
+    def to_nt(time):
+        """Convert a datetime64 to a NT timestamp (100 ns intervals since 1601-01-01)."""
+        if isinstance(time, (int, np.integer)):
+            return time
+        return np.datetime64(time, 'ns').astype('int64') // 100 + EPOCH_DELTA_100NS
+
+    def locate_time(self, time):
+        """Return the number of the first datagram with a timestamp at or after ``time``.
+
+        Parameters
+        ----------
+        time : np.datetime64 or int
+            time as datetime64 or as NT timestamp
+        """
+        nt_time = self.records['nt_time']
+        t = np.uint64(self.to_nt(time))   # searching with a signed value would compare as float
+        if self._time_order is None:
+            if np.all(nt_time[1:] >= nt_time[:-1]):
+                self._time_order = slice(None)
+            else:
+                self._time_order = np.argsort(nt_time, kind='stable')
+        if isinstance(self._time_order, slice):
+            return int(np.searchsorted(nt_time, t, side='left'))
+        idx = np.searchsorted(nt_time[self._time_order], t, side='left')
+        if idx == len(self):
+            return len(self)
+        return int(self._time_order[idx])
+
+    def offset_of(self, dgram_num):
+        """Return the byte offset of datagram number ``dgram_num``.
+
+        The end of the indexed data is returned for ``dgram_num == len(self)``.
+        """
+        if dgram_num == len(self):
+            return self.end_offset
+        return int(self.records['offset'][dgram_num])
@@ -13,9 +13,13 @@ TODO: fix docstring
 """
 
 from io import BufferedReader, FileIO, SEEK_SET, SEEK_CUR, SEEK_END
+import os
+import re
+import mmap
 import struct
 import logging
 from . import ek60_raw_parsers as parsers
+from .ek60_raw_index import RawDatagramIndex
 
 __all__ = ['RawSimradFile', 'SimradEOF']
 
@@ -69,6 +73,15 @@ class RawSimradFile(BufferedReader):
     """
     A low-level extension of the built in python file object allowing the reading/writing
     of SIMRAD RAW files on datagram by datagram basis (instead of at the byte level)
+
+    When opened with ``use_mmap=True`` the file is memory-mapped and datagrams are
+    walked over a ``memoryview`` of the mapping instead of being copied through the
+    read buffer. RAW datagram power/angle arrays are then returned as read-only views
+    into the mapping, and ``return_raw=True`` returns ``memoryview`` objects.
+
+    When opened with ``use_index=True`` a ``RawDatagramIndex`` of the file is built, or loaded
+    from an up-to-date sidecar file, and ``seek``/``seek_time`` jump directly to a datagram
+    instead of walking through the file.
     """
 
     #: Dict object with datagram header/python class key/value pairs
@@ -79,7 +92,14 @@ class RawSimradFile(BufferedReader):
                       'BOT': parsers.SimradBottomParser(),
                       'DEP': parsers.SimradDepthParser()}
 
-    def __init__(self, name, mode='rb', closefd=True, return_raw=False, buffer_size=1024 * 1024):
+    #: Matches the type field of the datagrams in DGRAM_TYPE_KEY, used to resynchronize after bad datagrams
+    DGRAM_TYPE_RE = re.compile(rb'(?:RAW|CON|TAG|NME|BOT|DEP)\d')
+
+    #: Number of bytes scanned at once when resynchronizing
+    RESYNC_BUFFER_SIZE = 1024 * 1024
+
+    def __init__(self, name, mode='rb', closefd=True, return_raw=False, buffer_size=1024 * 1024,
+                 use_mmap=False, use_index=False):
 
         #  9-28-18 RHT: Changed RawSimradFile to implement BufferedReader instead of
         #  io.FileIO to increase performance.
@@ -92,6 +112,65 @@ class RawSimradFile(BufferedReader):
         self._current_dgram_offset = 0
         self._total_dgram_count = None
         self._return_raw = return_raw
+        self._bytes_skipped = 0
+
+        # Memory-mapped access, see _open_mmap()
+        self._mmap = None
+        self._mview = None
+        self._mmap_pos = 0
+        if use_mmap:
+            self._open_mmap(fio)
+
+        self._index = RawDatagramIndex.from_file(name) if use_index else None
+
+    def _open_mmap(self, fio):
+        '''
+        Maps the whole file read-only and keeps a memoryview of the mapping so that
+        datagrams can be sliced without copying.
+        '''
+
+        if os.fstat(fio.fileno()).st_size > 0:
+            self._mmap = mmap.mmap(fio.fileno(), 0, access=mmap.ACCESS_READ)
+            self._mview = memoryview(self._mmap)
+        else:
+            # Empty files cannot be mapped
+            self._mview = memoryview(b'')
+
+    @property
+    def use_mmap(self):
+        return self._mview is not None
+
+    @property
+    def index(self):
+        return self._index
+
+    @property
+    def bytes_skipped(self):
+        '''
+        Total number of bytes skipped while resynchronizing after bad datagrams.
+        '''
+        return self._bytes_skipped
+
+    def close(self):
+        '''
+        Closes the file and releases the memory map (if any).
+        '''
+
+        self._close_mmap()
+        BufferedReader.close(self)
+
+    def _close_mmap(self):
+        if self._mview is not None:
+            self._mview.release()
+            self._mview = None
+            if self._mmap is not None:
+                try:
+                    self._mmap.close()
+                except BufferError:
+                    # Sample arrays returned from this file are still views into the
+                    # mapping: it is unmapped once the last of them is garbage collected.
+                    pass
+                self._mmap = None
 
     def _seek_bytes(self, bytes_, whence=0):
         '''
@@ -103,13 +182,29 @@ class RawSimradFile(BufferedReader):
         Seeks a file by bytes instead of datagrams.
         '''
 
-        BufferedReader.seek(self, bytes_, whence)
+        if self._mview is not None:
+            if whence == SEEK_SET:
+                new_pos = bytes_
+            elif whence == SEEK_CUR:
+                new_pos = self._mmap_pos + bytes_
+            elif whence == SEEK_END:
+                new_pos = len(self._mview) + bytes_
+            else:
+                raise ValueError('Illegal value for \'whence\' (%s)' % str(whence))
+
+            if new_pos < 0:
+                raise IOError('Negative seek position %d' % new_pos)
+            self._mmap_pos = new_pos
+        else:
+            BufferedReader.seek(self, bytes_, whence)
 
     def _tell_bytes(self):
         '''
         Returns the file pointer position in bytes.
         '''
 
+        if self._mview is not None:
+            return self._mmap_pos
         return BufferedReader.tell(self)
 
     def _read_dgram_size(self):
@@ -158,13 +253,13 @@ class RawSimradFile(BufferedReader):
         (long lowDateField, long highDateField)
         """
 
+        # A short read of the size or timestamp only happens in the last bytes of the file,
+        # which are then stray bytes or a header still being written rather than a datagram
+        header_pos = self._tell_bytes()
         try:
             dgram_size = self._read_dgram_size()
-        except Exception:
-            if self.at_eof():
-                raise SimradEOF()
-            else:
-                raise
+        except DatagramReadError:
+            raise SimradEOF()
 
         buf = self._read_bytes(4)
 
@@ -178,17 +273,27 @@ class RawSimradFile(BufferedReader):
         else:
             dgram_type = buf
 
-        dgram_type = dgram_type.decode()
+        dgram_type = bytes(dgram_type).decode()
 
-        lowDateField, highDateField = self._read_timestamp()
+        try:
+            lowDateField, highDateField = self._read_timestamp()
+        except DatagramReadError:
+            self._seek_bytes(header_pos, SEEK_SET)
+            raise SimradEOF()
 
         return dict(size=dgram_size, type=dgram_type, low_date=lowDateField, high_date=highDateField)
 
     def _read_bytes(self, k):
         '''
         Reads raw bytes from the file
+
+        Returns a zero-copy memoryview slice of the mapping in mmap mode.
         '''
 
+        if self._mview is not None:
+            buf = self._mview[self._mmap_pos:self._mmap_pos + k]
+            self._mmap_pos += len(buf)
+            return buf
         return BufferedReader.read(self, k)
 
     def _read_next_dgram(self):
@@ -224,7 +329,7 @@ class RawSimradFile(BufferedReader):
             log.warning('Invalid datagram header: size: %d, type: %s, nt_date: %s.  dgram_size < 16',
                         header['size'], header['type'], str((header['low_date'], header['high_date'])))
 
-            self._find_next_datagram()
+            self._find_next_datagram(old_file_pos)
             return self._read_next_dgram()
 
         raw_dgram = self._read_bytes(header['size'])
@@ -236,7 +341,7 @@ class RawSimradFile(BufferedReader):
             #                        (header['size'], len(raw_dgram)), (old_file_pos, self.tell()))
             log.warning('Datagram %d (@%d) shorter than expected length:  %d < %d', self.tell(),
                         old_file_pos, bytes_read, header['size'])
-            self._find_next_datagram()
+            self._find_next_datagram(old_file_pos)
             return self._read_next_dgram()
 
         try:
@@ -252,7 +357,7 @@ class RawSimradFile(BufferedReader):
             log.warning('Datagram failed size check:  %d != %d @ (%d, %d)',
                         header['size'], dgram_size_check, self._tell_bytes(), self.tell())
             log.warning('Skipping to next datagram...')
-            self._find_next_datagram()
+            self._find_next_datagram(old_file_pos)
 
             return self._read_next_dgram()
 
@@ -273,13 +378,18 @@ class RawSimradFile(BufferedReader):
         Returns a formated datagram object using the data in raw_datagram_string
         '''
 
-        dgram_type = raw_datagram_string[:3].decode()
+        dgram_type = bytes(raw_datagram_string[:3]).decode()
         try:
             parser = self.DGRAM_TYPE_KEY[dgram_type]
         except KeyError:
             # raise KeyError('Unknown datagram type %s, valid types: %s' % (str(dgram_type), str(self.DGRAM_TYPE_KEY.keys())))
             return raw_datagram_string
 
+        # Only sample data is decoded straight from the mapping,
+        # the other (small) datagrams are string-parsed from a copy
+        if isinstance(raw_datagram_string, memoryview) and dgram_type != 'RAW':
+            raw_datagram_string = raw_datagram_string.tobytes()
+
         nice_dgram = parser.from_string(raw_datagram_string)
         return nice_dgram
 
@@ -294,6 +404,10 @@ class RawSimradFile(BufferedReader):
             raise ValueError(
                 'self._total_dgram_count has already been set.  Call .reset() first if you really want to recount')
 
+        if self._index is not None:
+            self._total_dgram_count = len(self._index)
+            return
+
         # Save current position for later
         old_file_pos = self._tell_bytes()
         old_dgram_offset = self.tell()
@@ -327,16 +441,54 @@ class RawSimradFile(BufferedReader):
             self._seek_bytes(offset, SEEK_END)
             return False
 
-    def read(self, k):
+    def read(self, k, types=None):
         '''
         :param k: Number of datagrams to read
         :type k: int
 
+        :param types: datagram types to read, either full ('RAW0') or without
+            version ('RAW'). Datagrams of other types are skipped without being read.
+        :type types: list
+
         Reads the next k datagrams.  A list of datagrams is returned if k > 1.  The entire
         file is read from the CURRENT POSITION if k < 0. (does not necessarily read from begining
         of file if previous datagrams were read)
         '''
 
+        if types is not None:
+            types = set(types)
+
+        if k == 1 and types is not None:
+            while True:
+                try:
+                    self._skip_to_type(types)
+                except Exception:
+                    if self.at_eof():
+                        raise SimradEOF()
+                    else:
+                        raise
+                dgram = self.read(1)
+
+                # a datagram of another type may follow corrupted data that was skipped while reading
+                if self._return_raw:
+                    dgram_type = bytes(dgram[:4]).decode()
+                else:
+                    dgram_type = dgram['type']
+                if dgram_type in types or dgram_type[:3] in types:
+                    return dgram
+
+        elif k > 1 and types is not None:
+            dgram_list = []
+
+            for m in range(k):
+                try:
+                    dgram_list.append(self.read(1, types=types))
+
+                except Exception:
+                    break
+
+            return dgram_list
+
         if k == 1:
             try:
                 return self._read_next_dgram()
@@ -361,30 +513,101 @@ class RawSimradFile(BufferedReader):
             return dgram_list
 
         elif k < 0:
-            return self.readall()
+            return self.readall(types=types)
 
-    def readall(self):
+    def _skip_to_type(self, types):
         '''
-        Reads the entire file from the beginning and returns a list of datagrams.
+        :param types: datagram types, either full ('RAW0') or without version ('RAW')
+        :type types: set
+
+        Skips forward to the next datagram of one of the given types, seeking
+        over the others using the size in their header.
+        '''
+
+        while True:
+            dgram_type = self.peek()['type']
+            if dgram_type in types or dgram_type[:3] in types:
+                return
+            self.skip()
+
+    def readall(self, types=None):
+        '''
+        Reads the entire file from the beginning and returns a list of datagrams,
+        optionally only those of the given types.
         '''
 
         self.seek(0, SEEK_SET)
         dgram_list = []
 
-        for raw_dgram in self.iter_dgrams():
+        for raw_dgram in self.iter_dgrams(types=types):
             dgram_list.append(raw_dgram)
 
         return dgram_list
 
-    def _find_next_datagram(self):
-        old_file_pos = self._tell_bytes()
+    def _find_next_datagram(self, bad_dgram_pos=None):
+        '''
+        :param bad_dgram_pos: byte offset of a datagram that could not be read,
+            defaults to searching from the current position
+        :type bad_dgram_pos: int
+
+        Positions the file at the start of the next valid datagram after
+        ``bad_dgram_pos``, or at the end of the file if there is none.
+
+        Large blocks of the file are searched for known datagram type tags, and each
+        candidate is only accepted if its leading and trailing size fields match.
+
+        Returns the number of bytes skipped.
+        '''
+
+        if bad_dgram_pos is None:
+            old_file_pos = self._tell_bytes()
+        else:
+            old_file_pos = bad_dgram_pos
+            self._seek_bytes(bad_dgram_pos + 1, SEEK_SET)
         log.warning('Attempting to find next valid datagram...')
 
-        while self.peek()['type'][:3] not in list(self.DGRAM_TYPE_KEY.keys()):
-            self._seek_bytes(1, 1)
+        block_pos = self._tell_bytes()
+        file_size = block_pos + self._bytes_remaining()
+        found_pos = None
+        while found_pos is None and block_pos + 8 <= file_size:
+            self._seek_bytes(block_pos, SEEK_SET)
+            buf = self._read_bytes(self.RESYNC_BUFFER_SIZE)
+            if isinstance(buf, memoryview):
+                buf = buf.tobytes()
+
+            # type tags start 4 bytes into the datagram, after the leading size
+            for match in self.DGRAM_TYPE_RE.finditer(buf, 4):
+                if self._is_valid_dgram_at(block_pos + match.start() - 4, file_size):
+                    found_pos = block_pos + match.start() - 4
+                    break
+
+            # overlap blocks so that a size field and type tag split between them are not missed
+            block_pos += max(len(buf) - 7, 1)
+
+        if found_pos is None:
+            found_pos = file_size
+            log.warning('No valid datagram found before the end of file')
+        self._seek_bytes(found_pos, SEEK_SET)
+
+        bytes_skipped = found_pos - old_file_pos
+        self._bytes_skipped += bytes_skipped
+        log.warning('Skipped ahead %d bytes', bytes_skipped)
+
+        return bytes_skipped
+
+    def _is_valid_dgram_at(self, pos, file_size):
+        '''
+        Checks whether the leading and trailing size fields of a datagram starting
+        at byte ``pos`` match.
+        '''
+
+        self._seek_bytes(pos, SEEK_SET)
+        dgram_size = struct.unpack('=l', self._read_bytes(4))[0]
+        if dgram_size < 16 or pos + dgram_size + 8 > file_size:
+            return False
 
-        log.warning('Found next datagram:  %s', self.peek())
-        log.warning('Skipped ahead %d bytes', self._tell_bytes() - old_file_pos)
+        self._seek_bytes(pos + 4 + dgram_size, SEEK_SET)
+        return struct.unpack('=l', self._read_bytes(4))[0] == dgram_size
 
     def tell(self):
         '''
@@ -433,24 +656,31 @@ class RawSimradFile(BufferedReader):
 
         # dgram_size, dgram_type, (low_date, high_date) = self.peek()[:3]
 
+        old_file_pos = self._tell_bytes()
         header = self.peek()
 
         if header['size'] < 16:
             log.warning('Invalid datagram header: size: %d, type: %s, nt_date: %s.  dgram_size < 16',
                         header['size'], header['type'], str((header['low_date'], header['high_date'])))
 
-            self._find_next_datagram()
+            self._find_next_datagram(old_file_pos)
 
         else:
             self._seek_bytes(header['size'] + 4, SEEK_CUR)
-            dgram_size_check = self._read_dgram_size()
+            try:
+                dgram_size_check = self._read_dgram_size()
+            except DatagramReadError:
+                log.warning('Datagram %d (@%d) extends beyond end of file', self.tell(), old_file_pos)
+                self._find_next_datagram(old_file_pos)
+                self._current_dgram_offset += 1
+                return
 
             if header['size'] != dgram_size_check:
                 log.warning('Datagram failed size check:  %d != %d @ (%d, %d)',
                             header['size'], dgram_size_check, self._tell_bytes(), self.tell())
                 log.warning('Skipping to next datagram... (in skip)')
 
-                self._find_next_datagram()
+                self._find_next_datagram(old_file_pos)
 
         self._current_dgram_offset += 1
 
@@ -490,8 +720,12 @@ class RawSimradFile(BufferedReader):
 
         self._current_dgram_offset -= 1
 
-    def iter_dgrams(self):
+    def iter_dgrams(self, types=None):
         '''
+        :param types: datagram types to iterate over, either full ('RAW0') or without
+            version ('RAW'). Datagrams of other types are skipped without being read.
+        :type types: list
+
         Iterates through the file, repeatedly calling self.next() until
         the end of file is reached
         '''
@@ -501,10 +735,10 @@ class RawSimradFile(BufferedReader):
             # yield new_dgram
 
             try:
-                new_dgram = next(self)
+                new_dgram = self.read(1, types=types)
             except Exception:
                 log.debug('Caught EOF?')
-                raise StopIteration
+                return
 
             yield new_dgram
 
@@ -527,6 +761,10 @@ class RawSimradFile(BufferedReader):
         instead of raw bytes.
         '''
 
+        if self._index is not None:
+            self._seek_indexed(offset, whence)
+            return
+
         if whence == SEEK_SET:
             if offset < 0:
                 raise ValueError('Cannot seek backwards from beginning of file')
@@ -560,6 +798,42 @@ class RawSimradFile(BufferedReader):
             for k in range(-offset):
                 self.skip_back()
 
+    def _seek_indexed(self, offset, whence):
+        '''
+        Seeks to a datagram using the byte offsets in the datagram index.
+        '''
+
+        if whence == SEEK_SET:
+            dgram_num = offset
+        elif whence == SEEK_CUR:
+            dgram_num = self.tell() + offset
+        elif whence == SEEK_END:
+            if offset > 0:
+                raise ValueError('Use negative offsets when seeking backward from end of file')
+            dgram_num = len(self._index) + offset
+        else:
+            raise ValueError(
+                'Illegal value for \'whence\' (%s), use 0 (beginning), 1 (current), or 2 (end)' % (str(whence)))
+
+        if dgram_num < 0 or dgram_num > len(self._index):
+            raise ValueError('Datagram %d is out of the indexed range' % dgram_num)
+
+        self._seek_bytes(self._index.offset_of(dgram_num), SEEK_SET)
+        self._current_dgram_offset = dgram_num
+
+    def seek_time(self, time):
+        '''
+        :param time: timestamp to seek to
+        :type time: numpy.datetime64
+
+        Positions the file at the first datagram with a timestamp at or after ``time``.
+        Requires the file to be opened with ``use_index=True``.
+        '''
+
+        if self._index is None:
+            raise ValueError('seek_time requires a datagram index, open the file with use_index=True')
+        self.seek(self._index.locate_time(time), SEEK_SET)
+
     def reset(self):
         self._current_dgram_offset = 0
         self._total_dgram_count = None
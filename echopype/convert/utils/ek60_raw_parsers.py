@@ -18,7 +18,7 @@ import logging
 import struct
 import re
 import sys
-from .ek60_date_conversion import nt_to_unix
+from .ek60_date_conversion import nt_to_datetime64
 
 
 __all__ = ['SimradNMEAParser', 'SimradDepthParser', 'SimradBottomParser',
@@ -30,6 +30,10 @@ class _SimradDatagramParser(object):
     '''
     '''
 
+    # numpy equivalents of the standard-size struct format codes
+    _dtype_codes = {'b': 'i1', 'B': 'u1', 'h': '<i2', 'H': '<u2', 'l': '<i4', 'L': '<u4',
+                    'f': '<f4', 'd': '<f8'}
+
     def __init__(self, header_type, header_formats):
         self._id      = header_type
         self._headers = header_formats
@@ -47,6 +51,21 @@ class _SimradDatagramParser(object):
     def header(self, version=0):
         return self._headers[version][:]
 
+    def header_dtype(self, version=0):
+        '''
+        Returns the header layout as a little-endian numpy structured dtype
+        '''
+        fields = []
+        for name, fmt in self._headers[version]:
+            count, code = re.match(r'(\d*)(\w)', fmt).groups()
+            if code == 's':
+                fields.append((name, 'S' + count))
+            elif count:
+                fields.append((name, self._dtype_codes[code], (int(count),)))
+            else:
+                fields.append((name, self._dtype_codes[code]))
+        return np.dtype(fields)
+
 
     def validate_data_header(self, data):
 
@@ -71,7 +90,7 @@ class _SimradDatagramParser(object):
 
     def from_string(self, raw_string):
 
-        header = raw_string[:4]
+        header = bytes(raw_string[:4])
         if (sys.version_info.major > 2):
             header = header.decode()
         id_, version = self.validate_data_header(header)
@@ -102,7 +121,7 @@ class SimradDepthParser(_SimradDatagramParser):
         type:         string == 'DEP0'
         low_date:     long uint representing LSBytes of 64bit NT date
         high_date:    long uint representing MSBytes of 64bit NT date
-        timestamp:    datetime.datetime object of NT date, assumed to be UTC
+        timestamp:    numpy.datetime64[ns] of NT date, UTC
         transceiver_count:  [long uint] with number of tranceivers
 
         depth:        [float], one value for each active channel
@@ -140,7 +159,7 @@ class SimradDepthParser(_SimradDatagramParser):
             if isinstance(data[field], bytes):
                 data[field] = data[field].decode()
 
-        data['timestamp'] = nt_to_unix((data['low_date'], data['high_date']))
+        data['timestamp'] = nt_to_datetime64(data['low_date'], data['high_date'])
 
         if version == 0:
             data_fmt    = '=3f'
@@ -198,7 +217,7 @@ class SimradBottomParser(_SimradDatagramParser):
         type:         string == 'BOT0'
         low_date:     long uint representing LSBytes of 64bit NT date
         high_date:    long uint representing MSBytes of 64bit NT date
-        datetime:     datetime.datetime object of NT date converted to UTC
+        timestamp:    numpy.datetime64[ns] of NT date, UTC
         transceiver_count:  long uint with number of tranceivers
         depth:        [float], one value for each active channel
 
@@ -233,7 +252,7 @@ class SimradBottomParser(_SimradDatagramParser):
             if isinstance(data[field], bytes):
                 data[field] = data[field].decode()
 
-        data['timestamp'] = nt_to_unix((data['low_date'], data['high_date']))
+        data['timestamp'] = nt_to_datetime64(data['low_date'], data['high_date'])
 
         if version == 0:
             depth_fmt    = '=%dd' %(data['transceiver_count'],)
@@ -274,7 +293,7 @@ class SimradAnnotationParser(_SimradDatagramParser):
         type:         string == 'TAG0'
         low_date:     long uint representing LSBytes of 64bit NT date
         high_date:    long uint representing MSBytes of 64bit NT date
-        timestamp:     datetime.datetime object of NT date, assumed to be UTC
+        timestamp:     numpy.datetime64[ns] of NT date, UTC
 
         text:         Annotation
 
@@ -310,7 +329,7 @@ class SimradAnnotationParser(_SimradDatagramParser):
             if isinstance(data[field], bytes):
                 data[field] = data[field].decode()
 
-        data['timestamp'] = nt_to_unix((data['low_date'], data['high_date']))
+        data['timestamp'] = nt_to_datetime64(data['low_date'], data['high_date'])
 
 #        if version == 0:
 #            data['text'] = raw_string[self.header_size(version):].strip('\x00')
@@ -361,7 +380,7 @@ class SimradNMEAParser(_SimradDatagramParser):
         type:         string == 'NME0'
         low_date:     long uint representing LSBytes of 64bit NT date
         high_date:    long uint representing MSBytes of 64bit NT date
-        timestamp:     datetime.datetime object of NT date, assumed to be UTC
+        timestamp:     numpy.datetime64[ns] of NT date, UTC
 
         nmea_string:  full (original) NMEA string
 
@@ -404,7 +423,7 @@ class SimradNMEAParser(_SimradDatagramParser):
             if isinstance(data[field], bytes):
                 data[field] = data[field].decode()
 
-        data['timestamp'] = nt_to_unix((data['low_date'], data['high_date']))
+        data['timestamp'] = nt_to_datetime64(data['low_date'], data['high_date'])
 
         if version == 0:
             if (sys.version_info.major > 2):
@@ -461,7 +480,7 @@ class SimradConfigParser(_SimradDatagramParser):
         type:         string == 'CON0'
         low_date:     long uint representing LSBytes of 64bit NT date
         high_date:    long uint representing MSBytes of 64bit NT date
-        timestamp:    datetime.datetime object of NT date, assumed to be UTC
+        timestamp:    numpy.datetime64[ns] of NT date, UTC
 
         survey_name                     [str]
         transect_name                   [str]
@@ -659,7 +678,7 @@ class SimradConfigParser(_SimradDatagramParser):
             if (sys.version_info.major > 2) and isinstance(data[field], bytes):
                 data[field] = data[field].decode('latin_1')
 
-        data['timestamp'] = nt_to_unix((data['low_date'], data['high_date']))
+        data['timestamp'] = nt_to_datetime64(data['low_date'], data['high_date'])
 
         if version == 0:
 
@@ -827,7 +846,7 @@ class SimradConfigParser(_SimradDatagramParser):
 #         type:         string == 'CON1'
 #         low_date:     long uint representing LSBytes of 64bit NT date
 #         high_date:    long uint representing MSBytes of 64bit NT date
-#         timestamp:    datetime.datetime object of NT date, assumed to be UTC
+#         timestamp:    numpy.datetime64[ns] of NT date, UTC
 
 
 #         beam_config             [str]    xml string
@@ -841,7 +860,7 @@ class SimradRawParser(_SimradDatagramParser):
         type:         string == 'RAW0'
         low_date:     long uint representing LSBytes of 64bit NT date
         high_date:    long uint representing MSBytes of 64bit NT date
-        timestamp:    datetime.datetime object of NT date, assumed to be UTC
+        timestamp:    numpy.datetime64[ns] of NT date, UTC
 
         channel                         [short] Channel number
         mode                            [short] 1 = Power only, 2 = Angle only 3 = Power & Angle
@@ -900,6 +919,22 @@ class SimradRawParser(_SimradDatagramParser):
                     }
         _SimradDatagramParser.__init__(self, 'RAW', headers)
 
+    def unpack_headers(self, buffer, offsets, version=0):
+        '''
+        :param buffer: contents of a whole .raw file (bytes, mmap or uint8 array)
+        :param offsets: byte offsets of the RAW datagrams in buffer, pointing past the
+            leading datagram size (i.e. at the 'RAW0' type field)
+        :type offsets: array of int
+
+        Decodes the fixed-size headers of many RAW datagrams at once and returns them as a
+        numpy structured array with one record per datagram and one column per header field.
+        '''
+        dtype = self.header_dtype(version)
+        buf = np.frombuffer(buffer, dtype='u1')
+        offsets = np.asarray(offsets, dtype='int64')
+        raw_headers = buf[offsets[:, None] + np.arange(dtype.itemsize)]
+        return raw_headers.view(dtype)[:, 0]
+
     def _unpack_contents(self, raw_string, version):
 
         header_values = struct.unpack(self.header_fmt(version), raw_string[:self.header_size(version)])
@@ -912,7 +947,7 @@ class SimradRawParser(_SimradDatagramParser):
                 if isinstance(data[field], bytes):
                     data[field] = data[field].decode()
 
-            data['timestamp'] = nt_to_unix((data['low_date'], data['high_date']))
+            data['timestamp'] = nt_to_datetime64(data['low_date'], data['high_date'])
 
             if data['count'] > 0:
                 block_size = data['count'] * 2
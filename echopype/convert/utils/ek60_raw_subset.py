@@ -0,0 +1,221 @@
+"""
+Functions to subset and split EK60 ``.raw`` files at the datagram level.
+
+Datagrams are located with the datagram index in ``ek60_raw_index.py`` and copied
+byte for byte into a new ``.raw`` file, without decoding the sample data. Only the
+configuration datagram and the channel numbers of RAW datagrams are rewritten when
+a subset of the channels is kept, with the RAW datagrams of each ping put in the
+new channel order.
+"""
+
+import os
+import struct
+import numpy as np
+from .ek60_raw_index import RawDatagramIndex
+from .ek60_raw_parsers import SimradConfigParser
+from .ek60_date_conversion import nt_to_datetime64
+
+__all__ = ['subset_raw', 'split_raw']
+
+_config_parser = SimradConfigParser()
+
+# Byte offset of the channel number of a RAW datagram from the leading size field
+_RAW_CHANNEL_OFFSET = 16
+
+
+def _ping_nt_time(records):
+    """Return the NT time of each datagram, with RAW datagrams taking the time of their ping.
+
+    The time of a ping is the time of its datagram from the first channel, so that
+    selecting datagrams by time never splits the channels of a ping.
+    """
+    nt_time = records['nt_time'].astype('int64')
+    is_raw = records['type'].astype('S3') == b'RAW'
+    seq = np.arange(len(records))
+    last_ping_start = np.maximum.accumulate(np.where(is_raw & (records['channel'] == 1), seq, -1))
+    in_ping = is_raw & (last_ping_start >= 0)
+    nt_time[in_ping] = nt_time[last_ping_start[in_ping]]
+    return nt_time
+
+
+def _subset_config(config_bytes, channels):
+    """Return a configuration datagram with only the given channels.
+
+    Parameters
+    ----------
+    config_bytes : bytes
+        configuration datagram including the leading and trailing size fields
+    channels : list of int
+        channel numbers to keep, in their order in the new file
+    """
+    body = config_bytes[4:-4]
+    config = _config_parser.from_string(body)
+    header_size = _config_parser.header_size(0)
+    transducer_header = _config_parser._transducer_headers.get(config['sounder_name'],
+                                                               _config_parser._transducer_headers['ER60'])
+    txcvr_size = struct.calcsize('=' + ''.join([x[1] for x in transducer_header]))
+
+    txcvr_bytes = [body[header_size + (ch - 1) * txcvr_size:header_size + ch * txcvr_size] for ch in channels]
+    new_body = body[:header_size - 4] + struct.pack('=l', len(channels)) + b''.join(txcvr_bytes)
+    return _config_parser.finalize_datagram(new_body)
+
+
+def _channel_order(records, ping_nt_time, channel_map):
+    """Return the order of datagrams that puts the RAW datagrams of each ping in their new channel order.
+
+    The RAW datagrams of a ping take the places of the ping's RAW datagrams in the file,
+    and the other datagrams keep their places.
+
+    Parameters
+    ----------
+    records : np.ndarray
+        index records of the selected datagrams
+    ping_nt_time : np.ndarray
+        NT time of each datagram, with RAW datagrams taking the time of their ping
+    channel_map : np.ndarray
+        new channel number of each old channel number
+    """
+    order = np.arange(len(records))
+    raw_pos = np.flatnonzero(records['type'].astype('S3') == b'RAW')
+    ping = ping_nt_time[raw_pos]
+    new_channel = channel_map[records['channel'][raw_pos]]
+    order[raw_pos[np.lexsort((raw_pos, ping))]] = raw_pos[np.lexsort((new_channel, ping))]
+    return order
+
+
+def subset_raw(raw_path, out_path, start_time=None, end_time=None, channels=None, index=None):
+    """Copy the datagrams of an EK60 ``.raw`` file in a time window and/or of some channels to a new file.
+
+    The configuration datagram(s) at the head of the file are always kept. Other datagrams
+    are selected by their timestamp, and RAW datagrams by the time of their ping, so that pings
+    are not split at the edges of the window. Datagrams are copied without decoding.
+
+    Parameters
+    ----------
+    raw_path : str
+        path to the ``.raw`` file
+    out_path : str
+        path to the new ``.raw`` file
+    start_time : np.datetime64
+        first time to include. Defaults to the start of the file
+    end_time : np.datetime64
+        time to stop at (excluded). Defaults to the end of the file
+    channels : list of int
+        channel numbers to keep. Channels are renumbered from 1 in the new file,
+        in the order of this list. Defaults to keeping all channels
+    index : RawDatagramIndex
+        datagram index of the file, if already loaded
+
+    Returns
+    -------
+    Number of datagrams written
+    """
+    if os.path.abspath(out_path) == os.path.abspath(raw_path):
+        raise ValueError('Cannot subset %s onto itself' % raw_path)
+    if index is None:
+        index = RawDatagramIndex.from_file(raw_path)
+    records = index.records
+
+    # Configuration datagrams at the head of the file
+    n_config = 0
+    while n_config < len(records) and records['type'][n_config].startswith(b'CON'):
+        n_config += 1
+    if n_config == 0:
+        raise ValueError('%s does not start with a configuration datagram' % raw_path)
+
+    mask = np.ones(len(records), dtype=bool)
+    mask[:n_config] = False
+    nt_time = _ping_nt_time(records)
+    if start_time is not None:
+        mask &= nt_time >= np.int64(index.to_nt(start_time))
+    if end_time is not None:
+        mask &= nt_time < np.int64(index.to_nt(end_time))
+    channel_map = None
+    if channels is not None:
+        channels = list(channels)
+        mask &= index.select(channels=channels)
+        channel_map = np.zeros(max(channels) + 1, dtype='int16')
+        channel_map[channels] = np.arange(1, len(channels) + 1)
+    selected = records[mask]
+    if channel_map is not None:
+        selected = selected[_channel_order(selected, nt_time[mask], channel_map)]
+
+    raw_file = np.memmap(raw_path, dtype='u1', mode='r')
+    with open(out_path, 'wb') as out:
+        for rec in records[:n_config]:
+            config_bytes = raw_file[rec['offset']:rec['offset'] + rec['size'] + 8].tobytes()
+            if channels is not None and rec['type'] == b'CON0':
+                config_bytes = _subset_config(config_bytes, channels)
+            out.write(config_bytes)
+
+        # Copy runs of datagrams that are contiguous in the file with one write each
+        run_ends = selected['offset'] + selected['size'] + 8
+        run_breaks = np.flatnonzero(selected['offset'][1:] != run_ends[:-1]) + 1
+        for run in np.split(np.arange(len(selected)), run_breaks):
+            if run.size == 0:
+                continue
+            run_start = selected['offset'][run[0]]
+            run_bytes = raw_file[run_start:run_ends[run[-1]]]
+            if channel_map is not None:
+                run_bytes = np.array(run_bytes)
+                is_raw = selected['type'][run].astype('S3') == b'RAW'
+                pos = selected['offset'][run][is_raw] - run_start + _RAW_CHANNEL_OFFSET
+                new_channel = channel_map[selected['channel'][run][is_raw]].astype('<i2')
+                run_bytes[pos[:, None] + np.arange(2)] = new_channel.view('u1').reshape((-1, 2))
+            out.write(run_bytes.tobytes())
+
+    return n_config + len(selected)
+
+
+def split_raw(raw_path, out_dir=None, interval=np.timedelta64(1, 'h')):
+    """Split an EK60 ``.raw`` file into files covering consecutive time intervals.
+
+    Intervals are aligned to multiples of ``interval`` (e.g. to whole hours), and each
+    new file is named after the time of its first datagram following the
+    ``<prefix>-DYYYYMMDD-THHMMSS.raw`` convention of the input file. The first new file
+    usually has the name of the input file, so they are saved to a separate directory.
+
+    Parameters
+    ----------
+    raw_path : str
+        path to the ``.raw`` file
+    out_dir : str
+        directory to save the new files in, created if it does not exist. Must not be
+        the directory of ``raw_path``. Defaults to ``<raw_path without extension>_split``
+    interval : np.timedelta64
+        length of time covered by each new file. Defaults to 1 hour
+
+    Returns
+    -------
+    List of paths to the new files
+    """
+    index = RawDatagramIndex.from_file(raw_path)
+    records = index.records
+    is_config = records['type'].astype('S3') == b'CON'
+    nt_time = _ping_nt_time(records)[~is_config]
+    if nt_time.size == 0:
+        return []
+
+    if out_dir is None:
+        out_dir = os.path.splitext(raw_path)[0] + '_split'
+    if os.path.abspath(out_dir) == os.path.abspath(os.path.dirname(raw_path)):
+        raise ValueError('Cannot split %s into its own directory' % raw_path)
+    os.makedirs(out_dir, exist_ok=True)
+    prefix = os.path.basename(raw_path).rsplit('-D', 1)[0]
+
+    # Interval containing each datagram, counted in whole intervals since the NT epoch
+    interval_nt = np.timedelta64(interval, 'ns').astype('int64') // 100
+    bins = np.unique(nt_time // interval_nt)
+
+    out_paths = []
+    for b in bins:
+        start_nt, end_nt = b * interval_nt, (b + 1) * interval_nt
+        first_nt = nt_time[nt_time >= start_nt].min()
+        first_time = nt_to_datetime64(first_nt & 0xFFFFFFFF, first_nt >> 32)
+        out_path = os.path.join(out_dir, '%s-D%s-T%s.raw' % (prefix,
+                                                             str(first_time)[:10].replace('-', ''),
+                                                             str(first_time)[11:19].replace(':', '')))
+        subset_raw(raw_path, out_path, start_time=int(start_nt), end_time=int(end_nt), index=index)
+        out_paths.append(out_path)
+
+    return out_paths
@@ -14,6 +14,36 @@ TODO: fix docstring
 
 
 import numpy as np
+import pynmea2
+
+# integer value of NaT in datetime64 arrays
+NAT_INT64 = np.iinfo('int64').min
+
+# Index of the latitude and longitude fields of the NMEA messages containing
+# a position, counting the talker and message ID as field 0. Each is followed
+# by its hemisphere field.
+POSITION_FIELDS = {'GGA': (2, 4), 'GLL': (1, 3), 'RMC': (3, 5)}
+
+# Index of the numeric fields in nmea_definitions of each NMEA message, counting
+# the talker and message ID as field 0.
+NUMERIC_FIELDS = {'HDT': {'heading_true': 1},
+                  'VTG': {'true_track': 1, 'spd_over_grnd_kts': 5},
+                  'SHR': {'roll': 4, 'pitch': 5, 'heave': 6},
+                  'VLW': {'trip_distance_nmi': 3}}
+
+# Range of the fields which are angles wrapping around 360 degrees
+ANGLE_FIELDS = {'longitude': (-180., 180.), 'heading_true': (0., 360.), 'true_track': (0., 360.)}
+
+# number of sentences decoded at once, bounding the memory of the char matrices
+DECODE_CHUNK_SIZE = 100000
+
+# value of hexadecimal digits indexed by their ASCII code, -1 for other characters
+_HEX_VALUE = np.full(256, -1, dtype='int16')
+_HEX_VALUE[np.frombuffer(b'0123456789ABCDEF', dtype='uint8')] = np.arange(16)
+_HEX_VALUE[np.frombuffer(b'abcdef', dtype='uint8')] = np.arange(10, 16)
+_IS_SPACE = np.zeros(256, dtype=bool)
+_IS_SPACE[np.frombuffer(b' \t\n\r\x0b\x0c', dtype='uint8')] = True
+
 
 class NMEAData(object):
     """The nmea_data class provides storage for and parsing of NMEA data commonly
@@ -31,7 +61,7 @@ class NMEAData(object):
         # Create arrays to store raw NMEA data as well as times, talkers,
         # and message IDs.
         self.raw_datagrams = np.empty(self.CHUNK_SIZE, dtype=object)
-        self.nmea_times = np.empty(self.CHUNK_SIZE, dtype='datetime64[ms]')
+        self.nmea_times = np.empty(self.CHUNK_SIZE, dtype='datetime64[ns]')
         self.talkers = np.empty(self.CHUNK_SIZE, dtype='U2')
         self.messages = np.empty(self.CHUNK_SIZE, dtype='U3')
 
@@ -39,6 +69,10 @@ class NMEAData(object):
         self.talker_ids = []
         self.message_ids = []
 
+        # Index of the talkers and message IDs of the datagrams at each timestamp,
+        # used to discard duplicate datagrams without searching all times.
+        self._time_index = {}
+
         # nmea_definitions define the NMEA message(s) and pynmea2.NMEASentence
         # attributes of those messages that the NMEA interpolation routine
         # will process. These definitions can also be used to define meta-types
@@ -100,12 +134,14 @@ class NMEAData(object):
 
             #  check if we're allowing duplicates and if this is one. We need
             #  to do this since .out files can contain duplicate NMEA data.
-            if (not allow_duplicates):
-                dup_idx = (self.nmea_times == time)
-                if (np.any(dup_idx)):
+            #  NaT never matches an existing time, so it is not indexed.
+            time_key = int(np.datetime64(time, 'ns').astype('int64'))
+            is_nat = time_key == NAT_INT64
+            if (not allow_duplicates) and (not is_nat):
+                my_ids = self._time_index.get(time_key)
+                if (my_ids is not None):
                     #  We have a time match - check the talker and message id
-                    my_talker = self.talkers[dup_idx]
-                    my_message = self.messages[dup_idx]
+                    my_talker, my_message = my_ids
                     if ((header[0:2] in my_talker) and (header[2:6] in my_message)):
                         #  this is the same - discard it
                         return
@@ -125,12 +161,151 @@ class NMEAData(object):
             self.nmea_times[self.n_raw-1] = time
             self.talkers[self.n_raw-1] = header[0:2]
             self.messages[self.n_raw-1] = header[2:6]
+            if not is_nat:
+                my_talker, my_message = self._time_index.setdefault(time_key, (set(), set()))
+                my_talker.add(header[0:2])
+                my_message.add(header[2:6])
 
             if not header[0:2] in self.talker_ids:
                 self.talker_ids.append(header[0:2])
             if not header[2:5] in self.message_ids:
                 self.message_ids.append(header[2:5])
 
+    def decode_position(self, idx):
+        """
+        Decode the latitude and longitude of GGA, GLL and RMC datagrams.
+
+        decode_position splits the sentences into comma separated fields and
+        converts the coordinates of all datagrams at once with numpy array
+        operations, giving the same signed decimal degrees as the latitude and
+        longitude attributes of pynmea2. Checksums are validated in bulk.
+        Sentences with a bad checksum or with fields that are not in the
+        expected format are parsed by pynmea2, and their position is NaN if
+        pynmea2 can not decode them either.
+
+        Args:
+            idx (array of int): Indices of the GGA, GLL or RMC datagrams to decode.
+
+        Returns:
+            Arrays of latitudes and longitudes in decimal degrees.
+        """
+        idx = np.asarray(idx, dtype=int)
+        lat = np.full(idx.size, np.nan)
+        lon = np.full(idx.size, np.nan)
+        for start in range(0, idx.size, DECODE_CHUNK_SIZE):
+            chunk = slice(start, start + DECODE_CHUNK_SIZE)
+            sentences = self.raw_datagrams[idx[chunk]]
+            chars, field_num, is_valid = _split_sentences(sentences)
+
+            # Field numbers of the position of each datagram
+            messages = self.messages[idx[chunk]]
+            fields = np.full((idx[chunk].size, 2), -1)
+            for message, message_fields in POSITION_FIELDS.items():
+                fields[messages == message] = message_fields
+            is_valid &= fields[:, 0] >= 0
+            lat_chunk, lat_ok = _decode_coordinate(chars, field_num, fields[:, 0], 'N', 'S')
+            lon_chunk, lon_ok = _decode_coordinate(chars, field_num, fields[:, 1], 'E', 'W')
+            is_valid &= lat_ok & lon_ok
+            lat[chunk] = np.where(is_valid, lat_chunk, np.nan)
+            lon[chunk] = np.where(is_valid, lon_chunk, np.nan)
+
+            # Leave malformed sentences to pynmea2
+            for i in np.flatnonzero(~is_valid):
+                try:
+                    msg = pynmea2.parse(sentences[i])
+                    lat[start + i], lon[start + i] = msg.latitude, msg.longitude
+                except (pynmea2.ParseError, AttributeError, ValueError):
+                    pass
+
+        return lat, lon
+
+    def decode_fields(self, idx, fields):
+        """
+        Decode fields listed in nmea_definitions from NMEA datagrams.
+
+        decode_fields splits all sentences at once and converts the fields
+        with numpy array operations. Latitude and longitude are decoded by
+        decode_position. Fields that are empty, not a number, not part of the
+        message of a datagram, or in a sentence with a bad checksum are NaN.
+
+        Args:
+            idx (array of int): Indices of the datagrams to decode.
+            fields (list of str): Names of the fields to decode.
+
+        Returns:
+            Dictionary with an array of the values of each field.
+        """
+        idx = np.asarray(idx, dtype=int)
+        values = {field: np.full(idx.size, np.nan) for field in fields}
+        if 'latitude' in fields or 'longitude' in fields:
+            lat, lon = self.decode_position(idx)
+            values.update({field: value for field, value in [('latitude', lat), ('longitude', lon)]
+                           if field in fields})
+
+        numeric_fields = [field for field in fields if field not in ('latitude', 'longitude')]
+        for start in range(0, idx.size if numeric_fields else 0, DECODE_CHUNK_SIZE):
+            chunk = slice(start, start + DECODE_CHUNK_SIZE)
+            chars, field_num, is_valid = _split_sentences(self.raw_datagrams[idx[chunk]])
+            messages = self.messages[idx[chunk]]
+            for field in numeric_fields:
+                field_idx = np.full(messages.size, -1)
+                for message, message_fields in NUMERIC_FIELDS.items():
+                    if field in message_fields:
+                        field_idx[messages == message] = message_fields[field]
+                number, is_number = _decode_number(chars, field_num, field_idx)
+                values[field][chunk] = np.where(is_valid & is_number & (field_idx >= 0), number, np.nan)
+
+        return values
+
+    def interpolate(self, meta_type, ping_times):
+        """
+        Interpolate the fields of a NMEA message type or meta-type onto ping times.
+
+        interpolate decodes the fields listed in nmea_definitions for all
+        datagrams of the messages of meta_type, and linearly interpolates each
+        field onto the ping times. Longitudes and headings are interpolated
+        along the shortest arc, so that crossing the antimeridian or north does
+        not give values on the opposite side. Ping times before the first or
+        after the last value of a field are NaN.
+
+        Args:
+            meta_type (str): Message type or meta-type defined in nmea_definitions.
+            ping_times (array of datetime64): Times to interpolate to.
+
+        Returns:
+            Dictionary with an array of the values of each field at the ping times.
+        """
+        definition = self.nmea_definitions[meta_type]
+        idx = np.flatnonzero(np.isin(self.messages[:self.n_raw], definition['message']))
+        values = self.decode_fields(idx, definition['fields'])
+
+        # Times in ns relative to the first ping, to keep their precision as floats
+        nmea_times = self.nmea_times[idx].astype('int64')
+        ping_times = np.asarray(ping_times, dtype='datetime64[ns]').astype('int64')
+        ref_time = ping_times[0] if ping_times.size else 0
+        order = np.argsort(nmea_times, kind='stable')
+        nmea_times = nmea_times[order]
+
+        interp = {}
+        for field, field_values in values.items():
+            field_values = field_values[order]
+            has_value = ~np.isnan(field_values) & (nmea_times != NAT_INT64)
+            interp[field] = np.full(ping_times.size, np.nan)
+            if not has_value.any():
+                continue
+            field_values = field_values[has_value]
+            if field in ANGLE_FIELDS:
+                field_values = np.unwrap(field_values, period=360.)
+            interp[field] = np.interp((ping_times - ref_time).astype('float64'),
+                                      (nmea_times[has_value] - ref_time).astype('float64'),
+                                      field_values, left=np.nan, right=np.nan)
+            interp[field][ping_times == NAT_INT64] = np.nan
+            if field in ANGLE_FIELDS:
+                lower, upper = ANGLE_FIELDS[field]
+                interp[field] = (interp[field] - lower) % (upper - lower) + lower
+
+        return interp
+
     def _resize_arrays(self, new_size):
         """
         Resize arrays if needed to hold more data.
@@ -185,3 +360,144 @@ class NMEAData(object):
             msg = msg + ("  nmea_data object contains no data\n")
 
         return msg
+
+
+def _split_sentences(sentences):
+    """
+    Convert NMEA sentences to a matrix of ASCII codes and validate their checksums.
+
+    Args:
+        sentences (array of str): NMEA sentences.
+
+    Returns:
+        chars (2d array of uint8): ASCII codes of the sentences, padded with 0.
+            Non-ASCII characters are replaced by '?'.
+        field_num (2d array of int16): Number of the comma separated field of
+            each character, -1 for the commas and the checksum.
+        is_valid (array of bool): Whether each sentence has the form
+            '$' + data + optional '*HH' checksum + optional whitespace, with a
+            matching checksum.
+    """
+    text = np.char.encode(np.asarray(sentences, dtype='U'), 'ascii', 'replace')
+    length = np.char.str_len(text)
+    chars = np.ascontiguousarray(text).view('uint8').reshape(text.size, -1)
+    pos = np.arange(chars.shape[1])
+    rows = np.arange(chars.shape[0])
+
+    is_star = chars == ord('*')
+    has_star = is_star.any(axis=1)
+    end = np.where(has_star, is_star.argmax(axis=1), length)
+
+    # The checksum is the XOR of the characters between '$' and '*'
+    in_body = (pos >= 1) & (pos < end[:, np.newaxis])
+    checksum = np.bitwise_xor.reduce(np.where(in_body, chars, 0), axis=1)
+    digits = _HEX_VALUE[chars[rows[:, np.newaxis], np.minimum(end[:, np.newaxis] + [1, 2], chars.shape[1] - 1)]]
+    in_tail = (pos >= end[:, np.newaxis] + 3) & (pos < length[:, np.newaxis])
+    checksum_ok = ((end + 3 <= length) & (digits >= 0).all(axis=1) &
+                   (digits[:, 0] * 16 + digits[:, 1] == checksum) &
+                   ~(in_tail & ~_IS_SPACE[chars]).any(axis=1))
+
+    is_valid = (length > 0) & (chars[:, 0] == ord('$')) & (is_star.sum(axis=1) <= 1) & \
+        np.where(has_star, checksum_ok, True)
+
+    is_comma = chars == ord(',')
+    field_num = np.cumsum(is_comma, axis=1, dtype='int16')
+    field_num[is_comma | (pos >= end[:, np.newaxis])] = -1
+    return chars, field_num, is_valid
+
+
+def _get_field(chars, field_num, field):
+    """
+    Extract one comma separated field of each sentence.
+
+    Args:
+        chars (2d array of uint8): ASCII codes of the sentences.
+        field_num (2d array of int16): Number of the field of each character.
+        field (array of int): Number of the field to extract from each sentence.
+
+    Returns:
+        ASCII codes of the fields padded with 0, and the length of each field.
+    """
+    in_field = field_num == field[:, np.newaxis]
+    length = in_field.sum(axis=1)
+    start = in_field.argmax(axis=1)
+    return _take_chars(chars, start, length), length
+
+
+def _take_chars(chars, start, length):
+    """
+    Take ``length`` characters from position ``start`` of each row of a char matrix.
+    """
+    width = max(int(length.max(initial=0)), 1)
+    pos = np.arange(width)
+    cols = np.minimum(start[:, np.newaxis] + pos, chars.shape[1] - 1)
+    out = chars[np.arange(chars.shape[0])[:, np.newaxis], cols]
+    out[pos >= length[:, np.newaxis]] = 0
+    return out
+
+
+def _to_float(chars, is_valid):
+    """
+    Convert rows of ASCII codes of decimal numbers to floats, with 0 for invalid rows.
+    """
+    text = np.ascontiguousarray(np.where(is_valid[:, np.newaxis], chars, 0)).view('S%d' % chars.shape[1]).ravel()
+    return np.where(is_valid, text, b'0').astype('float64')
+
+
+def _decode_number(chars, field_num, field):
+    """
+    Convert a field holding a decimal number to floats.
+
+    Args:
+        chars (2d array of uint8): ASCII codes of the sentences.
+        field_num (2d array of int16): Number of the field of each character.
+        field (array of int): Number of the field of each sentence.
+
+    Returns:
+        Numbers, and whether each field held a number.
+    """
+    number, length = _get_field(chars, field_num, field)
+    is_digit = (number >= ord('0')) & (number <= ord('9'))
+    n_dot = (number == ord('.')).sum(axis=1)
+    is_sign = (number == ord('+')) | (number == ord('-'))
+    has_sign = is_sign[:, 0]
+    is_number = (is_digit.sum(axis=1) >= 1) & (n_dot <= 1) & (is_sign.sum(axis=1) == has_sign) & \
+        (is_digit.sum(axis=1) + n_dot + has_sign == length)
+    return np.where(is_number, _to_float(number, is_number), np.nan), is_number
+
+
+def _decode_coordinate(chars, field_num, field, positive, negative):
+    """
+    Convert a coordinate given as degrees/minutes 'DDDMM.MMM' and its hemisphere
+    to signed decimal degrees in the same way as pynmea2.
+
+    Args:
+        chars (2d array of uint8): ASCII codes of the sentences.
+        field_num (2d array of int16): Number of the field of each character.
+        field (array of int): Number of the coordinate field of each sentence,
+            which is followed by the hemisphere field.
+        positive (str): Hemisphere of positive coordinates.
+        negative (str): Hemisphere of negative coordinates.
+
+    Returns:
+        Coordinates, and whether each coordinate was in the expected format.
+    """
+    dm, length = _get_field(chars, field_num, field)
+    pos = np.arange(dm.shape[1])
+    is_dot = dm == ord('.')
+    is_digit = (dm >= ord('0')) & (dm <= ord('9'))
+    dot = is_dot.argmax(axis=1)
+
+    # pynmea2 uses 0 for empty fields and '0', and otherwise needs a match of r'^(\d+)(\d\d\.\d+)$'
+    is_zero = (length == 0) | ((length == 1) & (dm[:, 0] == ord('0')))
+    is_dm = (is_dot.sum(axis=1) == 1) & (is_digit.sum(axis=1) == length - 1) & \
+        (dot >= 3) & (dot < length - 1)
+    degrees = _to_float(np.where(pos < dot[:, np.newaxis] - 2, dm, 0), is_dm)
+    minutes = _to_float(_take_chars(dm, dot - 2, length - dot + 2), is_dm)
+    sd = np.where(is_dm, degrees + minutes / 60, 0.)
+
+    hemisphere, hemisphere_len = _get_field(chars, field_num, field + 1)
+    sign = np.where(hemisphere_len != 1, 0.,
+                    np.where(hemisphere[:, 0] == ord(positive), 1.,
+                             np.where(hemisphere[:, 0] == ord(negative), -1., 0.)))
+    return np.where(sign == 0, 0., sign * sd), is_zero | is_dm
@@ -8,7 +8,8 @@ from .set_groups_azfp import SetGroupsAZFP
 
 
 class SetGroups:
-    def __new__(cls, file_path, echo_type, compress=True):
+    def __new__(cls, file_path, echo_type, compress=True, append=False, pack_data=False, appendable=False,
+                ragged=False, chunks=None):
         """Wrapper class to use for setting groups in .nc files.
 
         Parameters
@@ -17,8 +18,21 @@ class SetGroups:
             Path to .nc file to be generated
         echo_type: str
             Type of echosounder from which data were generated
-        compress: bool
-            Whether or not to compress the backscatter data
+        compress: bool, str or dict
+            Whether or not to compress the backscatter data, the name of a codec profile in CODEC_PROFILES,
+            or the encoding of each variable of the Beam group
+        append: bool
+            Whether or not to append data along the time dimensions of an existing file
+        pack_data: bool
+            Whether or not to store backscatter data as integers packed with a CF scale_factor
+        appendable: bool
+            Whether or not to create netCDF time dimensions as unlimited so that data can be appended later
+        ragged: bool
+            Whether or not to store backscatter data as contiguous ragged arrays
+            instead of padding shorter channels with NaN
+        chunks: dict
+            Chunk size of the backscatter data along each dimension, -1 for the whole dimension.
+            If `None`, the chunks are chosen by the backend
         Returns
         -------
             Returns a specialized SetGroups object depending on
@@ -27,8 +41,8 @@ class SetGroups:
 
         # Returns specific EchoData object
         if echo_type == "EK60":
-            return SetGroupsEK60(file_path, compress)
+            return SetGroupsEK60(file_path, compress, append, pack_data, appendable, ragged, chunks)
         elif echo_type == "AZFP":
-            return SetGroupsAZFP(file_path, compress)
+            return SetGroupsAZFP(file_path, compress, append, pack_data, appendable, ragged, chunks)
         else:
             raise ValueError("Unsupported file type")
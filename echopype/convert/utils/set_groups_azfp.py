@@ -1,8 +1,5 @@
 from .set_groups_base import SetGroupsBase
 import xarray as xr
-import netCDF4
-import zarr
-import os
 
 
 class SetGroupsAZFP(SetGroupsBase):
@@ -22,7 +19,7 @@ class SetGroupsAZFP(SetGroupsBase):
                          env_dict['sound_speed']
         """
         # Only save environment group if file_path exists
-        if not os.path.exists(self.file_path):
+        if not self._file_exists(self.file_path):
             print('netCDF file does not exist, exiting without saving Environment group...')
         else:
             ds = xr.Dataset({'temperature': (['ping_time'], env_dict['temperature'])},
@@ -36,10 +33,7 @@ class SetGroupsAZFP(SetGroupsBase):
                                    'units': "C"})
 
             # save to file
-            if self.format == '.nc':
-                ds.to_netcdf(path=self.file_path, mode='a', group='Environment')
-            elif self.format == '.zarr':
-                ds.to_zarr(store=self.file_path, mode='a', group='Environment')
+            self._add_group(ds, self.file_path, 'Environment')
 
     def set_platform(self, platform_dict):
         """Set the Platform group in the AZFP nc file. AZFP does not record pitch, roll, and heave.
@@ -49,15 +43,11 @@ class SetGroupsAZFP(SetGroupsBase):
         platform_dict
             dictionary containing platform parameters
         """
-        if not os.path.exists(self.file_path):
+        if not self._file_exists(self.file_path):
             print('netCDF file does not exist, exiting without saving Platform group...')
-        elif self.format == '.nc':
-            with netCDF4.Dataset(self.file_path, 'a', format='NETCDF4') as ncfile:
-                [ncfile.setncattr(k, v) for k, v in platform_dict.items()]
-        elif self.format == '.zarr':
-            zarrfile = zarr.open(self.file_path, mode='a')
-            for k, v in platform_dict.items():
-                zarrfile.attrs[k] = v
+        else:
+            # platform attributes are stored with the top-level attributes of the new file
+            self._new_files[self.file_path].update(platform_dict)
 
     def set_beam(self, beam_dict):
         """Set the Beam group in the AZFP nc file.
@@ -123,15 +113,14 @@ class SetGroupsAZFP(SetGroupsBase):
                                'tilt_Y_c': beam_dict['tilt_Y_c'],
                                'tilt_Y_d': beam_dict['tilt_Y_d']})
 
-        settings = {}
-        if self.format == '.nc':
-            if self.compress:
-                settings = {'backscatter_r': {'zlib': True, 'complevel': 4}}
-            ds.to_netcdf(path=self.file_path, mode='a', group='Beam', encoding=settings)
-        elif self.format == '.zarr':
-            if self.compress:
-                settings = {'backscatter_r': {'compressor': zarr.Blosc(cname='zstd', clevel=3, shuffle=2)}}
-            ds.to_zarr(store=self.file_path, mode='a', group='Beam', encoding=settings)
+        if self.ragged:
+            ds = self._to_ragged(ds, beam_dict['sample_count'], ['backscatter_r'])
+
+        settings = self._get_compression(ds, ['backscatter_r'])
+        chunks = self._get_chunk_shape(ds['backscatter_r'], ['ping_time'])
+        if chunks is not None:
+            settings.setdefault('backscatter_r', {})['chunksizes' if self.format == '.nc' else 'chunks'] = chunks
+        self._add_group(ds, self.file_path, 'Beam', encoding=settings)
 
     def set_vendor_specific(self, vendor_dict):
         """Set the Vendor-specific group in the AZFP nc file.
@@ -183,7 +172,4 @@ class SetGroupsAZFP(SetGroupsBase):
                 'number_of_channels': vendor_dict['number_of_channels']}
         )
 
-        if self.format == '.nc':
-            ds.to_netcdf(path=self.file_path, mode='a', group='Vendor')
-        elif self.format == '.zarr':
-            ds.to_zarr(store=self.file_path, mode='a', group='Vendor')
+        self._add_group(ds, self.file_path, 'Vendor')
@@ -5,28 +5,47 @@ import netCDF4
 import zarr
 import xarray as xr
 
+# Compression encoding of backscatter data in each output file format for each codec profile.
+# "balanced" is used for compress=True.
+CODEC_PROFILES = {
+    'fast': {'.nc': {'zlib': True, 'complevel': 1},
+             '.zarr': {'compressor': zarr.Blosc(cname='lz4', clevel=1, shuffle=zarr.Blosc.SHUFFLE)}},
+    'balanced': {'.nc': {'zlib': True, 'complevel': 4},
+                 '.zarr': {'compressor': zarr.Blosc(cname='zstd', clevel=3, shuffle=zarr.Blosc.BITSHUFFLE)}},
+    'archive': {'.nc': {'zlib': True, 'complevel': 9},
+                '.zarr': {'compressor': zarr.Blosc(cname='zstd', clevel=9, shuffle=zarr.Blosc.BITSHUFFLE)}},
+}
+
 
 class SetGroupsBase:
     """Base class for setting groups in netCDF file.
+
+    The ``set_*`` methods collect the groups in memory, and ``flush()`` writes all of them
+    to each output file in a single session: through one netCDF4 file handle, or to one
+    zarr store with its metadata consolidated once at the end.
     """
 
-    def __init__(self, file_path='test.nc', compress=True):
+    def __init__(self, file_path='test.nc', compress=True, append=False, pack_data=False, appendable=False,
+                 ragged=False, chunks=None):
         self.file_path = file_path
         filename, ext = os.path.splitext(file_path)
         self.format = ext
-        self.compress = compress
+        if isinstance(compress, str) and compress not in CODEC_PROFILES:
+            raise ValueError("Unknown codec profile '%s', must be one of %s" % (compress, list(CODEC_PROFILES)))
+        self.compress = compress   # bool, codec profile in CODEC_PROFILES or encoding of each variable
+        self.append = append   # append to the time dimensions of groups in an existing file
+        self.pack_data = pack_data   # store backscatter data as integers packed with a CF scale_factor
+        self.appendable = appendable   # create netCDF time dimensions as unlimited to allow appending
+        self.ragged = ragged   # store backscatter data as contiguous ragged arrays instead of padding channels
+        self.chunks = chunks   # chunk size of backscatter data along each dimension, see _get_chunk_shape()
+        self._new_files = {}   # top-level attributes of each file to be created by flush()
+        self._pending_groups = []   # groups to be written or appended by flush()
 
     def set_toplevel(self, tl_dict):
         """Set attributes in the Top-level group."""
-        if self.format == '.nc':
-            with netCDF4.Dataset(self.file_path, "w", format="NETCDF4") as ncfile:
-                [ncfile.setncattr(k, v) for k, v in tl_dict.items()]
-        elif self.format == '.zarr':
-            zarrfile = zarr.open(self.file_path, mode="w")
-            for k, v in tl_dict.items():
-                zarrfile.attrs[k] = v
-        else:
+        if self.format not in ('.nc', '.zarr'):
             raise ValueError("Unsupported file format")
+        self._new_files[self.file_path] = dict(tl_dict)
 
     def set_provenance(self, src_file_names, prov_dict):
         """Set the Provenance group in the nc file.
@@ -54,10 +73,7 @@ class SetGroupsBase:
             ds.attrs[k] = v
 
         # save to file
-        if self.format == '.nc':
-            ds.to_netcdf(path=self.file_path, mode='a', group='Provenance')
-        elif self.format == '.zarr':
-            ds.to_zarr(store=self.file_path, mode='a', group='Provenance')
+        self._add_group(ds, self.file_path, 'Provenance')
 
     def set_sonar(self, sonar_dict):
         """Set the Sonar group in the nc file.
@@ -67,23 +83,8 @@ class SetGroupsBase:
         sonar_dict
             dictionary containing sonar parameters
         """
-        # create group
-        if self.format == '.nc':
-            ncfile = netCDF4.Dataset(self.file_path, "a", format="NETCDF4")
-            snr = ncfile.createGroup("Sonar")
-
-            # set group attributes
-            for k, v in sonar_dict.items():
-                snr.setncattr(k, v)
-
-            # close nc file
-            ncfile.close()
-        elif self.format == '.zarr':
-            zarrfile = zarr.open(self.file_path, mode='a')
-            snr = zarrfile.create_group('Sonar')
-
-            for k, v in sonar_dict.items():
-                snr.attrs[k] = v
+        # create group with only attributes
+        self._add_group(xr.Dataset(attrs=sonar_dict), self.file_path, 'Sonar')
 
     def set_nmea(self, nmea_dict):
         """Set the Platform/NMEA group in the nc file.
@@ -94,13 +95,12 @@ class SetGroupsBase:
             dictionary containing platform parameters
         """
         # Only save platform group if file_path exists
-        if not os.path.exists(self.file_path):
+        if not self._file_exists(self.file_path):
             print('netCDF file does not exist, exiting without saving Platform group...')
         else:
-            # Convert np.datetime64 numbers to seconds since 1900-01-01
+            # Convert np.datetime64 numbers to integer nanoseconds since 1900-01-01
             # due to xarray.to_netcdf() error on encoding np.datetime64 objects directly
-            time = (nmea_dict['nmea_time'] - np.datetime64('1900-01-01T00:00:00')) \
-                   / np.timedelta64(1, 's')
+            time = (nmea_dict['nmea_time'] - np.datetime64('1900-01-01T00:00:00', 'ns')).astype('int64')
             ds = xr.Dataset(
                 {'NMEA_datagram': (['time'], nmea_dict['nmea_datagram'],
                                    {'long_name': 'NMEA datagram'})
@@ -110,10 +110,305 @@ class SetGroupsBase:
                                   'calendar': 'gregorian',
                                   'long_name': 'Timestamps for NMEA datagrams',
                                   'standard_name': 'time',
-                                  'units': 'seconds since 1900-01-01'})},
+                                  'units': 'nanoseconds since 1900-01-01'})},
                 attrs={'description': 'All NMEA sensor datagrams'})
             # save to file
+            self._write_group(ds, self.file_path, 'Platform/NMEA', ['time'])
+
+    @staticmethod
+    def _to_ragged(ds, sample_count, var_names):
+        """Store variables of dimensions [frequency x ping_time x range_bin] as CF contiguous ragged arrays.
+
+        The samples of all frequency channels are concatenated along a ``sample`` dimension,
+        so that each channel keeps its own number of range_bin instead of being padded
+        to the longest channel. The number of samples of each channel is stored in the
+        ``sample_count`` variable.
+
+        Parameters
+        ----------
+        ds : xr.Dataset
+            data of the group, with ``range_bin`` as the last dimension of the variables in ``var_names``
+        sample_count : np.ndarray
+            number of range_bin of each frequency channel
+        var_names : list of str
+            names of the variables to store as ragged arrays, skipped if not in ``ds``
+
+        Returns
+        -------
+        Dataset with the ragged variables of dimensions [ping_time x sample] and without ``range_bin``
+        """
+        sample_count = np.asarray(sample_count, dtype='int32')
+        ds = ds.drop_vars('range_bin')
+        for name in var_names:
+            if name in ds:
+                data = ds[name].values
+                ds[name] = (['ping_time', 'sample'],
+                            np.concatenate([data[ch, :, :n] for ch, n in enumerate(sample_count)], axis=-1),
+                            ds[name].attrs)
+        ds['sample_count'] = ('frequency', sample_count,
+                              {'long_name': 'Number of range_bin of each frequency channel',
+                               'sample_dimension': 'sample'})
+        return ds
+
+    def _get_compression(self, ds, var_names):
+        """Get the compression encoding of backscatter variables from ``self.compress``.
+
+        Parameters
+        ----------
+        ds : xr.Dataset
+            data of the group
+        var_names : list of str
+            names of the backscatter variables compressed with a codec profile, skipped if not in ``ds``
+
+        Returns
+        -------
+        Dictionary of the encoding of each compressed variable. If ``self.compress`` is a dictionary,
+        these are its encodings of the variables in ``ds``.
+        """
+        if isinstance(self.compress, dict):
+            return {name: dict(encoding) for name, encoding in self.compress.items() if name in ds}
+        if not self.compress:
+            return {}
+        profile = CODEC_PROFILES['balanced' if self.compress is True else self.compress]
+        return {name: dict(profile[self.format]) for name in var_names if name in ds}
+
+    def _get_chunk_shape(self, var, append_dims):
+        """Get the chunk shape of a variable from ``self.chunks``.
+
+        Dimensions with a chunk size of -1 or not in ``self.chunks`` are stored in one chunk.
+        Chunks are no longer than their dimension, except along the time dimensions
+        of files that are appended to later.
+
+        Parameters
+        ----------
+        var : xr.DataArray
+            variable to chunk
+        append_dims : list of str
+            time dimensions of the group
+
+        Returns
+        -------
+        Tuple of the chunk size along each dimension of the variable,
+        or `None` to let the backend choose if ``self.chunks`` is `None`
+        """
+        if self.chunks is None:
+            return None
+        shape = []
+        for dim, length in var.sizes.items():
+            size = self.chunks.get(dim, -1)
+            if size == -1:
+                size = length
+            elif not (self.appendable and dim in append_dims):
+                size = min(size, length)
+            shape.append(max(size, 1))
+        return tuple(shape)
+
+    def _file_exists(self, path):
+        """Whether the file exists or is created by ``set_toplevel()`` at the next ``flush()``."""
+        return path in self._new_files or os.path.exists(path)
+
+    def _add_group(self, ds, path, group, encoding=None, unlimited_dims=None):
+        """Collect a group to be written to a file by ``flush()``.
+
+        Parameters
+        ----------
+        ds : xr.Dataset
+            data of the group
+        path : str
+            path to the netCDF file or zarr store
+        group : str
+            path of the group in the file
+        encoding : dict
+            encoding of the variables of the group
+        unlimited_dims : list of str
+            dimensions to create as unlimited in netCDF files
+        """
+        self._pending_groups.append({'path': path, 'group': group, 'ds': ds, 'encoding': encoding,
+                                     'unlimited_dims': unlimited_dims, 'append_dims': None})
+
+    def _write_group(self, ds, path, group, append_dims, encoding=None):
+        """Write a group to a new file, or append it along its time dimension(s) if ``self.append``.
+
+        The group is written by the next ``flush()``.
+
+        Parameters
+        ----------
+        ds : xr.Dataset
+            data of the group
+        path : str
+            path to the netCDF file or zarr store
+        group : str
+            path of the group in the file
+        append_dims : list of str
+            time dimensions of the group. These are unlimited in netCDF files if ``self.appendable``
+        encoding : dict
+            encoding of the variables of the group, only used when creating the group
+        """
+        if self.append:
+            self._pending_groups.append({'path': path, 'group': group, 'ds': ds, 'append_dims': append_dims})
+        else:
+            self._add_group(ds, path, group, encoding=encoding,
+                            unlimited_dims=append_dims if self.appendable else None)
+
+    def flush(self):
+        """Write the groups collected by the ``set_*`` methods, opening each output file only once.
+
+        Files set by ``set_toplevel()`` are created, and the groups of other files are
+        added to or appended to the existing files.
+        """
+        paths = list(self._new_files) + [x['path'] for x in self._pending_groups]
+        for path in dict.fromkeys(paths):
+            attrs = self._new_files.get(path)
+            groups = [x for x in self._pending_groups if x['path'] == path]
             if self.format == '.nc':
-                ds.to_netcdf(path=self.file_path, mode='a', group='Platform/NMEA')
+                self._flush_netcdf(path, attrs, groups)
             elif self.format == '.zarr':
-                ds.to_zarr(store=self.file_path, mode='a', group='Platform/NMEA')
+                self._flush_zarr(path, attrs, groups)
+        self._new_files = {}
+        self._pending_groups = []
+
+    def to_datasets(self):
+        """Get the groups collected by the ``set_*`` methods as in-memory Datasets instead of writing them.
+
+        The Datasets are decoded as they would be when opened from a file, but without the encoding
+        of the output file format, such as compression, chunks and the packing of ``pack_data``.
+
+        Returns
+        -------
+        Dictionary of the groups of each output file, which are dictionaries of the Dataset of each group path,
+        with the top-level attributes in a ``Toplevel`` Dataset
+        """
+        datasets = {path: {'Toplevel': xr.Dataset(attrs=attrs)} for path, attrs in self._new_files.items()}
+        for x in self._pending_groups:
+            if x['append_dims'] is not None:
+                raise ValueError('Cannot append to the %s group of an in-memory Dataset' % x['group'])
+            datasets.setdefault(x['path'], {})[x['group']] = xr.decode_cf(x['ds'])
+        self._new_files = {}
+        self._pending_groups = []
+        return datasets
+
+    def _flush_netcdf(self, path, attrs, groups):
+        """Write groups to a netCDF file through a single file handle.
+
+        Parameters
+        ----------
+        path : str
+            path to the netCDF file
+        attrs : dict
+            top-level attributes of a new file, or `None` to add the groups to an existing file
+        groups : list of dict
+            groups collected by ``_add_group()`` and ``_write_group()``
+        """
+        with netCDF4.Dataset(path, 'a' if attrs is None else 'w', format='NETCDF4') as ncfile:
+            if attrs is not None:
+                ncfile.setncatts(attrs)
+            for x in groups:
+                if x['append_dims'] is not None:
+                    self._append_netcdf(x['ds'], ncfile, x['group'], x['append_dims'])
+                    continue
+                nc_group = ncfile
+                for name in x['group'].split('/'):
+                    nc_group = nc_group.groups[name] if name in nc_group.groups else nc_group.createGroup(name)
+                x['ds'].dump_to_store(xr.backends.NetCDF4DataStore(nc_group),
+                                      encoding=x['encoding'], unlimited_dims=x['unlimited_dims'])
+
+    def _flush_zarr(self, path, attrs, groups):
+        """Write groups to a zarr store and consolidate its metadata once at the end.
+
+        Parameters
+        ----------
+        path : str
+            path to the zarr store
+        attrs : dict
+            top-level attributes of a new store, or `None` to add the groups to an existing store
+        groups : list of dict
+            groups collected by ``_add_group()`` and ``_write_group()``
+        """
+        root = zarr.open_group(path, mode='a' if attrs is None else 'w')
+        if attrs is not None:
+            root.attrs.update(attrs)
+        for x in groups:
+            if x['append_dims'] is not None:
+                self._append_zarr(x['ds'], root.store, x['group'], x['append_dims'])
+            else:
+                x['ds'].to_zarr(store=root.store, mode='a', group=x['group'], encoding=x['encoding'],
+                                consolidated=False)
+        zarr.consolidate_metadata(root.store)
+
+    @staticmethod
+    def _append_netcdf(ds, ncfile, group, append_dims):
+        """Append the variables of a group along its unlimited time dimension(s) in an existing netCDF file.
+
+        Variables without any of the ``append_dims`` are left as they are in the file.
+        New data are encoded with the packing and fill value of the variables in the file.
+
+        Parameters
+        ----------
+        ds : xr.Dataset
+            new data of the group
+        ncfile : netCDF4.Dataset
+            netCDF file opened in append mode
+        group : str
+            path of the group in the file
+        append_dims : list of str
+            dimensions to append along
+        """
+        ds = xr.decode_cf(ds, decode_times=False)
+        nc_group = ncfile[group]
+        for dim, size in ds.sizes.items():
+            if dim in append_dims:
+                if not nc_group.dimensions[dim].isunlimited():
+                    raise ValueError('Cannot append to %s group: %s is not an unlimited dimension'
+                                     % (group, dim))
+            elif nc_group.dimensions[dim].size != size:
+                raise ValueError('Cannot append to %s group: length of %s changed from %d to %d'
+                                 % (group, dim, nc_group.dimensions[dim].size, size))
+
+        for dim in append_dims:
+            n_old = nc_group.dimensions[dim].size
+            for name, var in ds.variables.items():
+                if dim not in var.dims or var.sizes[dim] == 0:
+                    continue
+                nc_var = nc_group[name]
+                nc_var.set_auto_maskandscale(False)
+                var = var.copy(deep=False)
+                var.attrs = {}
+                var.encoding = {k: nc_var.getncattr(k) for k in ['scale_factor', 'add_offset', '_FillValue']
+                                if k in nc_var.ncattrs()}
+                if isinstance(nc_var.dtype, np.dtype):
+                    var.encoding['dtype'] = nc_var.dtype
+                data = xr.conventions.encode_cf_variable(var, name=name).values
+                idx = [slice(None)] * var.ndim
+                idx[var.dims.index(dim)] = slice(n_old, n_old + var.sizes[dim])
+                nc_var[tuple(idx)] = data
+
+    @staticmethod
+    def _append_zarr(ds, store, group, append_dims):
+        """Append the variables of a group along its time dimension(s) to an existing zarr store.
+
+        Variables without any of the ``append_dims`` are left as they are in the store.
+
+        Parameters
+        ----------
+        ds : xr.Dataset
+            new data of the group
+        store : zarr.storage.BaseStore
+            zarr store, whose metadata are consolidated after appending
+        group : str
+            path of the group in the store
+        append_dims : list of str
+            dimensions to append along
+        """
+        with xr.open_zarr(store, group=group, consolidated=False) as ds_old:
+            for dim, size in ds.sizes.items():
+                if dim not in append_dims and ds_old.sizes.get(dim, size) != size:
+                    raise ValueError('Cannot append to %s group: length of %s changed from %d to %d'
+                                     % (group, dim, ds_old.sizes[dim], size))
+
+        # Variables already packed in memory carry their CF encoding as attributes,
+        # which conflicts with the encoding xarray takes from the existing store
+        ds = xr.decode_cf(ds, decode_times=False)
+        for dim in append_dims:
+            ds_dim = ds[[var for var in ds.data_vars if dim in ds[var].dims]]
+            if ds_dim.sizes.get(dim, 0) > 0:
+                ds_dim.to_zarr(store=store, mode='a', group=group, append_dim=dim, consolidated=False)
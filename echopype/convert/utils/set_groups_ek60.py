@@ -1,15 +1,41 @@
 from .set_groups_base import SetGroupsBase
 import xarray as xr
-import os
 import numpy as np
 import shutil
-import zarr
 
 
 class SetGroupsEK60(SetGroupsBase):
     """Class for setting groups in netCDF file for EK60 data.
     """
 
+    # Name and attributes in the Platform group of each NMEA field interpolated onto ping times
+    NMEA_PING_VARS = {
+        'latitude': ('ping_latitude', {'long_name': 'Platform latitude interpolated onto ping times',
+                                       'standard_name': 'latitude',
+                                       'units': 'degrees_north',
+                                       'valid_range': (-90.0, 90.0)}),
+        'longitude': ('ping_longitude', {'long_name': 'Platform longitude interpolated onto ping times',
+                                         'standard_name': 'longitude',
+                                         'units': 'degrees_east',
+                                         'valid_range': (-180.0, 180.0)}),
+        'heading_true': ('ping_heading', {'long_name': 'Platform heading interpolated onto ping times',
+                                          'standard_name': 'platform_orientation',
+                                          'units': 'degrees_north',
+                                          'valid_range': (0.0, 360.0)}),
+        'true_track': ('ping_course_over_ground', {'long_name': 'Platform course over ground '
+                                                                'interpolated onto ping times',
+                                                   'standard_name': 'platform_course',
+                                                   'units': 'degrees_north',
+                                                   'valid_range': (0.0, 360.0)}),
+        'spd_over_grnd_kts': ('ping_speed_over_ground', {'long_name': 'Platform speed over ground '
+                                                                      'interpolated onto ping times',
+                                                         'standard_name': 'platform_speed_wrt_ground',
+                                                         'units': 'knots'}),
+        'trip_distance_nmi': ('ping_distance', {'long_name': 'Trip distance of the platform '
+                                                             'interpolated onto ping times',
+                                                'units': 'nautical_miles'}),
+    }
+
     def set_env(self, env_dict):
         """Set the Environment group in the EK60 netCDF file.
 
@@ -22,7 +48,7 @@ class SetGroupsEK60(SetGroupsBase):
                          env_dict['sound_speed']
         """
         # Only save environment group if file_path exists
-        if not os.path.exists(self.file_path):
+        if not self._file_exists(self.file_path):
             print('netCDF file does not exist, exiting without saving Environment group...')
         else:
             absorption = xr.DataArray(env_dict['absorption_coeff'],
@@ -46,10 +72,7 @@ class SetGroupsEK60(SetGroupsBase):
             ds.frequency.attrs['valid_min'] = 0.0
 
             # save to file
-            if self.format == '.nc':
-                ds.to_netcdf(path=self.file_path, mode='a', group='Environment')
-            elif self.format == '.zarr':
-                ds.to_zarr(store=self.file_path, mode='a', group='Environment')
+            self._add_group(ds, self.file_path, 'Environment')
 
     def set_platform(self, platform_dict):
         """Set the Platform group in the EK60 nc file.
@@ -60,15 +83,15 @@ class SetGroupsEK60(SetGroupsBase):
             dictionary containing platform parameters
         """
         # Only save platform group if file_path exists
-        if not os.path.exists(platform_dict['path']):
+        if not self._file_exists(platform_dict['path']):
             print('netCDF file does not exist, exiting without saving Platform group...')
         else:
-            # Convert np.datetime64 numbers to seconds since 1900-01-01
+            # Convert np.datetime64 numbers to integer nanoseconds since 1900-01-01
             # due to xarray.to_netcdf() error on encoding np.datetime64 objects directly
-            ping_time = (platform_dict['ping_time'] - np.datetime64('1900-01-01T00:00:00')) \
-                        / np.timedelta64(1, 's')
-            location_time = (platform_dict['location_time'] - np.datetime64('1900-01-01T00:00:00')) \
-                            / np.timedelta64(1, 's')
+            ping_time = (np.asarray(platform_dict['ping_time'], dtype='datetime64[ns]') -
+                         np.datetime64('1900-01-01T00:00:00', 'ns')).astype('int64')
+            location_time = (np.asarray(platform_dict['location_time'], dtype='datetime64[ns]') -
+                             np.datetime64('1900-01-01T00:00:00', 'ns')).astype('int64')
 
             ds = xr.Dataset(
                 {'pitch': (['ping_time'], platform_dict['pitch'],
@@ -106,30 +129,32 @@ class SetGroupsEK60(SetGroupsBase):
                                        'calendar': 'gregorian',
                                        'long_name': 'Timestamps for position datagrams',
                                        'standard_name': 'time',
-                                       'units': 'seconds since 1900-01-01'}),
+                                       'units': 'nanoseconds since 1900-01-01'}),
                         'location_time': (['location_time'], location_time,
                                           {'axis': 'T',
                                            'calendar': 'gregorian',
                                            'long_name': 'Timestamps for NMEA position datagrams',
                                            'standard_name': 'time',
-                                           'units': 'seconds since 1900-01-01'})
+                                           'units': 'nanoseconds since 1900-01-01'})
                         },
                 attrs={'platform_code_ICES': platform_dict['platform_code_ICES'],
                        'platform_name': platform_dict['platform_name'],
                        'platform_type': platform_dict['platform_type']})
 
+            # NMEA data interpolated onto ping times
+            for field, values in platform_dict['nmea_ping'].items():
+                name, attrs = self.NMEA_PING_VARS[field]
+                ds[name] = (['ping_time'], values, attrs)
+
             if 'ping_slice' in platform_dict:
-                lower = (platform_dict['ping_slice'][0] - np.datetime64('1900-01-01T00:00:00')) \
-                            / np.timedelta64(1, 's')
-                upper = (platform_dict['ping_slice'][-1] - np.datetime64('1900-01-01T00:00:00')) \
-                            / np.timedelta64(1, 's')
+                lower = (np.datetime64(platform_dict['ping_slice'][0], 'ns') -
+                         np.datetime64('1900-01-01T00:00:00', 'ns')).astype('int64')
+                upper = (np.datetime64(platform_dict['ping_slice'][-1], 'ns') -
+                         np.datetime64('1900-01-01T00:00:00', 'ns')).astype('int64')
                 ds = ds.sel(ping_time=slice(lower, upper)).sel(location_time=slice(lower, upper))
 
             # save to file
-            if self.format == '.nc':
-                ds.to_netcdf(path=platform_dict['path'], mode='a', group='Platform')
-            elif self.format == '.zarr':
-                ds.to_zarr(store=platform_dict['path'], mode='a', group='Platform')
+            self._write_group(ds, platform_dict['path'], 'Platform', ['ping_time', 'location_time'])
 
     def set_beam(self, beam_dict):
         """Set the Beam group in the EK60 nc file.
@@ -141,21 +166,28 @@ class SetGroupsEK60(SetGroupsBase):
         """
 
         # Only save beam group if file_path exists
-        if not os.path.exists(beam_dict['path']):
+        if not self._file_exists(beam_dict['path']):
             print('netCDF file does not exist, exiting without saving Beam group...')
         else:
-            # Convert np.datetime64 numbers to seconds since 1900-01-01
+            # Convert np.datetime64 numbers to integer nanoseconds since 1900-01-01
             # due to xarray.to_netcdf() error on encoding np.datetime64 objects directly
-            ping_time = (beam_dict['ping_time'] - np.datetime64('1900-01-01T00:00:00')) / np.timedelta64(1, 's')
+            ping_time = (np.asarray(beam_dict['ping_time'], dtype='datetime64[ns]') -
+                         np.datetime64('1900-01-01T00:00:00', 'ns')).astype('int64')
+
+            # Power parsed as int16 indices is stored as is with its CF packing attributes,
+            # or converted to dB if not packing data
+            backscatter_r = beam_dict['backscatter_r']
+            power_attrs = {'long_name': 'Backscatter power', 'units': 'dB'}
+            is_packed = np.issubdtype(backscatter_r.dtype, np.integer)
+            if is_packed and self.pack_data:
+                power_attrs.update({'scale_factor': beam_dict['power_scale_factor'],
+                                    '_FillValue': beam_dict['power_fill_value']})
+            elif is_packed:
+                backscatter_r = np.where(backscatter_r == beam_dict['power_fill_value'], np.nan,
+                                         backscatter_r * beam_dict['power_scale_factor'])
 
             ds = xr.Dataset(
-                {'backscatter_r': (['frequency', 'ping_time', 'range_bin'], beam_dict['backscatter_r'],
-                                   {'long_name': 'Backscatter power',
-                                    'units': 'dB'}),
-                 'angle_athwardship': (['frequency', 'ping_time', 'range_bin'], beam_dict['angle_dict'][:, :, :, 0],
-                                       {'long_name': 'electrical athwardship angle'}),
-                 'angle_alongship': (['frequency', 'ping_time', 'range_bin'], beam_dict['angle_dict'][:, :, :, 1],
-                                       {'long_name': 'electrical alongship angle'}),
+                {'backscatter_r': (['frequency', 'ping_time', 'range_bin'], backscatter_r, power_attrs),
                  'beam_type': ('frequency', beam_dict['beam_type'],
                                {'long_name': 'type of transducer (0-single, 1-split)'}),
                  'beamwidth_receive_alongship': (['frequency'], beam_dict['beamwidth_receive_major'],
@@ -255,7 +287,7 @@ class SetGroupsEK60(SetGroupsBase):
                         'ping_time': (['ping_time'], ping_time,
                                       {'axis': 'T',
                                        'calendar': 'gregorian',
-                                       'units': 'seconds since 1900-01-01',
+                                       'units': 'nanoseconds since 1900-01-01',
                                        'long_name': 'Timestamp of each ping',
                                        'standard_name': 'time'}),
                         'range_bin': (['range_bin'], beam_dict['range_bin'])},
@@ -267,14 +299,50 @@ class SetGroupsEK60(SetGroupsBase):
             ds['gpt_software_version'] = ('frequency', beam_dict['gpt_software_version'])
             ds['sa_correction'] = ('frequency', beam_dict['sa_correction'])
 
-            n_settings = {}
-            z_settings = {}
-            if self.compress:
-                n_settings = {'backscatter_r': {'zlib': True, 'complevel': 4}}
-                z_settings = {'backscatter_r': {'compressor': zarr.Blosc(cname='zstd', clevel=3, shuffle=2)}}
+            # Angles are stored as int16 indices with their CF packing attributes,
+            # and only if at least one channel is split-beam.
+            has_angle = np.any(np.array(beam_dict['beam_type']) == 1)
+            if has_angle:
+                angle_attrs = {'scale_factor': beam_dict['angle_scale_factor'],
+                               '_FillValue': beam_dict['angle_fill_value'],
+                               'comment': 'Electrical angles are stored as indices of 180/128 degrees.'}
+                ds['angle_athwardship'] = (['frequency', 'ping_time', 'range_bin'], beam_dict['angle_dict'][:, :, :, 0],
+                                           dict({'long_name': 'electrical athwardship angle'}, **angle_attrs))
+                ds['angle_alongship'] = (['frequency', 'ping_time', 'range_bin'], beam_dict['angle_dict'][:, :, :, 1],
+                                         dict({'long_name': 'electrical alongship angle'}, **angle_attrs))
+            if self.ragged:
+                ds = self._to_ragged(ds, beam_dict['sample_count'],
+                                     ['backscatter_r', 'angle_athwardship', 'angle_alongship'])
+
+            settings = self._get_compression(ds, ['backscatter_r', 'angle_athwardship', 'angle_alongship'])
+            n_settings = settings if self.format == '.nc' else {}
+            z_settings = settings if self.format == '.zarr' else {}
+            if self.pack_data and not is_packed:
+                # CF packing of power converted to dB, NaN padding is stored as _FillValue
+                packing = {'dtype': 'int16',
+                           'scale_factor': beam_dict['power_scale_factor'],
+                           '_FillValue': beam_dict['power_fill_value']}
+                n_settings.setdefault('backscatter_r', {}).update(packing)
+                z_settings.setdefault('backscatter_r', {}).update(packing)
+            chunks = self._get_chunk_shape(ds['backscatter_r'], ['ping_time'])
+            if chunks is not None:
+                n_settings.setdefault('backscatter_r', {})['chunksizes'] = chunks
+                z_settings.setdefault('backscatter_r', {})['chunks'] = chunks
+            elif self.appendable:
+                # the default netCDF chunks of variables with an unlimited dimension hold a single ping
+                n_settings.setdefault('backscatter_r', {})['chunksizes'] = (1,) + ds['backscatter_r'].shape[1:]
+            if has_angle:
+                # Chunks holding only fill values compress away in netCDF and are not written in zarr.
+                # Without ragged arrays, one chunk per frequency keeps single-beam channels in such chunks
+                for angle_name in ['angle_athwardship', 'angle_alongship']:
+                    z_settings.setdefault(angle_name, {})['write_empty_chunks'] = False
+                    angle_chunks = chunks
+                    if not self.ragged:
+                        angle_chunks = (1,) + (ds[angle_name].shape if chunks is None else chunks)[1:]
+                    if angle_chunks is not None:
+                        n_settings.setdefault(angle_name, {})['chunksizes'] = angle_chunks
+                        z_settings.setdefault(angle_name, {})['chunks'] = angle_chunks
 
             # save to file
-            if self.format == '.nc':
-                ds.to_netcdf(path=beam_dict['path'], mode='a', group='Beam', encoding=n_settings)
-            elif self.format == '.zarr':
-                ds.to_zarr(store=beam_dict['path'], mode='a', group='Beam', encoding=z_settings)
+            self._write_group(ds, beam_dict['path'], beam_dict.get('group', 'Beam'), ['ping_time'],
+                              encoding=n_settings if self.format == '.nc' else z_settings)
@@ -3,6 +3,7 @@ This file provides a wrapper for the model object and functions.
 Users will not need to know the names of the specific objects they need to create.
 """
 
+import os
 import xarray as xr
 from echopype.model.azfp import ModelAZFP
 from echopype.model.ek60 import ModelEK60
@@ -10,12 +11,13 @@ from echopype.model.ek60 import ModelEK60
 
 def EchoData(nc_path):
     """
-    Provides data analysis and computation tools for sonar data in netCDF form.
+    Provides data analysis and computation tools for sonar data in netCDF or zarr form.
 
     Parameters
     ----------
-    nc_path : str
-        The path to a .nc file generated by `echopype`
+    nc_path : str or dict
+        The path to a .nc file or .zarr store generated by `echopype`,
+        or the dictionary of Datasets returned by ``Convert.to_datasets()``
 
     Returns
     -------
@@ -24,7 +26,13 @@ def EchoData(nc_path):
     """
 
     # Open nc file in order to determine what echosounder produced the original dataset
-    with xr.open_dataset(nc_path) as nc_file:
+    if isinstance(nc_path, dict):
+        nc_file = nc_path['Toplevel']
+    elif os.path.splitext(nc_path)[1] == '.zarr':
+        nc_file = xr.open_dataset(nc_path, engine='zarr', consolidated=True)
+    else:
+        nc_file = xr.open_dataset(nc_path)
+    with nc_file:
         try:
             echo_type = nc_file.keywords
         except AttributeError:
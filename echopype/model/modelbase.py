@@ -11,16 +11,21 @@ from echopype.utils import uwa
 import numpy as np
 import xarray as xr
 
+# Default number of pings per tile of noise estimation and MVBS,
+# to which the default chunks of converted files are also aligned
+NOISE_EST_PING_SIZE = 30
+MVBS_PING_SIZE = 30
+
 
 class ModelBase(object):
-    """Class for manipulating echo data that is already converted to netCDF."""
+    """Class for manipulating echo data that is already converted to netCDF or zarr."""
 
     def __init__(self, file_path=""):
         self.file_path = file_path  # this passes the input through file name test
         self.noise_est_range_bin_size = 5  # meters per tile for noise estimation
-        self.noise_est_ping_size = 30  # number of pings per tile for noise estimation
+        self.noise_est_ping_size = NOISE_EST_PING_SIZE  # number of pings per tile for noise estimation
         self.MVBS_range_bin_size = 5  # meters per tile for MVBS
-        self.MVBS_ping_size = 30  # number of pings per tile for MVBS
+        self.MVBS_ping_size = MVBS_PING_SIZE  # number of pings per tile for MVBS
         self.Sv = None            # calibrated volume backscattering strength
         self.Sv_path = None       # path to save calibrated results
         self.Sv_clean = None      # denoised volume backscattering strength
@@ -100,6 +105,12 @@ class ModelBase(object):
 
     @file_path.setter
     def file_path(self, p):
+        # Groups converted in memory by Convert.to_datasets() are used in place of a file,
+        # with the path of their source raw file to name the files of processed data
+        self._datasets = None
+        if isinstance(p, dict):
+            self._datasets = p
+            p = str(p['Provenance'].filenames.values[0])
         self._file_path = p
 
         # Load netCDF groups if file format is correct
@@ -107,10 +118,10 @@ class ModelBase(object):
         _, ext = os.path.splitext(pp)
 
         supported_ext_list = ['.raw', '.01A']
-        if ext in supported_ext_list:
+        if ext in supported_ext_list and self._datasets is None:
             print('Data file in manufacturer format, please convert to .nc first.')
-        elif ext == '.nc':
-            self.toplevel = xr.open_dataset(self.file_path)
+        elif ext in ('.nc', '.zarr') or self._datasets is not None:
+            self.toplevel = self.open_group()
 
             # Get .nc filenames for storing processed data if computation is performed
             self.Sv_path = os.path.join(os.path.dirname(self.file_path),
@@ -128,6 +139,73 @@ class ModelBase(object):
         else:
             raise ValueError('Data file format not recognized.')
 
+    def open_group(self, group=None):
+        """Open a group of the file.
+
+        Zarr stores are opened from their consolidated metadata, so that each group is opened with a single
+        metadata read instead of one read per array. Data are only read from the file when they are used.
+        Groups converted in memory by ``Convert.to_datasets()`` are returned without reading any file.
+
+        Parameters
+        ----------
+        group : str
+            path to the group in the file. Defaults to the top-level group
+
+        Returns
+        -------
+        An xarray Dataset of the group, which should be closed after use
+        """
+        if self._datasets is not None:
+            return self._datasets[group or 'Toplevel'].copy()   # keep the Datasets passed in unchanged
+        if os.path.splitext(self.file_path)[1] == '.zarr':
+            return xr.open_dataset(self.file_path, group=group, engine='zarr', consolidated=True)
+        return xr.open_dataset(self.file_path, group=group)
+
+    def open_beam(self, cube=True):
+        """Open the Beam group of the file.
+
+        Backscatter data converted with ``ragged=True`` are stored as CF contiguous ragged arrays
+        of dimensions [ping_time x sample], with the number of range_bin of each frequency channel
+        in the ``sample_count`` variable. Data are only read from the file when they are used.
+
+        Parameters
+        ----------
+        cube : bool
+            Whether or not to broadcast ragged arrays to a cube of dimensions
+            [frequency x ping_time x range_bin], in which shorter channels are padded with NaN.
+            Files without ragged arrays are always opened as a cube. Defaults to `True`
+
+        Returns
+        -------
+        An xarray Dataset of the Beam group, which should be closed after use
+        """
+        ds_beam = self.open_group('Beam')
+        if cube and 'sample_count' in ds_beam:
+            ds_cube = self._ragged_to_cube(ds_beam)
+            ds_cube.set_close(ds_beam.close)
+            return ds_cube
+        return ds_beam
+
+    @staticmethod
+    def _ragged_to_cube(ds):
+        """Broadcast the contiguous ragged arrays of a Beam group to [frequency x ping_time x range_bin].
+        """
+        sample_count = ds.sample_count.values
+        sample_start = np.cumsum(sample_count) - sample_count
+        range_bin = np.arange(sample_count.max())
+        is_sample = range_bin < sample_count[:, np.newaxis]   # dim: frequency x range_bin
+
+        # Index of the sample of each frequency and range_bin, pointing to the channel start beyond its end
+        sample_idx = xr.DataArray(sample_start[:, np.newaxis] + np.where(is_sample, range_bin, 0),
+                                  dims=['frequency', 'range_bin'])
+        is_sample = xr.DataArray(is_sample, dims=['frequency', 'range_bin'])
+        ragged_vars = [name for name in ds.data_vars if 'sample' in ds[name].dims]
+        ds_cube = ds.drop_vars(ragged_vars + ['sample_count'])
+        for name in ragged_vars:
+            ds_cube[name] = ds[name].isel(sample=sample_idx).where(is_sample).transpose(
+                'frequency', 'ping_time', 'range_bin')
+        return ds_cube.assign_coords(range_bin=range_bin)
+
     def calc_sound_speed(self, src='file'):
         """Base method to be overridden for calculating sound_speed for different sonar models
         """
@@ -202,7 +280,7 @@ class ModelBase(object):
         def _assemble_path():
             file_in = os.path.basename(self.file_path)
             file_name, file_ext = os.path.splitext(file_in)
-            return file_name + save_postfix + file_ext
+            return file_name + save_postfix + '.nc'  # processed data are saved to .nc for all input formats
 
         if save_path is None:
             save_dir = os.path.dirname(self.file_path)
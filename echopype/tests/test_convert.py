@@ -1,8 +1,20 @@
 import os
 import shutil
+import struct
+from io import SEEK_SET, SEEK_END
 import numpy as np
+import pynmea2
+import pytest
 import xarray as xr
-from echopype.convert import Convert
+from echopype.convert import Convert, ConvertEK60, benchmark_codecs
+from echopype.convert.ek60 import INDEX2ELEC
+from echopype.convert.utils.ek60_raw_io import RawSimradFile, SimradEOF
+from echopype.convert.utils.ek60_date_conversion import EPOCH_DELTA_100NS
+from echopype.convert.utils.ek60_ping_data import PingDataColumns
+from echopype.convert.utils.ek60_raw_index import RawDatagramIndex
+from echopype.convert.utils.ek60_raw_subset import subset_raw, split_raw
+from echopype.convert.utils.nmea_data import NMEAData
+from echopype.model import EchoData
 
 ek60_raw_path = './echopype/test_data/ek60/DY1801_EK60-D20180211-T164025.raw'     # Standard test
 # ek60_raw_path = './echopype/test_data/ek60/2015843-D20151023-T190636.raw'     # Different ranges
@@ -23,6 +35,62 @@ azfp_test_path = './echopype/test_data/azfp/from_matlab/17082117.nc'
 # azfp_xml_path = './echopype/test_data/azfp/17033000.XML'       # Multiple files
 
 
+def _write_ek60_raw(path, n_ping=20, sample_counts=(100, 80, 60), range_switch=None,
+                    start='2018-02-11T16:40:25.123', seed=0):
+    """Write a synthetic EK60 .raw file with a GGA and a VTG NMEA datagram before each ping.
+
+    All channels are split-beam except the third one. From ping number ``range_switch`` on,
+    each channel records half as many samples.
+    """
+    rng = np.random.default_rng(seed)
+    frequencies = [18000., 38000., 120000., 200000.]
+
+    def dgram(dgram_type, time, body):
+        nt_time = int(np.datetime64(time, 'ns').astype('int64')) // 100 + EPOCH_DELTA_100NS
+        body = struct.pack('=4sLL', dgram_type, nt_time & 0xFFFFFFFF, nt_time >> 32) + body
+        return struct.pack('=l', len(body)) + body + struct.pack('=l', len(body))
+
+    def nmea(time, sentence):
+        checksum = 0
+        for c in sentence:
+            checksum ^= ord(c)
+        body = ('$%s*%02X' % (sentence, checksum)).encode() + b'\x00'
+        return dgram(b'NME0', time, body + b'\x00' * (-len(body) % 4))
+
+    start = np.datetime64(start, 'ns')
+    config = struct.pack('=128s128s128s30s98sl', b'survey', b'transect', b'ER60', b'2.4.3', b'',
+                         len(sample_counts))
+    for ch, freq in enumerate(frequencies[:len(sample_counts)]):
+        config += struct.pack('=128slfffffffffffffff5f8s5f8s5f8s16s28s',
+                              b'GPT %d kHz' % (freq / 1000), int(ch != 2), freq, 25., -20.7, 7., 7., 21.9, 21.9,
+                              0., 0., 0., 0., 0., 0., 0., 1., 0.000256, 0.000512, 0.001024, 0.002048, 0.004096,
+                              b'', 20., 21., 22., 23., 24., b'', -0.7, -0.6, -0.5, -0.4, -0.3, b'', b'050413', b'')
+    with open(path, 'wb') as f:
+        f.write(dgram(b'CON0', start, config))
+        for n in range(n_ping):
+            time = start + np.timedelta64(n + 1, 's')
+            lat = 47.5 + n * 0.001
+            f.write(nmea(time - np.timedelta64(500, 'ms'),
+                         'GPGGA,164026.00,%02d%07.4f,N,12218.3000,W,1,08,0.9,5.0,M,-17.0,M,,'
+                         % (int(lat), (lat % 1) * 60)))
+            f.write(nmea(time - np.timedelta64(400, 'ms'), 'GPVTG,90.0,T,,M,10.2,N,18.9,K'))
+            for ch, freq in enumerate(frequencies[:len(sample_counts)]):
+                count = sample_counts[ch] // (2 if range_switch is not None and n >= range_switch else 1)
+                body = struct.pack('=hhfffffffffffffh6sll', ch + 1, 3, 5.0, freq, 1000., 0.001024, 2425.,
+                                   0.000256, 1494., 0.002, 0.1, 0.2, 0.3, 10., 90., 0, b'', 0, count)
+                body += rng.integers(-20000, 0, count).astype('int16').tobytes()
+                body += rng.integers(-128, 128, count * 2).astype('int8').tobytes()
+                f.write(dgram(b'RAW0', time, body))
+
+
+@pytest.fixture
+def ek60_syn_path(tmp_path):
+    """Path to a synthetic EK60 .raw file written under tmp_path"""
+    raw_path = str(tmp_path / 'SYN-D20180211-T164025.raw')
+    _write_ek60_raw(raw_path)
+    return raw_path
+
+
 def test_convert_ek60():
     """Test converting """
     # Unpacking data
@@ -99,3 +167,620 @@ def test_convert_AZFP():
     ds_test.close()
     os.remove(tmp.nc_path)
     del tmp
+
+
+def test_nmea_duplicates():
+    """Test NMEA datagrams with the time, talker and message of an earlier datagram are discarded"""
+    t = np.datetime64('2018-02-11T16:40:25.123', 'ns')
+    nmea_data = NMEAData()
+    nmea_data.add_datagram(t, '$GPGGA,164026.00,4730.0000,N,12218.3000,W,1,08,0.9,5.0,M,-17.0,M,,')
+    nmea_data.add_datagram(t, '$GPGGA,164026.00,4730.0000,N,12218.3000,W,1,08,0.9,5.0,M,-17.0,M,,')
+    nmea_data.add_datagram(t, '$GPVTG,90.0,T,,M,10.2,N,18.9,K')
+    nmea_data.add_datagram(t + np.timedelta64(1, 's'), '$GPGGA,164027.00,4730.0000,N,12218.3000,W,1,08,0.9,5.0,M,-17.0,M,,')
+    nmea_data.add_datagram(t, '$GPVTG,90.0,T,,M,10.2,N,18.9,K', allow_duplicates=True)
+    nmea_data.trim()
+    assert list(nmea_data.messages) == ['GGA', 'VTG', 'GGA', 'VTG']
+    assert nmea_data.nmea_times[2] == t + np.timedelta64(1, 's')
+
+
+def test_nmea_decode_position():
+    """Test bulk decoding of NMEA positions gives the same values as pynmea2"""
+    sentences = ['$GPGGA,164026.00,4730.1234,N,12218.3000,W,1,08,0.9,5.0,M,-17.0,M,,*59',
+                 '$GPGLL,0012.5,S,00018.3,E,164026.00,A*00',   # wrong checksum
+                 '$INRMC,164026.00,A,4730.1234,N,12218.3000,W,10.2,90.0,110218,,',
+                 '$GPGLL,47.30,N,12218.3,W']   # invalid latitude
+    nmea_data = NMEAData()
+    for n, sentence in enumerate(sentences):
+        nmea_data.add_datagram(np.datetime64('2018-02-11T16:40:25', 'ns') + np.timedelta64(n, 's'), sentence)
+    nmea_data.trim()
+    lat, lon = nmea_data.decode_position(np.arange(len(sentences)))
+
+    msg = pynmea2.parse(sentences[0])
+    assert lat[0] == msg.latitude and lon[0] == msg.longitude
+    assert lat[2] == msg.latitude and lon[2] == msg.longitude
+    assert np.isnan(lat[[1, 3]]).all() and np.isnan(lon[[1, 3]]).all()
+
+
+def test_nmea_interpolate():
+    """Test interpolating NMEA fields onto ping times across the antimeridian and north"""
+    sentences = ['$GPGGA,000000,4730.0000,N,17959.4000,E,1,08,0.9,5.0,M,,M,,*5F',
+                 '$GPHDT,350.0,T*33',
+                 '$GPGGA,000010,4731.0000,N,17959.4000,W,1,08,0.9,5.0,M,,M,,*4D',
+                 '$GPHDT,10.0,T*04']
+    nmea_data = NMEAData()
+    for n, sentence in enumerate(sentences):
+        nmea_data.add_datagram(np.datetime64('2018-02-11T16:40:25', 'ns') + np.timedelta64(n // 2 * 10, 's'),
+                               sentence)
+    nmea_data.trim()
+    ping_times = np.datetime64('2018-02-11T16:40:25', 'ns') + np.array([-1, 0, 5, 10, 11], dtype='timedelta64[s]')
+
+    position = nmea_data.interpolate('position', ping_times)
+    assert np.allclose(position['latitude'][1:4], [47.5, 47.50833333, 47.51666667])
+    assert np.allclose(position['longitude'][1:4], [179.99, -180., -179.99])
+    heading = nmea_data.interpolate('HDT', ping_times)
+    assert np.allclose(heading['heading_true'][1:4], [350., 0., 10.])
+    for values in [position['latitude'], position['longitude'], heading['heading_true']]:
+        assert np.isnan(values[[0, 4]]).all()
+
+
+def test_ping_data_columns():
+    """Test growing PingDataColumns past its initial size and trimming it to the pings stored"""
+    dtype = np.dtype([('channel', 'i2'), ('transducer_depth', 'f4')])
+    columns = PingDataColumns(dtype, frequency=18000., initial_size=2)
+    for i in range(3):
+        columns.append({'channel': 1, 'transducer_depth': i})
+    assert columns._data.shape[0] == 4
+    columns.extend({'channel': np.ones(5), 'transducer_depth': np.arange(3, 8)})
+    assert columns._data.shape[0] == 8
+    columns.extend(columns)
+    assert columns._data.shape[0] == 16
+    assert len(columns) == 16
+    assert columns['frequency'] == 18000.
+    assert list(columns) == ['frequency', 'channel', 'transducer_depth']
+
+    columns.trim()
+    assert columns._data.shape[0] == 16
+    assert columns['channel'].dtype == np.int16
+    assert np.array_equal(columns['channel'], np.ones(16))
+    assert np.array_equal(columns['transducer_depth'], np.tile(np.arange(8), 2))
+
+    columns = PingDataColumns(dtype, initial_size=10)
+    columns.append({'channel': 2, 'transducer_depth': 1.5})
+    columns.trim()
+    assert columns._data.shape[0] == 1
+    assert np.array_equal(columns['transducer_depth'], [1.5])
+
+
+@pytest.mark.parametrize('option, value', [('use_mmap', True), ('batch_decode', True),
+                                           ('parse_workers', 2), ('preallocate', True)])
+def test_convert_ek60_parser_options(tmp_path, option, value):
+    """Test that each parser option gives the same data as datagram-by-datagram parsing"""
+    raw_path = str(tmp_path / 'SYN-D20180211-T164025.raw')
+    _write_ek60_raw(raw_path, range_switch=10)
+    tmp_ref = ConvertEK60(raw_path)
+    tmp_ref.load_ek60_raw(tmp_ref.filename)
+
+    tmp_opt = ConvertEK60(raw_path)
+    tmp_opt.scratch_dir = str(tmp_path)
+    setattr(tmp_opt, option, value)
+    tmp_opt.load_ek60_raw(tmp_opt.filename)
+
+    assert np.array_equal(tmp_ref.ping_time, tmp_opt.ping_time)
+    for ch_num in tmp_ref.config_datagram['transceivers'].keys():
+        for field in ConvertEK60.ping_data_fields:
+            assert np.array_equal(tmp_ref.ping_data_dict[ch_num][field], tmp_opt.ping_data_dict[ch_num][field])
+    assert len(tmp_ref.power_dict_split) == 2
+    for range_group in tmp_ref.power_dict_split.keys():
+        assert np.array_equal(tmp_ref.power_dict_split[range_group],
+                              tmp_opt.power_dict_split[range_group], equal_nan=True)
+        assert np.array_equal(tmp_ref.angle_dict_split[range_group],
+                              tmp_opt.angle_dict_split[range_group], equal_nan=True)
+    assert np.array_equal(tmp_ref.nmea_data.raw_datagrams, tmp_opt.nmea_data.raw_datagrams)
+
+
+def test_convert_ek60_batch_decode_frequency_mismatch(ek60_syn_path):
+    """Test batch decoding raises an error on a RAW datagram with the frequency of another channel"""
+    index = RawDatagramIndex.from_file(ek60_syn_path)
+    offset = index.records['offset'][index.select(types=['RAW'], channels=[2])][0]
+    with open(ek60_syn_path, 'r+b') as f:
+        f.seek(offset + 24)   # frequency field of the RAW0 datagram
+        f.write(struct.pack('=f', 70000.))
+
+    tmp = ConvertEK60(ek60_syn_path)
+    tmp.batch_decode = True
+    with pytest.raises(ValueError, match='Frequency mismatch'):
+        tmp.load_ek60_raw(tmp.filename)
+
+
+def test_ek60_datagram_index(tmp_path):
+    """Test random access through the datagram index and reuse of its sidecar file"""
+    raw_path = str(tmp_path / 'SYN-D20180211-T164025.raw')
+    _write_ek60_raw(raw_path, n_ping=10)
+    index = RawDatagramIndex.from_file(raw_path)
+    assert not os.path.exists(RawDatagramIndex.sidecar_path(raw_path))   # sidecar is opt-in
+
+    # Sidecar is reused on later opens
+    RawDatagramIndex.from_file(raw_path, save_sidecar=True)
+    assert np.array_equal(RawDatagramIndex.load(RawDatagramIndex.sidecar_path(raw_path)).records, index.records)
+    assert np.array_equal(RawDatagramIndex.from_file(raw_path).records, index.records)
+
+    # Datagram count and order match a sequential walk of the file
+    with RawSimradFile(raw_path, 'r') as fid:
+        fid.seek(0, SEEK_END)
+        assert fid.tell() == len(index)
+    with RawSimradFile(raw_path, 'r', use_index=True) as fid:
+        fid.seek(len(index) // 2, SEEK_SET)
+        dgram = fid.read(1)
+        assert dgram['type'].encode() == index[len(index) // 2]['type']
+
+    # A file rewritten with other datagrams is re-indexed instead of extended from the stale sidecar
+    _write_ek60_raw(raw_path, n_ping=20, start='2018-02-11T17:00:00')
+    assert np.array_equal(RawDatagramIndex.from_file(raw_path).records, RawDatagramIndex.scan(raw_path))
+
+
+@pytest.mark.parametrize('sidecar', [False, True])
+def test_ek60_seek_time(ek60_syn_path, sidecar):
+    """Test seeking to the first datagram at or after a time, with the index built or loaded from its sidecar"""
+    with RawSimradFile(ek60_syn_path, 'r') as fid:
+        dgram_times = []
+        while True:
+            try:
+                dgram_times.append(fid.read(1)['timestamp'])
+            except SimradEOF:
+                break
+    dgram_times = np.array(dgram_times)
+    times = np.concatenate([dgram_times[[0, 1, 7, -1]],
+                            dgram_times[[0, 5, 20]] + np.timedelta64(1, 'ms'),
+                            [dgram_times[0] - np.timedelta64(1, 's'), dgram_times[-1] + np.timedelta64(1, 's')]])
+
+    if sidecar:
+        RawDatagramIndex.from_file(ek60_syn_path, save_sidecar=True)
+    with RawSimradFile(ek60_syn_path, 'r', use_index=True) as fid:
+        assert os.path.exists(RawDatagramIndex.sidecar_path(ek60_syn_path)) == sidecar
+        for time in times:
+            fid.seek_time(time)
+            dgram_num = int(np.searchsorted(dgram_times, time, side='left'))
+            assert fid.tell() == dgram_num
+            if dgram_num < len(dgram_times):
+                assert fid.read(1)['timestamp'] == dgram_times[dgram_num]
+            else:
+                with pytest.raises(SimradEOF):
+                    fid.read(1)
+
+    with RawSimradFile(ek60_syn_path, 'r') as fid:
+        with pytest.raises(ValueError):
+            fid.seek_time(times[0])
+
+
+def test_ek60_resync_corrupted(ek60_syn_path):
+    """Test that the reader skips garbage bytes and recovers the following datagrams"""
+    index = RawDatagramIndex.from_file(ek60_syn_path)
+    cut = index.offset_of(len(index) // 2)
+    garbage = b'\xff\xff\xff\x7fRAW0' + bytes(range(256)) * 40
+    bad_path = ek60_syn_path.replace('.raw', '_corrupted.raw')
+    with open(ek60_syn_path, 'rb') as f:
+        raw_bytes = f.read()
+    with open(bad_path, 'wb') as f:
+        f.write(raw_bytes[:cut] + garbage + raw_bytes[cut:])
+
+    with RawSimradFile(bad_path, 'r') as fid:
+        fid.seek(0, SEEK_END)
+        assert fid.bytes_skipped == len(garbage)
+    assert len(RawDatagramIndex.scan(bad_path)) == len(index)
+
+
+@pytest.mark.parametrize('n_bytes', [3, 10])
+def test_ek60_truncated_header(ek60_syn_path, n_bytes):
+    """Test that a partial datagram header at the end of a file is read as the end of the file"""
+    tmp_full = ConvertEK60(ek60_syn_path)
+    tmp_full.load_ek60_raw(tmp_full.filename)
+    with open(ek60_syn_path, 'ab') as f:
+        f.write(b'\x10\x00\x00\x00RAW0\x00\x00\x00\x00'[:n_bytes])
+
+    for use_mmap in [False, True]:
+        tmp = ConvertEK60(ek60_syn_path)
+        tmp.use_mmap = use_mmap
+        tmp.load_ek60_raw(tmp.filename)
+        assert np.array_equal(tmp.ping_time, tmp_full.ping_time)
+
+
+def test_convert_ek60_types_filter(ek60_syn_path):
+    """Test that parsing only some datagram types skips the others"""
+    tmp_all = ConvertEK60(ek60_syn_path)
+    tmp_all.load_ek60_raw(tmp_all.filename)
+
+    tmp_raw = ConvertEK60(ek60_syn_path)
+    tmp_raw.load_ek60_raw(tmp_raw.filename, types=['RAW'])
+    assert np.array_equal(tmp_all.ping_time, tmp_raw.ping_time)
+    assert np.array_equal(tmp_all.power_dict_split[0], tmp_raw.power_dict_split[0], equal_nan=True)
+    assert len(tmp_raw.nmea_data.raw_datagrams) == 0
+
+    with RawSimradFile(ek60_syn_path, 'r') as fid:
+        assert all(dgram['type'].startswith('NME') for dgram in fid.iter_dgrams(types=['NME']))
+
+
+@pytest.mark.parametrize('file_format', ['.nc', '.zarr'])
+def test_convert_ek60_navigation_only(ek60_syn_path, tmp_path, file_format):
+    """Test converting only NMEA datagrams saves the Platform groups without any ping data"""
+    tmp_all = Convert(ek60_syn_path)
+    tmp_all.save(file_format, save_path=str(tmp_path / 'all'))
+    tmp_nav = Convert(ek60_syn_path)
+    tmp_nav.save(file_format, save_path=str(tmp_path / 'nav'), types=['NME'])
+    assert len(tmp_nav.ping_time) == 0
+
+    nav_path = tmp_nav.nc_path if file_format == '.nc' else tmp_nav.zarr_path
+    all_path = tmp_all.nc_path if file_format == '.nc' else tmp_all.zarr_path
+    open_kwargs = {'engine': 'netcdf4'} if file_format == '.nc' else {'engine': 'zarr'}
+    with xr.open_dataset(nav_path, group='Platform', **open_kwargs) as ds_nav, \
+            xr.open_dataset(all_path, group='Platform', **open_kwargs) as ds_all:
+        assert ds_nav.sizes['ping_time'] == 0
+        assert ds_nav[['latitude', 'longitude']].identical(ds_all[['latitude', 'longitude']])
+    with xr.open_dataset(nav_path, group='Platform/NMEA', **open_kwargs) as ds_nav, \
+            xr.open_dataset(all_path, group='Platform/NMEA', **open_kwargs) as ds_all:
+        assert ds_nav.identical(ds_all)
+    with xr.open_dataset(nav_path, group='Provenance', **open_kwargs) as ds_prov:
+        assert ds_prov.filenames.size == 1
+    for group in ['Beam', 'Environment']:
+        with pytest.raises((OSError, KeyError)):
+            xr.open_dataset(nav_path, group=group, **open_kwargs).close()
+
+    # Pings parsed before saving are used as they are
+    tmp_loaded = Convert(ek60_syn_path)
+    tmp_loaded.load_ek60_raw(tmp_loaded.filename, types=['NME'])
+    tmp_loaded.save(file_format, save_path=str(tmp_path / 'loaded'))
+    with xr.open_dataset(str(tmp_path / 'loaded' / os.path.basename(nav_path)), group='Platform/NMEA',
+                         **open_kwargs) as ds_loaded:
+        assert ds_loaded.time.size == 2 * len(tmp_all.ping_time)
+
+
+def test_convert_ek60_follow(ek60_syn_path, caplog):
+    """Test converting a file that is still being written in several polls"""
+    with open(ek60_syn_path, 'rb') as f:
+        raw_bytes = f.read()
+    grow_path = ek60_syn_path.replace('-D', '_grow-D')
+    open(grow_path, 'wb').close()
+
+    tmp_follow = ConvertEK60(grow_path)
+    for n in range(1, 4):
+        with open(grow_path, 'ab') as f:
+            f.write(raw_bytes[(n - 1) * len(raw_bytes) // 3:n * len(raw_bytes) // 3])
+        tmp_follow.follow()
+    # the partly written datagram at the end of the file is left for the next poll, not resynchronized
+    assert not [x for x in caplog.records if x.levelname == 'WARNING']
+
+    tmp_full = ConvertEK60(ek60_syn_path)
+    tmp_full.load_ek60_raw(tmp_full.filename)
+    with xr.open_zarr(tmp_follow.save_path, group='Beam') as ds_beam:
+        assert np.array_equal(ds_beam.backscatter_r, tmp_full.power_dict_split[0], equal_nan=True)
+
+
+def test_convert_ek60_follow_range_groups(tmp_path):
+    """Test following a file with a range_bin change converts the following pings to a new Zarr file"""
+    raw_path = str(tmp_path / 'SYN-D20180211-T164025.raw')
+    _write_ek60_raw(raw_path, range_switch=9)
+    with open(raw_path, 'rb') as f:
+        raw_bytes = f.read()
+    grow_path = str(tmp_path / 'SYN_grow-D20180211-T164025.raw')
+    open(grow_path, 'wb').close()
+
+    tmp_follow = ConvertEK60(grow_path)
+    n_pings = []
+    for n in range(1, 6):
+        with open(grow_path, 'ab') as f:
+            f.write(raw_bytes[(n - 1) * len(raw_bytes) // 5:n * len(raw_bytes) // 5])
+        n_pings.append(tmp_follow.follow())
+    n_pings.append(tmp_follow.follow())   # pings after the change in the last poll
+    assert sum(n_pings) == 20
+
+    tmp_full = ConvertEK60(raw_path)
+    tmp_full.load_ek60_raw(tmp_full.filename)
+    part_paths = [tmp_follow.save_path.replace('_part02', '')] + [tmp_follow.save_path]
+    assert part_paths[1].endswith('_part02.zarr')
+    for range_group, part_path in enumerate(part_paths):
+        with xr.open_zarr(part_path, group='Beam') as ds_beam:
+            assert np.array_equal(ds_beam.backscatter_r, tmp_full.power_dict_split[range_group], equal_nan=True)
+
+
+def test_ek60_subset_raw(ek60_syn_path):
+    """Test copying a time window and some channels of a .raw file to a new .raw file"""
+    tmp_full = ConvertEK60(ek60_syn_path)
+    tmp_full.load_ek60_raw(tmp_full.filename)
+    ping_time = np.array(tmp_full.ping_time)
+
+    subset_path = ek60_syn_path.replace('-D', '_subset-D')
+    subset_raw(ek60_syn_path, subset_path, start_time=ping_time[1], end_time=ping_time[-1], channels=[1, 3])
+    tmp_subset = ConvertEK60(subset_path)
+    tmp_subset.load_ek60_raw(tmp_subset.filename)
+
+    assert tmp_subset.config_datagram['transceiver_count'] == 2
+    assert np.array_equal(tmp_subset.ping_time, ping_time[1:-1])
+    assert np.array_equal(tmp_subset.power_dict_split[0], tmp_full.power_dict_split[0][[0, 2], 1:-1],
+                          equal_nan=True)
+
+    # Channels are renumbered in the order they are given
+    subset_raw(ek60_syn_path, subset_path, channels=[3, 1])
+    tmp_subset = ConvertEK60(subset_path)
+    tmp_subset.load_ek60_raw(tmp_subset.filename)
+    assert [x['frequency'] for x in tmp_subset.config_datagram['transceivers'].values()] == \
+           [tmp_full.config_datagram['transceivers'][ch]['frequency'] for ch in [3, 1]]
+    assert np.array_equal(tmp_subset.ping_time, ping_time)
+    assert np.array_equal(tmp_subset.power_dict_split[0], tmp_full.power_dict_split[0][[2, 0]], equal_nan=True)
+
+
+def test_ek60_split_raw(ek60_syn_path):
+    """Test splitting a .raw file into files of consecutive time intervals"""
+    tmp_full = ConvertEK60(ek60_syn_path)
+    tmp_full.load_ek60_raw(tmp_full.filename)
+
+    split_paths = split_raw(ek60_syn_path, interval=np.timedelta64(10, 's'))
+    split_dir = os.path.splitext(ek60_syn_path)[0] + '_split'
+    assert [os.path.dirname(x) for x in split_paths] == [split_dir] * 3
+    assert os.path.basename(split_paths[0]) == os.path.basename(ek60_syn_path)
+    assert os.path.basename(split_paths[1]) == 'SYN-D20180211-T164030.raw'
+
+    ping_time, power = [], []
+    for split_path in split_paths:
+        tmp_split = ConvertEK60(split_path)
+        tmp_split.load_ek60_raw(tmp_split.filename)
+        ping_time.append(tmp_split.ping_time)
+        power.append(tmp_split.power_dict_split[0])
+    assert np.array_equal(np.concatenate(ping_time), tmp_full.ping_time)
+    assert np.array_equal(np.concatenate(power, axis=1), tmp_full.power_dict_split[0], equal_nan=True)
+
+    with pytest.raises(ValueError):
+        split_raw(ek60_syn_path, out_dir=os.path.dirname(ek60_syn_path))
+
+
+@pytest.mark.parametrize('preallocate', [False, True])
+def test_convert_ek60_pack_data(ek60_syn_path, tmp_path, preallocate):
+    """Test storing power as packed int16 decodes to the same backscatter data"""
+    tmp_float = Convert(ek60_syn_path)
+    tmp_float.raw2nc(save_path=str(tmp_path / 'float'))
+    tmp = Convert(ek60_syn_path)
+    tmp.preallocate = preallocate
+    tmp.raw2nc(pack_data=True)
+
+    # power is packed straight from the int16 indices of the RAW datagrams
+    assert tmp.power_dict_split[0].dtype == np.int16
+    with xr.open_dataset(tmp.nc_path, group='Beam', mask_and_scale=False) as ds_packed:
+        assert ds_packed.backscatter_r.dtype == np.int16
+        assert np.array_equal(ds_packed.backscatter_r[0], np.array(tmp.power_dict[1]))
+    with xr.open_dataset(tmp.nc_path, group='Beam') as ds_beam, \
+            xr.open_dataset(tmp_float.nc_path, group='Beam') as ds_float:
+        assert np.allclose(ds_beam.backscatter_r, ds_float.backscatter_r, equal_nan=True)
+
+    # the int16 indices are converted to dB when saving them again without packing
+    tmp.raw2zarr()
+    with xr.open_zarr(tmp.zarr_path, group='Beam') as ds_zarr, \
+            xr.open_dataset(tmp_float.nc_path, group='Beam') as ds_float:
+        assert ds_zarr.backscatter_r.dtype == np.float64
+        assert np.allclose(ds_zarr.backscatter_r, ds_float.backscatter_r, equal_nan=True)
+
+
+def test_convert_ek60_angle_storage(ek60_syn_path):
+    """Test electrical angles are stored as int16 indices for split-beam channels only"""
+    tmp = Convert(ek60_syn_path)
+    tmp.raw2nc()
+
+    split_beam = np.array([x['beam_type'] == 1 for x in tmp.config_datagram['transceivers'].values()])
+    with xr.open_dataset(tmp.nc_path, group='Beam', mask_and_scale=False) as ds_packed:
+        assert ds_packed.angle_alongship.dtype == np.int16
+        assert ds_packed.angle_alongship.attrs['_FillValue'] < np.iinfo('int8').min
+    with xr.open_dataset(tmp.nc_path, group='Beam') as ds_beam:
+        assert np.all(ds_beam.angle_alongship[~split_beam].isnull())
+        # samples at the -128 phase wrap index are kept as data, not read as missing
+        raw_alongship = np.array(tmp.angle_dict[1])[:, :, 1]
+        assert np.any(raw_alongship == -128)
+        assert np.allclose(ds_beam.angle_alongship[0], raw_alongship * INDEX2ELEC)
+
+
+def test_convert_ek60_max_pings_in_memory(ek60_syn_path, tmp_path):
+    """Test converting in blocks of pings appended to the output gives the same data"""
+    tmp = Convert(ek60_syn_path)
+    tmp.raw2nc(save_path=str(tmp_path / 'all'))
+
+    tmp_blocks = Convert(ek60_syn_path)
+    tmp_blocks.max_pings_in_memory = 7
+    tmp_blocks.raw2nc(save_path=str(tmp_path / 'blocks'))
+
+    for group in ['Beam', 'Platform', 'Platform/NMEA']:
+        with xr.open_dataset(tmp.nc_path, group=group) as ds_all, \
+                xr.open_dataset(tmp_blocks.nc_path, group=group) as ds_blocks:
+            assert ds_all.equals(ds_blocks)
+
+
+def test_convert_ek60_max_pings_in_memory_range_groups(tmp_path):
+    """Test converting in blocks of pings saves range_bin groups to the same part files as without blocks"""
+    raw_path = str(tmp_path / 'SYN-D20180211-T164025.raw')
+    _write_ek60_raw(raw_path, range_switch=9)
+    tmp = Convert(raw_path)
+    tmp.raw2nc(save_path=str(tmp_path / 'all'))
+
+    tmp_blocks = Convert(raw_path)
+    tmp_blocks.max_pings_in_memory = 4   # the range_bin length changes within a block
+    tmp_blocks.nmea_window = 2   # NMEA datagrams are recorded every second
+    tmp_blocks.raw2nc(save_path=str(tmp_path / 'blocks'))
+
+    part_names = sorted(os.listdir(str(tmp_path / 'all')))
+    assert len(part_names) == 2
+    assert sorted(os.listdir(str(tmp_path / 'blocks'))) == part_names
+    nmea_times = []
+    for part_name in part_names:
+        for group in ['Beam', 'Platform']:
+            with xr.open_dataset(str(tmp_path / 'all' / part_name), group=group) as ds_all, \
+                    xr.open_dataset(str(tmp_path / 'blocks' / part_name), group=group) as ds_blocks:
+                assert ds_all.identical(ds_blocks)
+        # each part file only gets the NMEA datagrams of its blocks
+        with xr.open_dataset(str(tmp_path / 'blocks' / part_name), group='Platform/NMEA') as ds_nmea, \
+                xr.open_dataset(str(tmp_path / 'blocks' / part_name), group='Platform') as ds_platform:
+            assert ds_nmea.time.min() > ds_platform.ping_time.min() - np.timedelta64(5, 's')
+            assert ds_nmea.time.max() < ds_platform.ping_time.max() + np.timedelta64(5, 's')
+            nmea_times.append(ds_nmea.time.values)
+    with xr.open_dataset(str(tmp_path / 'all' / part_names[0]), group='Platform/NMEA') as ds_all:
+        assert np.array_equal(np.unique(np.concatenate(nmea_times)), ds_all.time.values)
+
+    tmp_sub = Convert(raw_path)
+    tmp_sub.max_pings_in_memory = 4
+    with pytest.raises(ValueError):
+        tmp_sub.save('.nc', save_path=str(tmp_path / 'sub'), range_groups='subgroups')
+
+
+def test_convert_ek60_n_workers(tmp_path):
+    """Test converting multiple files in worker processes, with errors captured per file"""
+    raw_paths = [str(tmp_path / ('SYN-D20180211-T16402%d.raw' % n)) for n in range(3)]
+    for raw_path in raw_paths[:2]:
+        _write_ek60_raw(raw_path)
+    with open(raw_paths[2], 'wb') as f:
+        f.write(b'not a raw file')
+
+    tmp = Convert(raw_paths)
+    tmp.raw2nc(n_workers=2)
+    assert list(tmp.conversion_errors.keys()) == [raw_paths[2]]
+    assert not os.path.exists(tmp.nc_path[2])
+
+    tmp_serial = Convert(raw_paths[0])
+    tmp_serial.raw2nc(save_path=str(tmp_path / 'serial'))
+    for nc_path in tmp.nc_path[:2]:
+        with xr.open_dataset(nc_path, group='Beam') as ds_beam, \
+                xr.open_dataset(tmp_serial.nc_path, group='Beam') as ds_serial:
+            assert ds_beam.equals(ds_serial)
+
+
+def test_convert_ek60_ragged(ek60_syn_path, tmp_path):
+    """Test storing power and angles as contiguous ragged arrays and opening them as a cube"""
+    tmp_pad = Convert(ek60_syn_path)
+    tmp_pad.raw2nc(save_path=str(tmp_path / 'padded'))
+    tmp_rag = Convert(ek60_syn_path)
+    tmp_rag.raw2nc(ragged=True)
+
+    with xr.open_dataset(tmp_rag.nc_path, group='Beam') as ds_rag:
+        assert ds_rag.backscatter_r.dims == ('ping_time', 'sample')
+        assert ds_rag.sizes['sample'] == ds_rag.sample_count.sum()
+    e_data = EchoData(tmp_rag.nc_path)
+    with e_data.open_beam() as ds_cube, \
+            xr.open_dataset(tmp_pad.nc_path, group='Beam') as ds_pad:
+        assert ds_cube.backscatter_r.identical(ds_pad.backscatter_r)
+        assert ds_cube.angle_alongship.identical(ds_pad.angle_alongship)
+
+
+def test_convert_ek60_chunks(ek60_syn_path):
+    """Test chunking power along each dimension in netCDF and zarr files"""
+    tmp = Convert(ek60_syn_path)
+    tmp.raw2nc(chunks={'frequency': 1, 'ping_time': 7, 'range_bin': -1})
+    tmp.raw2zarr(chunks={'frequency': 1, 'ping_time': 7, 'range_bin': -1})
+    with xr.open_dataset(tmp.nc_path, group='Beam') as ds_nc:
+        n_range_bin = ds_nc.sizes['range_bin']
+        assert ds_nc.backscatter_r.encoding['chunksizes'] == (1, 7, n_range_bin)
+    with xr.open_zarr(tmp.zarr_path, group='Beam') as ds_zarr:
+        assert ds_zarr.backscatter_r.encoding['chunks'] == (1, 7, n_range_bin)
+
+    # Default chunks are aligned to the tiles of MVBS and noise estimation
+    assert tmp._get_chunks()['ping_time'] % np.lcm(tmp.MVBS_ping_size, tmp.noise_est_ping_size) == 0
+
+
+def test_convert_ek60_codec_profiles(ek60_syn_path, tmp_path):
+    """Test compressing power with a codec profile and benchmarking the profiles"""
+    tmp = Convert(ek60_syn_path)
+    tmp.raw2nc(compress='archive')
+    with xr.open_dataset(tmp.nc_path, group='Beam') as ds_beam:
+        assert ds_beam.backscatter_r.encoding['complevel'] == 9
+
+    results = benchmark_codecs(ek60_syn_path, file_formats=['.nc'], profiles=[False, 'fast'],
+                               save_dir=str(tmp_path))
+    assert [x['profile'] for x in results] == [False, 'fast']
+    assert results[1]['bytes_on_disk'] < results[0]['bytes_on_disk']
+
+
+@pytest.mark.parametrize('file_format', ['.nc', '.zarr'])
+def test_convert_ek60_flush(ek60_syn_path, file_format):
+    """Test all groups written to a file in one flush can be read back"""
+    tmp = Convert(ek60_syn_path)
+    tmp.save(file_format)
+    out_path = tmp.nc_path if file_format == '.nc' else tmp.zarr_path
+    open_kwargs = {'engine': 'netcdf4'} if file_format == '.nc' else {'engine': 'zarr', 'consolidated': True}
+
+    with xr.open_dataset(out_path, **open_kwargs) as ds_top:
+        assert ds_top.attrs['keywords'] == 'EK60'
+    for group in ['Environment', 'Provenance', 'Platform', 'Platform/NMEA', 'Sonar', 'Beam']:
+        with xr.open_dataset(out_path, group=group, **open_kwargs) as ds:
+            assert ds.variables or ds.attrs
+    with xr.open_dataset(out_path, group='Beam', **open_kwargs) as ds_beam:
+        assert np.allclose(ds_beam.backscatter_r, tmp.power_dict_split[0], equal_nan=True)
+    with xr.open_dataset(out_path, group='Platform/NMEA', **open_kwargs) as ds_nmea:
+        assert ds_nmea.time.size == 2 * len(tmp.ping_time)
+
+
+@pytest.mark.parametrize('file_format', ['.nc', '.zarr'])
+@pytest.mark.parametrize('range_switch', [None, 10])
+@pytest.mark.parametrize('max_pings_in_memory', [None, 7])
+def test_convert_ek60_existing_output(tmp_path, capsys, file_format, range_switch, max_pings_in_memory):
+    """Test existing output files, including range_bin part files, are only replaced when overwriting"""
+    raw_path = str(tmp_path / 'SYN-D20180211-T164025.raw')
+    _write_ek60_raw(raw_path, range_switch=range_switch)
+    save_path = str(tmp_path / 'out')
+    open_kwargs = {'engine': 'netcdf4'} if file_format == '.nc' else {'engine': 'zarr'}
+
+    def convert(**kwargs):
+        tmp = Convert(raw_path)
+        tmp.max_pings_in_memory = max_pings_in_memory
+        tmp.save(file_format, save_path=save_path, **kwargs)
+
+    def backscatter_dtypes():
+        dtypes = []
+        for out_name in out_names:
+            with xr.open_dataset(os.path.join(save_path, out_name), group='Beam', mask_and_scale=False,
+                                 **open_kwargs) as ds_beam:
+                dtypes.append(ds_beam.backscatter_r.dtype)
+        return dtypes
+
+    convert()
+    out_names = sorted(os.listdir(save_path))
+    assert len(out_names) == (1 if range_switch is None else 2)
+    capsys.readouterr()
+
+    # An existing output is not converted again
+    convert(pack_data=True)
+    assert 'already been converted' in capsys.readouterr().out
+    assert sorted(os.listdir(save_path)) == out_names
+    assert backscatter_dtypes() == [np.float64] * len(out_names)
+
+    # An existing output is replaced when overwriting
+    convert(pack_data=True, overwrite=True)
+    assert 'overwriting' in capsys.readouterr().out
+    assert sorted(os.listdir(save_path)) == out_names
+    assert backscatter_dtypes() == [np.int16] * len(out_names)
+
+
+def test_convert_ek60_range_groups(tmp_path):
+    """Test saving range_bin groups to separate files or to Beam subgroups of one file"""
+    raw_path = str(tmp_path / 'SYN-D20180211-T164025.raw')
+    _write_ek60_raw(raw_path, range_switch=10)
+    tmp_files = Convert(raw_path)
+    tmp_files.raw2nc()
+    part_paths = [os.path.splitext(tmp_files.nc_path)[0] + '_part%02d.nc' % (n + 1)
+                  for n in range(len(tmp_files.range_lengths))]
+    assert len(part_paths) == 2
+    assert all(os.path.exists(x) for x in part_paths)
+    assert not os.path.exists(tmp_files.nc_path)
+
+    tmp_sub = Convert(raw_path)
+    tmp_sub.save('.nc', save_path=str(tmp_path / 'subgroups'), range_groups='subgroups')
+    with xr.open_dataset(tmp_sub.nc_path, group='Platform') as ds_plat:
+        assert ds_plat.ping_time.size == len(tmp_sub.ping_time)
+    for n, part_path in enumerate(part_paths):
+        with xr.open_dataset(part_path, group='Beam') as ds_part, \
+                xr.open_dataset(tmp_sub.nc_path, group='Beam/range_group_%02d' % (n + 1)) as ds_sub:
+            assert ds_part.identical(ds_sub)
+
+
+def test_convert_ek60_to_datasets(ek60_syn_path):
+    """Test converting to in-memory Datasets and processing them without a file"""
+    datasets = Convert(ek60_syn_path).to_datasets()
+    assert os.listdir(os.path.dirname(ek60_syn_path)) == [os.path.basename(ek60_syn_path)]
+    tmp = Convert(ek60_syn_path)
+    tmp.raw2nc(compress=False)
+    with xr.open_dataset(tmp.nc_path, group='Beam') as ds_beam:
+        assert datasets['Beam'].identical(ds_beam.load())
+
+    e_data = EchoData(datasets)
+    assert e_data.range.identical(EchoData(tmp.nc_path).range)
@@ -105,3 +105,19 @@ def test_noise_estimates_removal():
     del e_data
     os.remove(nc_path)
     os.remove(Sv_path)
+
+
+def test_model_ek60_zarr(tmp_path):
+    """Check that a model opened from a zarr store matches one opened from a .nc file.
+    """
+    tmp = Convert(ek60_raw_path)
+    tmp.raw2nc(save_path=str(tmp_path))
+    tmp.raw2zarr(save_path=str(tmp_path))
+    assert os.path.exists(os.path.join(tmp.zarr_path, '.zmetadata'))
+
+    e_nc = EchoData(tmp.nc_path)
+    e_zarr = EchoData(tmp.zarr_path)
+    assert e_zarr.range.identical(e_nc.range)
+    assert e_zarr.seawater_absorption.identical(e_nc.seawater_absorption)
+    with e_nc.open_beam() as ds_nc, e_zarr.open_beam() as ds_zarr:
+        assert ds_zarr.load().identical(ds_nc.load())